@@ -1,6 +1,5 @@
 from langchain_core.language_models import BaseChatModel
 from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
 from typing import Dict, TypedDict, Annotated, Optional
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from langgraph.constants import START, END
@@ -8,6 +7,8 @@ from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 
+import os
+import sys
 import time
 from contextlib import contextmanager
 from datetime import datetime
@@ -423,7 +424,10 @@ if __name__ == "__main__":
         "model": "glm-4-air",  # 可以先使用 glm-4-flash\ glm-4-0520 \ glm-4-plus 做验证
         "temperature": 0.1,
     }
-    chat_model = ChatOpenAI(**big_model)
+    # 与 interaction/pythonic 共用模型客户端（model_client.py），按本文件的位置找到它，不依赖当前工作目录
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'interaction', 'pythonic'))
+    from model_client import create_chat_model
+    chat_model = create_chat_model(**big_model)
 
     from src.asset_valuation_review.entity_agent.sample import revise_report, final_report
 
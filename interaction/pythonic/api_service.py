@@ -1,8 +1,32 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from mservice import handle_query, generate_suggestions
+from typing import Any, Dict, List, Optional
+import json
+from mservice import (
+    aprocess_query,
+    ahandle_batch,
+    astream_query,
+    codegen_cache,
+    codegen_prompt,
+    tool_retriever,
+    TOOL_RETRIEVAL_TOP_K,
+    tool_cache,
+    tool_metrics,
+    model_router,
+    repair_metrics,
+    deadline_metrics,
+    prefetch_metrics,
+    suggestion_metrics,
+    suggestion_rules,
+    EXECUTION_BACKEND,
+    BATCH_MAX_CONCURRENCY,
+    get_sandbox_pool
+)
+from test_mservice import get_compile_cache_stats
+from model_client import client_factory
+from deadline import Deadline
 
 app = FastAPI(
     title="Pythonic Service API",
@@ -19,9 +43,24 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def start_sandbox_pool():
+    """使用沙箱执行生成代码时，服务启动时就预先启动并预热工作进程"""
+    if EXECUTION_BACKEND == 'sandbox':
+        get_sandbox_pool()
+
+
+@app.on_event("shutdown")
+async def close_model_clients():
+    """关闭模型客户端的连接池"""
+    client_factory.close()
+    await client_factory.aclose()
+
+
 class QueryRequest(BaseModel):
     query: str
     need_suggestion: bool = False  # 默认不生成建议
+    timeout: Optional[float] = None  # 超时时间（秒），默认使用服务的默认超时
 
 
 class QueryResponse(BaseModel):
@@ -29,6 +68,24 @@ class QueryResponse(BaseModel):
     response: str
     executed_functions: List[str]
     suggestion: Optional[str] = None  # 可选的建议字段
+    timed_out_stage: Optional[str] = None  # 超时的阶段：generation / execution / suggestion
+    partial_results: Optional[List[Dict[str, Any]]] = None  # 代码执行超时前已完成的工具调用结果
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    need_suggestion: bool = False
+    max_concurrency: int = BATCH_MAX_CONCURRENCY  # 同时进行的模型调用数量上限，不超过服务端的 BATCH_MAX_CONCURRENCY
+    timeout: Optional[float] = None  # 整个批次的超时时间（秒）
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]  # 与请求中的 queries 顺序一致
+    total_time: float  # 整个批次的耗时（毫秒）
+    sum_execution_time: float  # 各查询耗时之和（毫秒），与 total_time 对比可以看出并发收益
+    deduplicated_queries: int  # 重复而只处理了一次的查询数
+    tool_calls: int  # 实际执行的工具调用数
+    deduplicated_tool_calls: int  # 在查询之间复用结果的工具调用数
 
 
 @app.post("/api/query", response_model=QueryResponse)
@@ -46,19 +103,10 @@ async def process_query(request: QueryRequest) -> QueryResponse:
         HTTPException: 当处理查询出错时抛出
     """
     try:
-        execution_time, response, executed_functions = handle_query(request.query)
-
-        # 如果需要生成建议
-        suggestion = None
-        if request.need_suggestion:
-            suggestion = generate_suggestions(request.query, response)
-
-        return QueryResponse(
-            execution_time=execution_time,
-            response=response,
-            executed_functions=executed_functions,
-            suggestion=suggestion
-        )
+        # 模型调用与代码执行都不会阻塞事件循环，多个请求可以并发处理；
+        # 超过截止时间时返回已完成的部分结果，timed_out_stage 为超时的阶段
+        result = await aprocess_query(request.query, request.need_suggestion, Deadline(request.timeout))
+        return QueryResponse(**result)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -66,6 +114,84 @@ async def process_query(request: QueryRequest) -> QueryResponse:
         )
 
 
+@app.post("/api/query/batch", response_model=BatchQueryResponse)
+async def process_batch_query(request: BatchQueryRequest) -> BatchQueryResponse:
+    """
+    批量处理查询请求，模型调用受 max_concurrency 限制并发执行，相同的工具调用在查询之间去重
+    
+    Args:
+        request: 包含多个查询文本的请求体
+        
+    Returns:
+        每个查询的结果和整体耗时统计
+        
+    Raises:
+        HTTPException: 当处理查询出错时抛出
+    """
+    try:
+        batch = await ahandle_batch(request.queries, request.need_suggestion, request.max_concurrency,
+                                    request.timeout)
+        return BatchQueryResponse(
+            results=[QueryResponse(**result) for result in batch["results"]],
+            total_time=batch["total_time"],
+            sum_execution_time=batch["sum_execution_time"],
+            deduplicated_queries=batch["deduplicated_queries"],
+            tool_calls=batch["tool_calls"],
+            deduplicated_tool_calls=batch["deduplicated_tool_calls"]
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"处理批量查询时出错: {str(e)}"
+        )
+
+
+@app.post("/api/query/stream")
+async def stream_query(request: QueryRequest) -> StreamingResponse:
+    """
+    流式处理用户的自然语言查询请求
+    
+    以 NDJSON（每行一个 JSON 事件）返回：模型生成代码的增量文本、代码就绪、每个函数的执行结果、
+    最终响应以及可选的建议，事件类型见 mservice.astream_query
+    
+    Args:
+        request: 包含查询文本的请求体
+        
+    Returns:
+        application/x-ndjson 格式的流式响应
+    """
+    async def event_stream():
+        async for event in astream_query(request.query, request.need_suggestion, request.timeout):
+            yield json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """返回服务内部缓存等运行统计信息"""
+    stats = {
+        "codegen_cache": codegen_cache.get_stats(),
+        "compile_cache": get_compile_cache_stats(),
+        "tool_cache": tool_cache.get_stats(),
+        "tool_metrics": tool_metrics.get_stats(),
+        "prompt_prefix": codegen_prompt.get_stats(),
+        "model_client": client_factory.get_stats(),
+        "code_repair": repair_metrics.get_stats(),
+        "deadlines": deadline_metrics.get_stats(),
+        "tool_prefetch": prefetch_metrics.get_stats(),
+        "speculative_suggestion": suggestion_metrics.get_stats(),
+        "suggestion_rules": suggestion_rules.get_stats()
+    }
+    if model_router is not None:
+        stats["model_router"] = model_router.get_stats()
+    if TOOL_RETRIEVAL_TOP_K > 0:
+        stats["tool_retrieval"] = tool_retriever.get_stats()
+    if EXECUTION_BACKEND == 'sandbox':
+        stats["sandbox"] = get_sandbox_pool().get_stats()
+    return stats
+
+
 @app.get("/ping")
 async def ping():
     """用于健康检查的ping接口"""
@@ -0,0 +1,84 @@
+"""
+前缀缓存的首 token 延迟对比
+
+分别用两种提示词布局请求代码生成模型，测量首 token 延迟（TTFT）：
+- stable: 函数定义等固定内容在前、用户查询在最后（mservice 当前的布局），前缀每次都相同
+- unstable: 用户查询放在最前面，每个请求的前缀都不同，后端无法复用前缀缓存
+
+只有后端开启了前缀缓存（例如 vLLM 的 --enable-prefix-caching）时两者才会有明显差别。
+
+用法: python benchmark_prefix_cache.py [每种布局的请求轮数]
+"""
+import sys
+import time
+from typing import Dict, List
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from model import chat
+from mservice import codegen_prompt, test_queries
+from tool_metrics import percentile
+
+
+def stable_messages(query: str) -> list:
+    return codegen_prompt.build_messages(query)
+
+
+def unstable_messages(query: str) -> list:
+    return [
+        SystemMessage(content=codegen_prompt.system_message),
+        HumanMessage(content=f"用户查询：{query}\n\n{codegen_prompt.prefix}")
+    ]
+
+
+def measure_ttft(messages: list) -> float:
+    """发送流式请求，返回收到第一个非空分块的耗时（毫秒），之后直接断开"""
+    start_time = time.perf_counter()
+    for chunk in chat.stream(messages):
+        if chunk.content:
+            break
+    return (time.perf_counter() - start_time) * 1000
+
+
+def run_benchmark(rounds: int = 1) -> Dict[str, List[float]]:
+    """
+    交替发送两种布局的请求，避免后端负载变化只影响其中一种
+
+    Args:
+        rounds: 每条测试查询在每种布局下请求的次数
+
+    Returns:
+        每种布局的首 token 延迟列表（毫秒）
+    """
+    layouts = {'stable': stable_messages, 'unstable': unstable_messages}
+    results: Dict[str, List[float]] = {name: [] for name in layouts}
+
+    # 预热：让稳定前缀进入后端缓存，同时排除建立连接的开销
+    measure_ttft(stable_messages(test_queries[0]))
+
+    for round_index in range(rounds):
+        for query in test_queries:
+            for name, build in layouts.items():
+                # 每轮给查询加上轮次标记，unstable 布局不会因为重复请求而命中整条提示词的缓存
+                ttft = measure_ttft(build(f"{query}（{round_index}）"))
+                results[name].append(ttft)
+                print(f"[{name}] {ttft:.0f}ms {query[:20]}")
+
+    return results
+
+
+def print_results(results: Dict[str, List[float]]) -> None:
+    print("\n" + "=" * 50)
+    print(f"前缀长度: {codegen_prompt.get_stats()['prefix_chars']}字符")
+    for name, samples in results.items():
+        print(f"{name}: 请求数 {len(samples)}，平均 {sum(samples) / len(samples):.0f}ms，"
+              f"P50 {percentile(samples, 50):.0f}ms，P95 {percentile(samples, 95):.0f}ms")
+    stable_p50 = percentile(results['stable'], 50)
+    unstable_p50 = percentile(results['unstable'], 50)
+    if unstable_p50:
+        print(f"稳定前缀的 P50 首 token 延迟是不稳定前缀的 {stable_p50 / unstable_p50 * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    print_results(run_benchmark(rounds))
@@ -0,0 +1,265 @@
+"""
+生成代码的静态分析
+
+对生成的代码只解析一次 AST，提取其中真正的工具函数调用位置、可以静态确定的参数取值以及调用次数。
+注释、字符串里出现的函数名不算调用。分析结果按代码内容缓存，代码验证和工具调用预取共用同一份结果。
+"""
+import ast
+import builtins
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# 无法静态求值的标记
+UNRESOLVED = object()
+
+ANALYSIS_CACHE_MAX_SIZE = 256
+
+
+class CallSite(NamedTuple):
+    """代码中的一处工具函数调用"""
+    name: str
+    lineno: int  # 在生成代码中的行号（从 1 开始）
+    col_offset: int
+    args: Optional[tuple]  # 静态求值后的位置参数，无法确定的参数为 UNRESOLVED；含 *args 时为 None
+    kwargs: Optional[dict]  # 静态求值后的关键字参数；含 **kwargs 时为 None
+    unconditional: bool = False  # 是否位于顶层顺序执行的语句中（不在分支、循环、try、函数定义等之中），代码执行时一定会调用
+
+    @property
+    def resolved(self) -> bool:
+        """参数是否都可以静态确定（不依赖运行时的值）"""
+        if self.args is None or self.kwargs is None:
+            return False
+        return all(value is not UNRESOLVED for value in self.args + tuple(self.kwargs.values()))
+
+
+class CodeAnalysis(NamedTuple):
+    """生成代码的分析结果"""
+    calls: List[CallSite]  # 按在代码中出现的顺序排列
+    call_counts: Dict[str, int]  # 每个工具函数的调用位置数量（循环中的调用只计一次）
+    rebound_names: frozenset  # 被代码重新定义过的工具函数名（此时它们不是工具函数）
+    syntax_error: Optional[str]
+
+    @property
+    def called_functions(self) -> List[str]:
+        """代码中调用到的工具函数，按首次出现的顺序排列"""
+        return list(self.call_counts)
+
+
+_analysis_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], CodeAnalysis]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+def parse_generated_code(code: str) -> ast.Module:
+    """按 execute_code 的方式包装代码后解析（生成的代码里可能直接出现顶层 return）"""
+    wrapped_code = f"""
+def _execute():
+{chr(10).join('    ' + line for line in code.split(chr(10)))}
+"""
+    return ast.parse(wrapped_code)
+
+
+def collect_constants(tree: ast.AST) -> Tuple[Dict[str, Any], set]:
+    """
+    收集可以静态确定取值的变量
+
+    Args:
+        tree: 代码的语法树
+
+    Returns:
+        (只被赋值过一次且值为字面量的变量字典, 代码中被绑定过的名字集合)
+    """
+    bind_counts: Dict[str, int] = {}
+    literal_values: Dict[str, Any] = {}
+
+    def bind(name: str) -> None:
+        bind_counts[name] = bind_counts.get(name, 0) + 1
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bind(node.id)
+        elif isinstance(node, ast.arg):
+            # 函数参数的取值在运行时才能确定
+            bind(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bind(node.name)
+        elif isinstance(node, ast.alias):
+            bind(node.asname or node.name.split('.')[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            for name in node.names:
+                bind(name)
+
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                literal_values[node.targets[0].id] = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                pass
+
+    constants = {name: value for name, value in literal_values.items() if bind_counts.get(name) == 1}
+    return constants, set(bind_counts)
+
+
+def resolve(node: ast.AST, constants: Dict[str, Any]) -> Any:
+    """静态求值调用参数，无法确定时返回 UNRESOLVED"""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants.get(node.id, UNRESOLVED)
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        items = [resolve(item, constants) for item in node.elts]
+        if any(item is UNRESOLVED for item in items):
+            return UNRESOLVED
+        if isinstance(node, ast.List):
+            return items
+        return tuple(items) if isinstance(node, ast.Tuple) else set(items)
+    if isinstance(node, ast.Dict):
+        if None in node.keys:  # {**other}
+            return UNRESOLVED
+        keys = [resolve(key, constants) for key in node.keys]
+        values = [resolve(value, constants) for value in node.values]
+        if any(item is UNRESOLVED for item in keys + values):
+            return UNRESOLVED
+        return dict(zip(keys, values))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = resolve(node.operand, constants)
+        if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+            return -operand if isinstance(node.op, ast.USub) else operand
+    return UNRESOLVED
+
+
+# 顶层顺序执行的简单语句，其中的调用一定会执行（除非前面的语句抛出异常）
+STRAIGHT_LINE_STATEMENTS = (ast.Expr, ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Return)
+
+
+def _collect_unconditional_calls(node: ast.AST, calls: set) -> None:
+    """收集表达式中一定会求值的调用，跳过条件表达式的分支、短路求值的后续操作数、推导式和 lambda"""
+    if isinstance(node, (ast.Lambda, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return
+    if isinstance(node, ast.IfExp):
+        _collect_unconditional_calls(node.test, calls)
+        return
+    if isinstance(node, ast.BoolOp):
+        _collect_unconditional_calls(node.values[0], calls)
+        return
+    if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+        _collect_unconditional_calls(node.generators[0].iter, calls)
+        return
+    if isinstance(node, ast.Call):
+        calls.add(node)
+    for child in ast.iter_child_nodes(node):
+        _collect_unconditional_calls(child, calls)
+
+
+def _may_exit(node: ast.AST) -> bool:
+    """语句中是否有 return/raise（不算嵌套函数定义中的），之后的顶层语句可能不会执行"""
+    if isinstance(node, (ast.Return, ast.Raise)):
+        return True
+    if isinstance(node, (ast.Lambda, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return False
+    return any(_may_exit(child) for child in ast.iter_child_nodes(node))
+
+
+def unconditional_calls(tree: ast.Module) -> set:
+    """
+    找出代码执行时一定会调用的调用节点
+
+    只包括顶层顺序执行的简单语句中的调用；遇到可能提前返回或抛出异常的语句后，后面的语句都不算
+    """
+    calls = set()
+    for statement in tree.body[0].body:  # parse_generated_code 包装出的 _execute 函数体
+        if isinstance(statement, STRAIGHT_LINE_STATEMENTS):
+            _collect_unconditional_calls(statement, calls)
+        if _may_exit(statement):
+            break
+    return calls
+
+
+def _analyze(code: str, function_names: Tuple[str, ...]) -> CodeAnalysis:
+    try:
+        tree = parse_generated_code(code)
+    except SyntaxError as e:
+        return CodeAnalysis([], {}, frozenset(), str(e))
+
+    constants, bound_names = collect_constants(tree)
+    rebound_names = frozenset(set(function_names) & bound_names)
+    candidates = set(function_names) - rebound_names
+
+    call_nodes = [
+        node for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in candidates
+    ]
+    # ast.walk 是广度优先的，按源码位置排序后与代码中的调用顺序一致
+    call_nodes.sort(key=lambda node: (node.lineno, node.col_offset))
+    unconditional = unconditional_calls(tree)
+
+    calls = []
+    call_counts: Dict[str, int] = {}
+    for node in call_nodes:
+        if any(isinstance(arg, ast.Starred) for arg in node.args):
+            args = None
+        else:
+            args = tuple(resolve(arg, constants) for arg in node.args)
+        if any(kw.arg is None for kw in node.keywords):
+            kwargs = None
+        else:
+            kwargs = {kw.arg: resolve(kw.value, constants) for kw in node.keywords}
+        # 包装后的代码多了开头的空行和函数定义行，每行多 4 个空格缩进
+        calls.append(CallSite(node.func.id, node.lineno - 2, node.col_offset - 4, args, kwargs,
+                              node in unconditional))
+        call_counts[node.func.id] = call_counts.get(node.func.id, 0) + 1
+
+    return CodeAnalysis(calls, call_counts, rebound_names, None)
+
+
+def unknown_calls(code: str, known_names: Iterable[str]) -> List[str]:
+    """
+    找出代码中调用的未定义函数：不在 known_names 中，不是内置函数，代码中也没有定义或赋值过
+
+    Args:
+        code: 生成的代码
+        known_names: 执行环境中可用的名字（工具函数等）
+
+    Returns:
+        函数名列表，按在代码中首次出现的顺序排列；代码有语法错误时返回空列表
+    """
+    try:
+        tree = parse_generated_code(code)
+    except SyntaxError:
+        return []
+    _, bound_names = collect_constants(tree)
+    known = set(known_names) | bound_names | set(dir(builtins))
+    call_nodes = [
+        node for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id not in known
+    ]
+    call_nodes.sort(key=lambda node: (node.lineno, node.col_offset))
+    return list(dict.fromkeys(node.func.id for node in call_nodes))
+
+
+def analyze_calls(code: str, function_names: Iterable[str]) -> CodeAnalysis:
+    """
+    分析生成代码中的工具函数调用，结果按 (代码, 函数列表) 缓存
+
+    Args:
+        code: 生成的代码
+        function_names: 工具函数名列表
+
+    Returns:
+        CodeAnalysis，代码有语法错误时 syntax_error 为错误信息（此时不缓存）
+    """
+    function_names = tuple(sorted(set(function_names)))
+    key = (hashlib.sha256(code.encode('utf-8')).hexdigest(), function_names)
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+            return analysis
+
+    analysis = _analyze(code, function_names)
+    if analysis.syntax_error is None:
+        with _analysis_cache_lock:
+            _analysis_cache[key] = analysis
+            while len(_analysis_cache) > ANALYSIS_CACHE_MAX_SIZE:
+                _analysis_cache.popitem(last=False)
+    return analysis
@@ -0,0 +1,175 @@
+"""
+生成代码失败后的修复重试
+
+模型生成的代码验证不通过，或者执行时报错（比如 strptime 的格式串写错），原先直接返回错误，整次模型调用白白浪费。
+这里把错误信息和上一次的代码发回给模型让它修正，修复次数和时间都有上限：
+- 最多修复 REPAIR_MAX_ATTEMPTS 次
+- 生成 + 修复的总时间不超过 REPAIR_BUDGET 秒；剩余时间不够再来一次（按之前最慢一次尝试的耗时估计）时提前停止
+- 执行阶段出错且代码调用了有副作用的函数时不修复，避免重复执行写操作
+
+修复消息接在原始提示词之后（原始提示词 + 上一次的回答 + 错误信息），原始提示词的前缀缓存仍然有效。
+
+RepairMetrics 统计每次尝试的耗时、第几次尝试成功，以及因时间、次数用完而放弃的查询数。
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.schema import AIMessage, HumanMessage
+
+# 最多修复的次数（不含第一次生成），0 表示不修复
+REPAIR_MAX_ATTEMPTS = int(os.getenv('PYTHONIC_REPAIR_MAX_ATTEMPTS', '2'))
+# 单个查询生成和修复代码的总时间预算（秒）
+REPAIR_BUDGET = float(os.getenv('PYTHONIC_REPAIR_BUDGET', '30'))
+
+REPAIR_PROMPT = """上面的代码在{stage}阶段出错：
+{error}
+
+请修正代码后重新输出完整代码，仍然只能调用上面提供的函数，输出格式与之前的要求相同。"""
+
+STAGE_NAMES = {'validation': '验证', 'execution': '执行'}
+
+
+class RepairBudget:
+    """
+    单个查询的修复预算，记录每次尝试的耗时和错误
+
+    Example:
+        budget = RepairBudget()
+        while True:
+            ...生成并执行代码...
+            budget.record(generation_time, execution_time, error, stage)
+            if error is None or not budget.can_repair():
+                break
+            messages = budget.repair_messages(messages, response.content)
+    """
+
+    def __init__(self, max_repairs: int = REPAIR_MAX_ATTEMPTS, budget: float = REPAIR_BUDGET,
+                 deadline: Optional[float] = None):
+        """
+        Args:
+            max_repairs: 最多修复的次数
+            budget: 总时间预算（秒）
+            deadline: 可选，外部的截止时间（time.time() 时间戳），与时间预算取较早者
+        """
+        self.max_repairs = max_repairs
+        self.deadline = time.time() + budget
+        if deadline is not None:
+            self.deadline = min(self.deadline, deadline)
+        self.attempts: List[Dict[str, Any]] = []
+        self.stop_reason: Optional[str] = None  # attempts / budget / side_effect
+
+    def record(self, generation_time: float, execution_time: float,
+               error: Optional[BaseException] = None, stage: Optional[str] = None) -> None:
+        """
+        记录一次尝试
+
+        Args:
+            generation_time: 模型生成代码的耗时（秒）
+            execution_time: 验证和执行代码的耗时（秒）
+            error: 出错时的异常
+            stage: 出错的阶段，validation 或 execution
+        """
+        self.attempts.append({
+            'generation_time': generation_time,
+            'execution_time': execution_time,
+            'error': None if error is None else str(error),
+            'stage': stage
+        })
+
+    def remaining(self) -> float:
+        return self.deadline - time.time()
+
+    def can_repair(self, has_side_effects: bool = False) -> bool:
+        """
+        上一次尝试失败后，判断是否还要让模型修复
+
+        Args:
+            has_side_effects: 代码是否调用了有副作用的函数（执行阶段出错时已经执行过的写操作不能重复执行）
+        """
+        last = self.attempts[-1]
+        if last['stage'] == 'execution' and has_side_effects:
+            self.stop_reason = 'side_effect'
+        elif len(self.attempts) > self.max_repairs:
+            self.stop_reason = 'attempts'
+        elif self.remaining() < max(item['generation_time'] + item['execution_time'] for item in self.attempts):
+            self.stop_reason = 'budget'
+        else:
+            return True
+        print(f"放弃修复（{self.stop_reason}），已尝试 {len(self.attempts)} 次，剩余时间 {max(self.remaining(), 0):.1f}秒")
+        return False
+
+    def repair_messages(self, messages: list, previous_response: str) -> list:
+        """
+        构造修复请求的消息：原始消息 + 上一次的回答 + 错误信息
+
+        Args:
+            messages: 原始的代码生成消息（不包含之前的修复消息）
+            previous_response: 上一次模型回答的完整文本
+        """
+        last = self.attempts[-1]
+        print(f"第 {len(self.attempts)} 次生成的代码{STAGE_NAMES.get(last['stage'], '')}失败，请模型修复: {last['error']}")
+        return messages + [
+            AIMessage(content=previous_response),
+            HumanMessage(content=REPAIR_PROMPT.format(stage=STAGE_NAMES.get(last['stage'], ''), error=last['error']))
+        ]
+
+
+class RepairMetrics:
+    """修复重试的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            'queries': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'success_after': {},  # 第 n 次尝试成功的查询数（1 为第一次就成功）
+            'stop_reasons': {},  # 最终失败的查询放弃修复的原因
+            'attempt_time': {},  # 第 n 次尝试的 [次数, 生成总耗时, 执行总耗时]
+            'failed_attempt_time': 0.0  # 失败尝试花费的总时间（秒）
+        }
+
+    def record(self, budget: RepairBudget, success: bool) -> None:
+        """记录一个查询所有尝试的结果"""
+        with self._lock:
+            self.stats['queries'] += 1
+            if success:
+                self.stats['succeeded'] += 1
+                attempts = str(len(budget.attempts))
+                self.stats['success_after'][attempts] = self.stats['success_after'].get(attempts, 0) + 1
+            else:
+                self.stats['failed'] += 1
+                reason = budget.stop_reason or 'unknown'
+                self.stats['stop_reasons'][reason] = self.stats['stop_reasons'].get(reason, 0) + 1
+            for index, attempt in enumerate(budget.attempts, 1):
+                timing = self.stats['attempt_time'].setdefault(str(index), [0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += attempt['generation_time']
+                timing[2] += attempt['execution_time']
+                if attempt['error'] is not None:
+                    self.stats['failed_attempt_time'] += attempt['generation_time'] + attempt['execution_time']
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回成功率、修复挽回的查询数和每次尝试的平均耗时（毫秒）"""
+        with self._lock:
+            stats = {
+                'queries': self.stats['queries'],
+                'succeeded': self.stats['succeeded'],
+                'failed': self.stats['failed'],
+                'success_after': dict(self.stats['success_after']),
+                'stop_reasons': dict(self.stats['stop_reasons']),
+                'failed_attempt_time': self.stats['failed_attempt_time'] * 1000,
+                'attempts': {
+                    index: {
+                        'count': count,
+                        'avg_generation_time': generation / count * 1000,
+                        'avg_execution_time': execution / count * 1000
+                    }
+                    for index, (count, generation, execution) in self.stats['attempt_time'].items()
+                }
+            }
+        stats['success_rate'] = stats['succeeded'] / stats['queries'] if stats['queries'] else 0.0
+        stats['repaired'] = stats['succeeded'] - stats['success_after'].get('1', 0)
+        return stats
@@ -0,0 +1,250 @@
+"""
+代码生成结果缓存
+
+很多查询只有实体（手机号、日期、城市、乘客数）不同，例如"帮我看看13800138000的余额"和
+"帮我看看13900139000的余额"。这里把查询中的实体替换成占位符作为缓存键，把生成代码中对应的
+字面量也替换成占位符保存为模板；命中时把新查询的实体重新绑定到模板上，直接跳过模型调用。
+"""
+import ast
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from code_analysis import parse_generated_code
+
+# 城市名称（航空订票场景），长的名称优先匹配
+CITY_NAMES = [
+    '北京', '上海', '广州', '深圳', '成都', '杭州', '厦门', '重庆', '武汉', '南京', '天津', '西安',
+    '长沙', '昆明', '贵阳', '济南', '青岛', '哈尔滨', '大连', '郑州', '福州', '长春', '沈阳', '兰州',
+    '西宁', '南宁', '桂林', '温州', '合肥', '太原', '海口', '三亚', '南昌', '徐州', '宁波', '珠海',
+    '苏州', '无锡', '石家庄', '呼和浩特', '乌鲁木齐', '拉萨', '银川', '烟台', '泉州', '汕头'
+]
+
+CHINESE_NUMBERS = {'一': 1, '两': 2, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+
+# 实体槽位：(槽位类型, 正则, 取值转换)。字符串槽位在代码中以字符串字面量出现，整数槽位以整数字面量出现
+SLOT_PATTERNS = [
+    ('PHONE', re.compile(r'(?<!\d)1[3-9]\d{9}(?!\d)'), str),
+    ('DATE', re.compile(r'(?<!\d)\d{4}-\d{2}-\d{2}(?!\d)'), str),
+    ('CITY', re.compile('|'.join(sorted(CITY_NAMES, key=len, reverse=True))), str),
+    ('PASSENGERS', re.compile(r'(?<![\d年月号])(\d{1,2}|[一两二三四五六七八九])\s*(?=个人|人|位)'),
+     lambda value: int(value) if value.isdigit() else CHINESE_NUMBERS[value]),
+]
+
+# 代码中出现这些格式的字面量却不来自查询时（例如模型照抄了示例里的手机号），模板不安全
+_CODE_LITERAL_PATTERNS = {
+    slot_type: pattern for slot_type, pattern, _ in SLOT_PATTERNS if slot_type in ('PHONE', 'DATE')
+}
+
+_PUNCTUATION_TABLE = str.maketrans('，。！？：；（）', ',.!?:;()')
+
+
+def normalize_query(query: str) -> Tuple[str, List[Tuple[str, Any]]]:
+    """
+    把查询中的实体替换为占位符
+
+    Args:
+        query: 用户查询文本
+
+    Returns:
+        (归一化后的查询, 槽位列表[(槽位名, 取值)])，槽位名形如 PHONE_0
+    """
+    text = re.sub(r'\s+', '', query).translate(_PUNCTUATION_TABLE)
+    slots: List[Tuple[str, Any]] = []
+
+    for slot_type, pattern, convert in SLOT_PATTERNS:
+        values: List[Any] = []
+
+        def replace(match: re.Match) -> str:
+            value = convert(match.group(match.lastindex or 0))
+            if value not in values:
+                values.append(value)
+                slots.append((f"{slot_type}_{len(values) - 1}", value))
+            return f"<{slot_type}_{values.index(value)}>"
+
+        text = pattern.sub(replace, text)
+
+    return text, slots
+
+
+def _placeholder(slot_name: str) -> str:
+    return f"__SLOT_{slot_name}__"
+
+
+def make_template(code: str, slots: List[Tuple[str, Any]], function_names: Iterable[str]) -> Optional[str]:
+    """
+    把生成代码中来自查询的实体替换成占位符
+
+    只有每个槽位都能在代码中准确定位时才生成模板，否则返回 None（该结果不缓存）：
+    - 字符串槽位必须出现在某个字符串字面量中
+    - 整数槽位只能作为工具函数的调用参数出现，出现在其他位置（比如 range(2)、timedelta(days=2)）时无法区分含义
+    """
+    try:
+        tree = parse_generated_code(code)
+    except SyntaxError:
+        return None
+
+    string_constants = [node.value for node in ast.walk(tree)
+                        if isinstance(node, ast.Constant) and isinstance(node.value, str)]
+    slot_values = {value for _, value in slots}
+
+    # 代码里出现了查询中没有的手机号、日期
+    for slot_type, pattern in _CODE_LITERAL_PATTERNS.items():
+        for text in string_constants:
+            if any(value not in slot_values for value in pattern.findall(text)):
+                return None
+
+    function_names = set(function_names)
+    tool_arguments = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in function_names:
+            tool_arguments.update(id(arg) for arg in node.args)
+            tool_arguments.update(id(kw.value) for kw in node.keywords)
+
+    lines = code.split('\n')
+    int_spans: List[Tuple[int, int, int, str]] = []  # (行号, 起始列, 结束列, 占位符)
+    for slot_name, value in slots:
+        if isinstance(value, str):
+            if not any(value in text for text in string_constants):
+                return None
+            continue
+
+        found = False
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Constant) and type(node.value) is int and node.value == value):
+                continue
+            if id(node) not in tool_arguments or node.lineno != node.end_lineno:
+                return None
+            # parse_generated_code 包装后的代码多了开头的空行和函数定义行，每行多 4 个空格缩进；
+            # AST 的列号是 UTF-8 字节偏移
+            line_index = node.lineno - 3
+            line_bytes = lines[line_index].encode('utf-8')
+            start = len(line_bytes[:node.col_offset - 4].decode('utf-8'))
+            end = len(line_bytes[:node.end_col_offset - 4].decode('utf-8'))
+            int_spans.append((line_index, start, end, _placeholder(slot_name)))
+            found = True
+        if not found:
+            return None
+
+    # 从后往前替换，避免前面的替换影响后面的列号
+    for line_index, start, end, placeholder in sorted(int_spans, reverse=True):
+        line = lines[line_index]
+        lines[line_index] = line[:start] + placeholder + line[end:]
+    template = '\n'.join(lines)
+
+    # 长的取值先替换，避免一个取值是另一个取值的子串时被部分替换
+    for slot_name, value in sorted(slots, key=lambda slot: len(str(slot[1])), reverse=True):
+        if isinstance(value, str):
+            template = template.replace(value, _placeholder(slot_name))
+
+    return template
+
+
+def bind_template(template: str, slots: List[Tuple[str, Any]]) -> str:
+    """把新查询的实体取值绑定到模板上"""
+    code = template
+    for slot_name, value in slots:
+        code = code.replace(_placeholder(slot_name), str(value))
+    return code
+
+
+class CodeGenCache:
+    """
+    按归一化查询缓存生成代码模板，支持 LRU 淘汰和过期时间
+    """
+
+    def __init__(self, function_names: Iterable[str], max_size: int = 512, ttl: float = 3600):
+        """
+        Args:
+            function_names: 工具函数名列表，用于定位作为调用参数出现的整数槽位
+            max_size: 最多缓存的模板数量，超过后淘汰最久未使用的
+            ttl: 模板的有效期（秒）
+        """
+        self.function_names = list(function_names)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'rejected': 0,  # 无法安全模板化而未缓存的结果
+            'evictions': 0,
+            'expired': 0,
+            'invalidated': 0  # 执行失败而删除的模板
+        }
+
+    def get(self, query: str) -> Optional[str]:
+        """
+        查找缓存的代码
+
+        Args:
+            query: 用户查询文本
+
+        Returns:
+            绑定了当前查询实体的代码，未命中时返回 None
+        """
+        key, slots = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return bind_template(entry[1], slots)
+
+    def put(self, query: str, code: str) -> bool:
+        """
+        缓存查询对应的生成代码（应只缓存验证并执行成功的代码）
+
+        Returns:
+            是否成功缓存
+        """
+        key, slots = normalize_query(query)
+        template = make_template(code, slots, self.function_names)
+        with self._lock:
+            if template is None:
+                self.stats['rejected'] += 1
+                return False
+            self._entries[key] = (time.time(), template)
+            self._entries.move_to_end(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return True
+
+    def invalidate(self, query: str) -> bool:
+        """
+        删除查询对应的模板（绑定后的代码执行失败时调用，之后的同类查询重新调用模型生成）
+
+        Returns:
+            是否删除了模板
+        """
+        key, _ = normalize_query(query)
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self.stats['invalidated'] += 1
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息，包括命中率和当前大小"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,139 @@
+"""
+请求的端到端截止时间
+
+一个查询依次经过代码生成（模型调用）、代码执行（工具调用）和建议生成三个阶段，任何一步卡住都会一直占着服务的
+工作协程。Deadline 在请求开始时确定截止时间，随请求传到每个阶段：
+- 异步等待（模型调用、线程池中的代码执行、建议生成）通过 Deadline.run 限时，超时后取消等待（模型请求随之断开），
+  流式输出通过 Deadline.iterate 对每个分块限时
+- 代码执行在线程中进行，无法强行中止；Deadline.wrap 包装工具函数，截止时间过后的工具调用直接抛出
+  DeadlineExceeded，被放弃的代码执行在下一次工具调用时结束
+- 各阶段开始前用 Deadline.check 检查，时间用完时不再开始新的阶段
+
+超时的阶段记录在 DeadlineExceeded.stage 中，调用方据此返回已经拿到的部分结果。DeadlineExceeded 与
+asyncio.CancelledError 一样继承 BaseException：生成的代码经常用 try/except Exception 包住工具调用，
+继承 Exception 时超时会被代码吞掉、继续执行下去。
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+# 服务默认的请求超时（秒），请求可以单独指定，但不超过 MAX_REQUEST_TIMEOUT
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv('PYTHONIC_REQUEST_TIMEOUT', '60'))
+MAX_REQUEST_TIMEOUT = float(os.getenv('PYTHONIC_MAX_REQUEST_TIMEOUT', '300'))
+
+STAGES = ('generation', 'execution', 'suggestion')
+STAGE_NAMES = {'generation': '代码生成', 'execution': '代码执行', 'suggestion': '建议生成'}
+
+
+class DeadlineExceeded(BaseException):
+    """请求在某个阶段超过了截止时间（继承 BaseException，不会被 except Exception 捕获）"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{STAGE_NAMES.get(stage, stage)}阶段超时")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    请求的截止时间
+
+    Example:
+        deadline = Deadline(request.timeout)
+        response = await deadline.run(chat.ainvoke(messages), 'generation')
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Args:
+            timeout: 超时时间（秒），默认 DEFAULT_REQUEST_TIMEOUT，超过 MAX_REQUEST_TIMEOUT 时按 MAX_REQUEST_TIMEOUT
+        """
+        timeout = DEFAULT_REQUEST_TIMEOUT if timeout is None else timeout
+        self.timeout = min(max(timeout, 0.0), MAX_REQUEST_TIMEOUT)
+        self.expires_at = time.time() + self.timeout
+
+    def remaining(self) -> float:
+        """剩余时间（秒），已过期时为 0"""
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def check(self, stage: str) -> None:
+        """截止时间已过时抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    async def run(self, awaitable: Awaitable, stage: str) -> Any:
+        """
+        在剩余时间内等待 awaitable 完成，超时后取消它
+
+        Raises:
+            DeadlineExceeded: 截止时间已过或等待超时
+        """
+        if self.expired():
+            # 没有被等待的协程需要关闭，避免 "coroutine was never awaited" 警告
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            elif isinstance(awaitable, asyncio.Future):
+                awaitable.cancel()
+            raise DeadlineExceeded(stage)
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage) from None
+
+    async def iterate(self, iterable: AsyncIterable, stage: str) -> AsyncIterator:
+        """
+        逐个产出异步迭代器（比如模型的流式输出）的元素，每次等待都受截止时间限制，超时后关闭迭代器
+
+        Raises:
+            DeadlineExceeded: 等待下一个元素时超过截止时间
+        """
+        iterator = iterable.__aiter__()
+        try:
+            while True:
+                try:
+                    item = await self.run(iterator.__anext__(), stage)
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+    def wrap(self, functions: Dict[str, Callable], stage: str = 'execution') -> Dict[str, Callable]:
+        """包装工具函数，截止时间过后再调用时抛出 DeadlineExceeded"""
+        def wrap_function(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                self.check(stage)
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        return {name: wrap_function(func) for name, func in functions.items()}
+
+
+class DeadlineMetrics:
+    """各阶段超时次数的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'timed_out': 0, **{stage: 0 for stage in STAGES}}
+
+    def record(self, timed_out_stage: Optional[str]) -> None:
+        with self._lock:
+            self.stats['requests'] += 1
+            if timed_out_stage is not None:
+                self.stats['timed_out'] += 1
+                self.stats[timed_out_stage] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['timeout_rate'] = stats['timed_out'] / stats['requests'] if stats['requests'] else 0.0
+        stats['default_timeout'] = DEFAULT_REQUEST_TIMEOUT
+        return stats
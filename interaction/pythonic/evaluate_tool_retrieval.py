@@ -0,0 +1,92 @@
+"""
+工具检索效果评估
+
+用标注了所需函数的查询评估 tool_retrieval 在不同 top_k 下的召回率，以及提示词中函数定义的 token 缩减比例。
+不需要调用模型。
+
+用法: python evaluate_tool_retrieval.py
+"""
+from typing import Dict, List, Tuple
+
+from mservice import tools, TOOL_KEYWORDS, SCHEMA_MODE, PROMPT_TEMPLATE, codegen_prompt
+from tool_registry import count_tokens
+from tool_retrieval import ToolRetriever
+
+# (查询, 回答该查询需要的函数)
+LABELED_QUERIES: List[Tuple[str, List[str]]] = [
+    ("喂，帮我看看13800138000这个号码还有多少话费啊，顺便看看最近都跟谁打电话了，对了，现在是5G还是4G啊",
+     ['search_phone_number_balance', 'query_last_calls', 'check_network_status']),
+    ("那个，我想问下13900139000的套餐用得怎么样了，流量快没了吗？我看我好像开了好几个增值服务，都有啥啊，能给我推荐个合适的套餐不",
+     ['query_basic_package_usage', 'query_value_added_services', 'get_package_recommendations']),
+    ("你好，我这个13700137000好像欠费了，帮我查查欠了多少，如果补上的话能马上开通5G不，这边信号老是不太好",
+     ['search_phone_number_balance', 'check_service_availability', 'check_network_status']),
+    ("麻烦帮我查一下13600136000，流量和通话时间还剩多少，最近这话费花得有点快，帮我看看都打给谁了",
+     ['query_basic_package_usage', 'query_last_calls']),
+    ("诶，13500135000这个号码的套餐情况帮我查一下呗，主要看看流量语音短信这些，还有最近新开的那些业务都查一下",
+     ['query_basic_package_usage', 'query_value_added_services']),
+    ("客服你好，13800138000这月余额有点不对劲，帮我查下通话记录，还有现在用的是4G还是5G，信号咋样，有啥合适的套餐推荐不",
+     ['search_phone_number_balance', 'query_last_calls', 'check_network_status', 'get_package_recommendations']),
+    ("那什么，13900139000这号码是不是欠费停机了啊，要是欠费了得充多少，顺便问下我那个流量包还够用不",
+     ['search_phone_number_balance', 'query_addon_package_usage']),
+    ("帮我查下这个13700137000，套餐用得差不多了，想看看基本套餐和那些增值服务都咋样了，是不是该换个套餐了",
+     ['query_basic_package_usage', 'query_value_added_services', 'get_package_recommendations']),
+    ("13600136000这信号老差，都没法用，你给我看看是不是可以升级到5G，顺便查查最近这话费和余额呗",
+     ['check_network_status', 'check_service_availability', 'search_phone_number_balance']),
+    ("你好，能帮我看看13500135000的各项使用情况吗，就是流量啊短信啊这些，再看看有什么优惠套餐",
+     ['query_basic_package_usage', 'get_package_recommendations']),
+    ("帮我看下13800138000的流量共享成员都用了多少",
+     ['query_data_sharing_members']),
+    ("把13900001111加到13800138000的亲情号码里",
+     ['manage_family_numbers']),
+    ("13800138000开通的5G畅游包这个月用了多少",
+     ['query_value_added_service_usage']),
+]
+
+TOP_K_VALUES = [2, 3, 4, 5, 6]
+
+
+def evaluate(top_k: int) -> Dict[str, float]:
+    """
+    评估指定 top_k 下的检索效果
+
+    Returns:
+        平均召回率、所需函数全部召回的查询比例、平均选中函数数、函数定义和整个提示词的 token 缩减比例
+    """
+    retriever = ToolRetriever(tools, keywords=TOOL_KEYWORDS, schema_mode=SCHEMA_MODE)
+    full_prompt_tokens = count_tokens(codegen_prompt.prefix)[0]
+
+    recall_sum = 0.0
+    complete = 0
+    prompt_tokens = 0
+    for query, expected in LABELED_QUERIES:
+        names = retriever.retrieve(query, top_k)
+        found = len(set(expected) & set(names))
+        recall_sum += found / len(expected)
+        complete += found == len(expected)
+        prefix = PROMPT_TEMPLATE.rpartition('{user_query}')[0].format(
+            functions_schema=tools.render_schema(SCHEMA_MODE, names)
+        )
+        prompt_tokens += count_tokens(prefix)[0]
+
+    stats = retriever.get_stats()
+    total = len(LABELED_QUERIES)
+    return {
+        'recall': recall_sum / total,
+        'complete_rate': complete / total,
+        'avg_selected_tools': stats['avg_selected_tools'],
+        'schema_token_reduction': stats['schema_token_reduction'],
+        'prompt_token_reduction': 1 - prompt_tokens / (full_prompt_tokens * total)
+    }
+
+
+if __name__ == "__main__":
+    print(f"标注查询数: {len(LABELED_QUERIES)}，工具函数数: {len(tools.names)}，schema 格式: {SCHEMA_MODE}")
+    print(f"token 计数方式: {count_tokens('')[1]}")
+    print("-" * 70)
+    for top_k in TOP_K_VALUES:
+        result = evaluate(top_k)
+        print(f"top_k={top_k}: 召回率 {result['recall'] * 100:.1f}%，"
+              f"完全召回 {result['complete_rate'] * 100:.1f}%，"
+              f"平均选中 {result['avg_selected_tools']:.1f} 个函数，"
+              f"函数定义缩减 {result['schema_token_reduction'] * 100:.1f}%，"
+              f"提示词缩减 {result['prompt_token_reduction'] * 100:.1f}%")
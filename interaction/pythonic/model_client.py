@@ -0,0 +1,296 @@
+"""
+模型客户端工厂
+
+ChatOpenAI 默认为每个实例各自创建 HTTP 客户端，连接池、keep-alive 和超时都使用默认值，并发请求多时会
+反复建立 TCP/TLS 连接。这里统一创建共享的同步、异步 httpx 客户端：
+- 连接池大小、keep-alive 时长可配置，多个模型实例（chat、suggest 等）共用同一个连接池
+- 连接、读取超时可配置，create_chat_model 也可以单独指定某个模型的超时
+- 连接失败、对端关闭空闲连接、429、5xx 时按指数退避加随机抖动重试（ChatOpenAI 自身的重试关闭，避免重复重试）
+- 通过 httpcore 的 trace 扩展统计每个请求是新建连接还是复用已有连接，以及建立连接的耗时
+
+配置通过环境变量修改（见下方常量），安装了 h2 且 MODEL_HTTP2=1 时使用 HTTP/2。
+
+Example:
+    from model_client import create_chat_model
+    chat = create_chat_model(base_url=..., api_key=..., model='glm-4-air', temperature=0.2)
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+try:
+    import h2  # noqa: F401  HTTP/2 支持是可选的
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 连接池
+POOL_MAX_CONNECTIONS = int(os.getenv('MODEL_POOL_MAX_CONNECTIONS', '100'))
+POOL_MAX_KEEPALIVE = int(os.getenv('MODEL_POOL_MAX_KEEPALIVE', '20'))
+KEEPALIVE_EXPIRY = float(os.getenv('MODEL_KEEPALIVE_EXPIRY', '60'))
+HTTP2_ENABLED = os.getenv('MODEL_HTTP2', '0') == '1' and HTTP2_AVAILABLE
+
+# 超时（秒），读取超时需要覆盖非流式请求生成完整代码的时间
+CONNECT_TIMEOUT = float(os.getenv('MODEL_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('MODEL_READ_TIMEOUT', '60'))
+
+# 重试
+MAX_RETRIES = int(os.getenv('MODEL_MAX_RETRIES', '2'))
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8.0
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def build_timeout(connect: float = CONNECT_TIMEOUT, read: float = READ_TIMEOUT) -> httpx.Timeout:
+    """构造超时配置，写入和从连接池获取连接的超时与连接超时相同"""
+    return httpx.Timeout(connect=connect, read=read, write=connect, pool=connect)
+
+
+def retry_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    """
+    计算第 attempt 次重试前的等待时间（秒）
+
+    响应带有 Retry-After（秒数）时按它等待，否则在 [0, 指数退避上限] 内随机取值（full jitter），
+    避免大量请求在同一时刻一起重试
+    """
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after and retry_after.replace('.', '', 1).isdigit():
+            return min(float(retry_after), RETRY_BACKOFF_MAX)
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+class ConnectionStats:
+    """连接复用和重试统计（同步、异步客户端共用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'new_connections': 0,
+            'reused_connections': 0,
+            'connect_time': 0.0,  # 建立连接（TCP + TLS）的总耗时
+            'retries': 0,
+            'errors': 0,
+            'status_errors': 0  # 重试后仍返回可重试状态码的请求数
+        }
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self.stats[key] += value
+
+    def new_trace(self) -> Dict[str, Any]:
+        """每个请求一份的状态，记录 trace 事件中是否出现了建立连接"""
+        return {'connected': False, 'connect_start': None, 'connect_time': 0.0}
+
+    @staticmethod
+    def on_trace(state: Dict[str, Any], event_name: str) -> None:
+        if event_name == 'connection.connect_tcp.started':
+            state['connected'] = True
+            state['connect_start'] = time.perf_counter()
+        elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            if state['connect_start'] is not None:
+                state['connect_time'] = time.perf_counter() - state['connect_start']
+
+    def finish(self, state: Dict[str, Any]) -> None:
+        """一次 HTTP 请求（含重试中的每一次）完成后记录连接是否复用"""
+        if state['connected']:
+            self.add(requests=1, new_connections=1, connect_time=state['connect_time'])
+        else:
+            self.add(requests=1, reused_connections=1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['reuse_ratio'] = stats['reused_connections'] / stats['requests'] if stats['requests'] else 0.0
+        stats['avg_connect_time'] = (
+            stats['connect_time'] / stats['new_connections'] if stats['new_connections'] else 0.0
+        )
+        return stats
+
+
+class RetryTransport(httpx.BaseTransport):
+    """带重试和连接统计的同步传输层"""
+
+    def __init__(self, transport: httpx.HTTPTransport, stats: ConnectionStats, max_retries: int = MAX_RETRIES):
+        self._transport = transport
+        self._stats = stats
+        self.max_retries = max_retries
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            state = self._stats.new_trace()
+
+            def trace(event_name, info, state=state):
+                ConnectionStats.on_trace(state, event_name)
+
+            request.extensions['trace'] = trace
+            try:
+                response = self._transport.handle_request(request)
+            except RETRY_EXCEPTIONS:
+                self._stats.finish(state)
+                if attempt >= self.max_retries:
+                    self._stats.add(errors=1)
+                    raise
+                delay = retry_delay(attempt)
+            else:
+                self._stats.finish(state)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                if attempt >= self.max_retries:
+                    self._stats.add(status_errors=1)
+                    return response
+                delay = retry_delay(attempt, response)
+                response.close()
+            attempt += 1
+            self._stats.add(retries=1)
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """带重试和连接统计的异步传输层"""
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, stats: ConnectionStats, max_retries: int = MAX_RETRIES):
+        self._transport = transport
+        self._stats = stats
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            state = self._stats.new_trace()
+
+            async def trace(event_name, info, state=state):
+                ConnectionStats.on_trace(state, event_name)
+
+            request.extensions['trace'] = trace
+            try:
+                response = await self._transport.handle_async_request(request)
+            except RETRY_EXCEPTIONS:
+                self._stats.finish(state)
+                if attempt >= self.max_retries:
+                    self._stats.add(errors=1)
+                    raise
+                delay = retry_delay(attempt)
+            else:
+                self._stats.finish(state)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                if attempt >= self.max_retries:
+                    self._stats.add(status_errors=1)
+                    return response
+                delay = retry_delay(attempt, response)
+                await response.aclose()
+            attempt += 1
+            self._stats.add(retries=1)
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ModelClientFactory:
+    """
+    持有共享的 httpx 客户端，创建使用这些客户端的 ChatOpenAI 实例
+
+    客户端在第一次使用时创建；同一个工厂创建的所有模型实例共用连接池和统计
+    """
+
+    def __init__(self, max_connections: int = POOL_MAX_CONNECTIONS, max_keepalive: int = POOL_MAX_KEEPALIVE,
+                 keepalive_expiry: float = KEEPALIVE_EXPIRY, timeout: Optional[httpx.Timeout] = None,
+                 max_retries: int = MAX_RETRIES, http2: bool = HTTP2_ENABLED):
+        """
+        Args:
+            max_connections: 连接池最大连接数
+            max_keepalive: 最多保留的空闲 keep-alive 连接数
+            keepalive_expiry: 空闲连接保留时长（秒）
+            timeout: 默认超时，默认使用 CONNECT_TIMEOUT、READ_TIMEOUT
+            max_retries: 最大重试次数
+            http2: 是否使用 HTTP/2（需要安装 h2）
+        """
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = timeout or build_timeout()
+        self.max_retries = max_retries
+        self.http2 = http2
+        self.stats = ConnectionStats()
+        self._lock = threading.Lock()
+        self._sync_client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                transport = httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+                self._sync_client = httpx.Client(
+                    transport=RetryTransport(transport, self.stats, self.max_retries), timeout=self.timeout
+                )
+            return self._sync_client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._async_client is None:
+                transport = httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+                self._async_client = httpx.AsyncClient(
+                    transport=AsyncRetryTransport(transport, self.stats, self.max_retries), timeout=self.timeout
+                )
+            return self._async_client
+
+    def create_chat_model(self, timeout: Optional[httpx.Timeout] = None, **config) -> ChatOpenAI:
+        """
+        创建使用共享客户端的 ChatOpenAI
+
+        Args:
+            timeout: 该模型的请求超时，默认使用工厂的超时
+            config: 传给 ChatOpenAI 的其他参数（base_url、api_key、model、temperature 等）
+
+        Returns:
+            ChatOpenAI 实例
+        """
+        return ChatOpenAI(
+            http_client=self.sync_client,
+            http_async_client=self.async_client,
+            timeout=timeout or self.timeout,
+            max_retries=0,  # 由传输层重试
+            **config
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回连接池配置和连接复用、重试统计"""
+        stats = self.stats.get_stats()
+        stats['max_connections'] = self.limits.max_connections
+        stats['max_keepalive_connections'] = self.limits.max_keepalive_connections
+        stats['keepalive_expiry'] = self.limits.keepalive_expiry
+        stats['http2'] = self.http2
+        return stats
+
+    def close(self) -> None:
+        """关闭同步客户端（异步客户端需要在事件循环中调用 aclose）"""
+        with self._lock:
+            client, self._sync_client = self._sync_client, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose()
+
+
+client_factory = ModelClientFactory()
+create_chat_model = client_factory.create_chat_model
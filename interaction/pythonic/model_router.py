@@ -0,0 +1,278 @@
+"""
+多模型后端路由
+
+model.py 中配置了多个 OpenAI 兼容的模型后端，这里把它们组合成一个与 ChatOpenAI 用法相同的对象
+（invoke / ainvoke / stream / astream），每个请求发往当前最快的健康后端：
+- 每个后端保留最近 ROUTER_WINDOW 次请求的耗时和成败，按成功请求耗时的 P50 排序
+- 连续失败或最近错误率过高的后端暂时摘除（ROUTER_COOLDOWN 秒后再尝试），请求失败时依次换下一个后端
+- 开启对冲（hedge）后，非流式请求超过首选后端的 P95 仍未返回时，向第二个后端发送相同请求，
+  取先返回的结果，用少量重复请求削减长尾延迟
+
+流式请求只做选择和失败切换，不做对冲（已经输出给用户的内容无法撤回）。
+
+Example:
+    chat = ModelRouter({'codegeex': create_chat_model(**codegeex_private_32b),
+                        'deepseek': create_chat_model(**deepseek)}, hedge=True)
+    response = chat.invoke(messages)
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set
+
+from tool_metrics import percentile
+
+# 每个后端保留的最近请求数
+ROUTER_WINDOW = int(os.getenv('PYTHONIC_ROUTER_WINDOW', '50'))
+# 样本数达到该值后才按延迟排序、计算对冲等待时间
+ROUTER_MIN_SAMPLES = 3
+# 错误率超过该值或连续失败 ROUTER_MAX_FAILURES 次后摘除后端
+ROUTER_ERROR_RATE = 0.5
+ROUTER_MAX_FAILURES = 3
+ROUTER_COOLDOWN = float(os.getenv('PYTHONIC_ROUTER_COOLDOWN', '30'))
+# 是否开启对冲请求；对冲等待时间不小于 HEDGE_MIN_DELAY 秒
+HEDGE_ENABLED = os.getenv('PYTHONIC_ROUTER_HEDGE', '1') == '1'
+HEDGE_MIN_DELAY = 0.5
+
+
+class _Backend:
+    """单个后端的最近请求记录和健康状态"""
+
+    def __init__(self, name: str, model: Any, window: int):
+        self.name = name
+        self.model = model
+        self.samples: deque = deque(maxlen=window)  # (耗时秒, 是否成功)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'hedges': 0,  # 作为对冲请求被调用的次数
+            'hedge_wins': 0,  # 对冲请求先于首选后端返回的次数
+            'cancelled': 0  # 对冲中输掉而被取消的次数
+        }
+
+    def latencies(self) -> List[float]:
+        return [latency for latency, ok in self.samples if ok]
+
+    def error_rate(self) -> float:
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+    def p50(self) -> Optional[float]:
+        latencies = self.latencies()
+        return percentile(latencies, 50) if len(latencies) >= ROUTER_MIN_SAMPLES else None
+
+    def p95(self) -> Optional[float]:
+        latencies = self.latencies()
+        return percentile(latencies, 95) if len(latencies) >= ROUTER_MIN_SAMPLES else None
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+
+class ModelRouter:
+    """按延迟和健康状态在多个模型后端之间路由请求"""
+
+    def __init__(self, backends: Dict[str, Any], hedge: bool = HEDGE_ENABLED, window: int = ROUTER_WINDOW,
+                 max_workers: int = 16):
+        """
+        Args:
+            backends: 后端名到模型实例（ChatOpenAI 等）的映射，顺序即没有延迟数据时的优先顺序
+            hedge: 是否开启对冲请求
+            window: 每个后端保留的最近请求数
+            max_workers: 同步调用时发送请求的线程数
+        """
+        if not backends:
+            raise ValueError("至少需要一个模型后端")
+        self.backends = [_Backend(name, model, window) for name, model in backends.items()]
+        self.hedge = hedge
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model-router')
+
+    def ranked(self) -> List[_Backend]:
+        """
+        按优先顺序排列的后端
+
+        健康的后端在前：样本不足的后端排在最前面（先积累延迟数据），其余按 P50 升序；
+        摘除中的后端排在最后，按恢复时间先后，全部后端都被摘除时仍然会被尝试
+        """
+        now = time.time()
+        with self._lock:
+            healthy = [backend for backend in self.backends if backend.healthy(now)]
+            unhealthy = sorted((backend for backend in self.backends if not backend.healthy(now)),
+                               key=lambda backend: backend.unhealthy_until)
+            p50s = {backend.name: backend.p50() for backend in healthy}
+        healthy.sort(key=lambda backend: -1.0 if p50s[backend.name] is None else p50s[backend.name])
+        return healthy + unhealthy
+
+    def _hedge_delay(self, backend: _Backend) -> Optional[float]:
+        """首选后端等待多久后发送对冲请求，延迟数据不足时不对冲"""
+        with self._lock:
+            p95 = backend.p95()
+        return None if p95 is None else max(p95, HEDGE_MIN_DELAY)
+
+    def _record(self, backend: _Backend, latency: float, ok: bool) -> None:
+        with self._lock:
+            backend.samples.append((latency, ok))
+            backend.stats['requests'] += 1
+            if ok:
+                backend.consecutive_failures = 0
+                return
+            backend.stats['errors'] += 1
+            backend.consecutive_failures += 1
+            if (backend.consecutive_failures >= ROUTER_MAX_FAILURES or
+                    (len(backend.samples) >= ROUTER_MIN_SAMPLES and backend.error_rate() > ROUTER_ERROR_RATE)):
+                backend.unhealthy_until = time.time() + ROUTER_COOLDOWN
+                print(f"模型后端 {backend.name} 暂时摘除 {ROUTER_COOLDOWN:.0f}秒（连续失败 "
+                      f"{backend.consecutive_failures} 次，错误率 {backend.error_rate() * 100:.0f}%）")
+
+    def _count(self, backend: _Backend, key: str) -> None:
+        with self._lock:
+            backend.stats[key] += 1
+
+    def _call(self, backend: _Backend, messages: Any, kwargs: Dict[str, Any]) -> Any:
+        start_time = time.perf_counter()
+        try:
+            result = backend.model.invoke(messages, **kwargs)
+        except Exception:
+            self._record(backend, time.perf_counter() - start_time, False)
+            raise
+        self._record(backend, time.perf_counter() - start_time, True)
+        return result
+
+    async def _acall(self, backend: _Backend, messages: Any, kwargs: Dict[str, Any],
+                     hedge_losers: Set[asyncio.Task]) -> Any:
+        start_time = time.perf_counter()
+        try:
+            result = await backend.model.ainvoke(messages, **kwargs)
+        except asyncio.CancelledError:
+            if asyncio.current_task() in hedge_losers:
+                # 对冲中输掉被取消：把已等待的时间作为一个样本（真实耗时只会更长），
+                # 否则慢后端总是被取消、始终没有新样本，会一直保持原来的排名
+                self._record(backend, time.perf_counter() - start_time, True)
+                self._count(backend, 'cancelled')
+            # 调用方超时、断开等原因的取消不记录：一直卡住直到调用方放弃的后端不能因此算作成功
+            raise
+        except Exception:
+            self._record(backend, time.perf_counter() - start_time, False)
+            raise
+        self._record(backend, time.perf_counter() - start_time, True)
+        return result
+
+    def invoke(self, messages: Any, **kwargs) -> Any:
+        """同步调用，首选后端失败时换下一个后端；对冲请求在线程池中发送，输掉的请求在后台完成并记录耗时"""
+        candidates = self.ranked()
+        last_error: Optional[BaseException] = None
+        while candidates:
+            primary = candidates.pop(0)
+            pending = {self._executor.submit(self._call, primary, messages, kwargs): primary}
+            delay = self._hedge_delay(primary) if self.hedge and candidates else None
+            if delay is not None:
+                done, _ = wait(pending, timeout=delay)
+                if not done:
+                    secondary = candidates.pop(0)
+                    self._count(secondary, 'hedges')
+                    pending[self._executor.submit(self._call, secondary, messages, kwargs)] = secondary
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    backend = pending.pop(future)
+                    if future.exception() is None:
+                        if backend is not primary:
+                            self._count(backend, 'hedge_wins')
+                        return future.result()
+                    last_error = future.exception()
+        raise last_error
+
+    async def ainvoke(self, messages: Any, **kwargs) -> Any:
+        """异步调用，逻辑与 invoke 相同，对冲中输掉的请求会被取消"""
+        candidates = self.ranked()
+        last_error: Optional[BaseException] = None
+        while candidates:
+            primary = candidates.pop(0)
+            hedge_losers: Set[asyncio.Task] = set()
+            pending = {asyncio.ensure_future(self._acall(primary, messages, kwargs, hedge_losers)): primary}
+            try:
+                # 等待对冲延迟期间调用方被取消时，finally 同样要取消已发出的请求
+                delay = self._hedge_delay(primary) if self.hedge and candidates else None
+                if delay is not None:
+                    done, _ = await asyncio.wait(pending, timeout=delay)
+                    if not done:
+                        secondary = candidates.pop(0)
+                        self._count(secondary, 'hedges')
+                        task = asyncio.ensure_future(self._acall(secondary, messages, kwargs, hedge_losers))
+                        pending[task] = secondary
+                while pending:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        backend = pending.pop(task)
+                        if task.exception() is None:
+                            if backend is not primary:
+                                self._count(backend, 'hedge_wins')
+                            # 剩下的请求是对冲中输掉的，由 finally 取消
+                            hedge_losers.update(pending)
+                            return task.result()
+                        last_error = task.exception()
+            finally:
+                for task in pending:
+                    task.cancel()
+        raise last_error
+
+    def stream(self, messages: Any, **kwargs) -> Iterator[Any]:
+        """同步流式调用，输出第一个分块之前失败时换下一个后端"""
+        last_error: Optional[BaseException] = None
+        for backend in self.ranked():
+            start_time = time.perf_counter()
+            started = False
+            try:
+                for chunk in backend.model.stream(messages, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self._record(backend, time.perf_counter() - start_time, False)
+                if started:
+                    raise
+                last_error = e
+                continue
+            self._record(backend, time.perf_counter() - start_time, True)
+            return
+        raise last_error
+
+    async def astream(self, messages: Any, **kwargs) -> AsyncIterator[Any]:
+        """异步流式调用，输出第一个分块之前失败时换下一个后端"""
+        last_error: Optional[BaseException] = None
+        for backend in self.ranked():
+            start_time = time.perf_counter()
+            started = False
+            try:
+                async for chunk in backend.model.astream(messages, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self._record(backend, time.perf_counter() - start_time, False)
+                if started:
+                    raise
+                last_error = e
+                continue
+            self._record(backend, time.perf_counter() - start_time, True)
+            return
+        raise last_error
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回每个后端的请求数、错误率、P50/P95（毫秒）、对冲情况和健康状态，按当前优先顺序排列"""
+        now = time.time()
+        order = [backend.name for backend in self.ranked()]
+        stats = {'hedge': self.hedge, 'order': order, 'backends': {}}
+        with self._lock:
+            for backend in self.backends:
+                latencies = backend.latencies()
+                item = dict(backend.stats)
+                item['error_rate'] = backend.error_rate()
+                item['p50_ms'] = percentile(latencies, 50) * 1000
+                item['p95_ms'] = percentile(latencies, 95) * 1000
+                item['healthy'] = backend.healthy(now)
+                stats['backends'][backend.name] = item
+        return stats
@@ -1,165 +1,46 @@
 from datetime import datetime, timedelta
+import asyncio
+import contextlib
+import functools
+import os
 import random
-from typing import Optional, List
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Optional, List
 import time
 from langchain.schema import HumanMessage, SystemMessage
+import model
 from model import chat, suggest
-from test_mservice import extract_python_code, validate_generated_code, execute_code
+from test_mservice import extract_python_code, validate_generated_code, execute_code, execution_globals
+from parallel_exec import parallelize_tool_calls, PrefetchMetrics, SharedCallMemo
+from codegen_cache import CodeGenCache
+from sandbox import SandboxPool
+from tool_cache import ToolResultCache
+from tool_metrics import ToolMetrics
+from prompt_cache import StablePromptPrefix
+from tool_registry import ToolRegistry
+from tool_retrieval import ToolRetriever
+from code_analysis import analyze_calls, unknown_calls
+from code_repair import RepairBudget, RepairMetrics, STAGE_NAMES as REPAIR_STAGE_NAMES
+from deadline import Deadline, DeadlineExceeded, DeadlineMetrics, STAGE_NAMES
+from speculative_suggestion import SpeculativeSuggestion, SuggestionMetrics, SPECULATIVE_SUGGESTION_ENABLED
+from suggestion_rules import SuggestionRuleEngine
+from structured_results import (AddonUsageResult, BalanceResult, DataPassUsageResult, PackageUsageResult,
+                                ToolResult, UsageItem)
+from sandbox import SandboxTimeout
+from model_client import create_chat_model
+from model_router import ModelRouter
 
-functions_schema = """
-def search_phone_number_balance(phone_number: str) -> str:
-    \"\"\"
-    查询指定手机号码的账户余额
-    
-    Args:
-        phone_number: 手机号码
-        
-    Returns:
-        账户余额信息
-    \"\"\"
-    pass
-
-def query_value_added_services(phone_number: str) -> List[str]:
-    \"\"\"
-    查询用户开通的增值服务列表
-    
-    Args:
-        phone_number: 手机号码
-        
-    Returns:
-        已开通的增值服务名称列表
-    \"\"\"
-    pass
-
-def query_basic_package_usage(phone_number: str) -> str:
-    \"\"\"
-    查询用户基本套餐的使用情况
-    
-    Args:
-        phone_number: 手机号码
-        
-    Returns:
-        各项服务使用情况
-    \"\"\"
-    pass
-
-def query_addon_package_usage(phone_number: str, package_type: Optional[str] = None) -> str:
-    \"\"\"
-    查询用户增值包的使用情况
-    
-    Args:
-        phone_number: 手机号码
-        package_type: 可选，包类型(data/voice/sms)
-        
-    Returns:
-        指定类型的使用情况
-    \"\"\"
-    pass
-
-def get_package_recommendations(phone_number: str) -> str:
-    \"\"\"
-    获取套餐推荐
-    
-    Args:
-        phone_number: 手机号码
-        
-    Returns:
-        推荐套餐列表
-    \"\"\"
-    pass
+# 代码生成使用的模型后端：model.py 中的配置名，逗号分隔（如 codegeex_private_32b,deepseek）。
+# 配置后 chat 换成 ModelRouter，每个请求发往最快的健康后端，并对超过 P95 的请求做对冲
+MODEL_BACKENDS = [name.strip() for name in os.getenv('PYTHONIC_MODEL_BACKENDS', '').split(',') if name.strip()]
+model_router: Optional[ModelRouter] = None
+if MODEL_BACKENDS:
+    model_router = chat = ModelRouter({name: create_chat_model(**getattr(model, name)) for name in MODEL_BACKENDS})
 
-def check_network_status(phone_number: str) -> str:
-    \"\"\"
-    查询用户当前网络状态
-    
-    Args:
-        phone_number: 手机号码
-        
-    Returns:
-        网络状态信息
-    \"\"\"
-    pass
-
-def query_last_calls(phone_number: str, limit: int = 5) -> str:
-    \"\"\"
-    查询最近通话记录
-    
-    Args:
-        phone_number: 手机号码
-        limit: 返回记录数量
-        
-    Returns:
-        通话记录列表
-    \"\"\"
-    pass
-
-def check_service_availability(phone_number: str, service_type: str) -> str:
-    \"\"\"
-    检查特定服务是否可用于该号码
-    
-    Args:
-        phone_number: 手机号码
-        service_type: 服务类型
-        
-    Returns:
-        服务可用性
-    \"\"\"
-    pass
-
-def query_value_added_service_usage(phone_number: str, service_name: str) -> str:
-    \"\"\"
-    查询特定增值服务的使用情况
-    
-    Args:
-        phone_number: 手机号码
-        service_name: 增值服务名称
-        
-    Returns:
-        服务使用情况描述
-    \"\"\"
-    pass
-
-def query_data_sharing_members(phone_number: str) -> List[dict]:
-    \"\"\"
-    查询流量共享成员列表及使用情况
-    
-    Args:
-        phone_number: 主号码
-        
-    Returns:
-        成员使用情况列表
-    \"\"\"
-    pass
-
-def manage_family_numbers(phone_number: str, action: str = "query", target_number: str = None) -> str:
-    \"\"\"
-    管理亲情号码
-    
-    Args:
-        phone_number: 主号码
-        action: 操作类型 (query/add/remove)
-        target_number: 目标亲情号码
-        
-    Returns:
-        操作结果描述
-    \"\"\"
-    pass
-
-"""
-
-functions_name_list = [
-    'search_phone_number_balance',
-    'query_value_added_services',
-    'query_basic_package_usage',
-    'query_addon_package_usage',
-    'get_package_recommendations',
-    'check_network_status',
-    'query_last_calls',
-    'check_service_availability',
-    'query_value_added_service_usage',
-    'query_data_sharing_members',
-    'manage_family_numbers'
-]
+# 工具函数注册表：提示词中的函数定义、函数名列表和函数字典都由它从函数签名和文档字符串生成
+tools = ToolRegistry()
 
 test_queries = [
     "喂，帮我看看13800138000这个号码还有多少话费啊，顺便看看最近都跟谁打电话了，对了，现在是5G还是4G啊",
@@ -201,39 +82,102 @@ PACKAGE_TYPES = {
     "sms": "短信包"
 }
 
+# 有副作用的函数，不允许在执行生成代码前提前并发调用
+SIDE_EFFECT_FUNCTIONS = {'manage_family_numbers'}
+
+# 工具函数结果的缓存有效期（秒）：余额、网络状态变化快，套餐、增值服务列表变化慢；不在其中的函数不缓存
+TOOL_CACHE_TTLS = {
+    'search_phone_number_balance': 10,
+    'check_network_status': 10,
+    'query_last_calls': 30,
+    'query_basic_package_usage': 60,
+    'query_addon_package_usage': 60,
+    'query_value_added_service_usage': 60,
+    'query_data_sharing_members': 60,
+    'manage_family_numbers': 300,  # 只缓存 action="query"，添加/移除会清除该号码的缓存
+    'query_value_added_services': 600,
+    'get_package_recommendations': 600,
+    'check_service_availability': 600
+}
+TOOL_CACHE_ENABLED = os.getenv('PYTHONIC_TOOL_CACHE', '1') != '0'
+tool_cache = ToolResultCache(TOOL_CACHE_TTLS)
+
+# 工具函数真实的调用次数、耗时分布和并发度（只统计实际执行的调用，不含缓存命中）
+tool_metrics = ToolMetrics()
+
+# 批量查询时同时进行的模型调用数量上限（默认值，也是请求中 max_concurrency 的最大值）
+BATCH_MAX_CONCURRENCY = 8
+
+# 生成代码的执行方式：inline 在当前进程中执行；sandbox 在预热好的隔离进程池中执行（有超时和内存限制）
+EXECUTION_BACKEND = os.getenv('PYTHONIC_EXECUTION_BACKEND', 'inline')
+_sandbox_pool: Optional[SandboxPool] = None
+
+# 执行生成代码（及其中阻塞的工具调用）的线程池，异步接口通过它避免阻塞事件循环
+TOOL_EXECUTOR_MAX_WORKERS = 32
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_EXECUTOR_MAX_WORKERS, thread_name_prefix="mservice-tool")
+
+# 生成代码验证或执行失败后让模型修复的统计（修复次数、时间预算见 code_repair.py）
+repair_metrics = RepairMetrics()
+
+# 请求截止时间的统计：各阶段超时的次数（默认超时见 deadline.py）
+deadline_metrics = DeadlineMetrics()
+
+# 工具调用预取的汇总统计（预取、命中、未被取用的调用数，见 parallel_exec.py）
+prefetch_metrics = PrefetchMetrics()
+
+# 建议的生成方式（推测 / 重新生成）和可见延迟统计，见 speculative_suggestion.py
+suggestion_metrics = SuggestionMetrics()
+
+# 建议的规则快速路径：规则命中时不调用建议模型，见 suggestion_rules.py
+suggestion_rules = SuggestionRuleEngine()
+
+
+def is_write_call(name: str, arguments: Dict[str, Any]) -> bool:
+    """判断工具调用是否会修改用户数据"""
+    return name == 'manage_family_numbers' and arguments.get('action') != 'query'
+
 
 def load_functions():
-    """加载所有函数"""
-    return {
-        'search_phone_number_balance': search_phone_number_balance,
-        'query_value_added_services': query_value_added_services,
-        'query_basic_package_usage': query_basic_package_usage,
-        'query_addon_package_usage': query_addon_package_usage,
-        'get_package_recommendations': get_package_recommendations,
-        'check_network_status': check_network_status,
-        'query_last_calls': query_last_calls,
-        'check_service_availability': check_service_availability,
-        'query_value_added_service_usage': query_value_added_service_usage,
-        'query_data_sharing_members': query_data_sharing_members,
-        'manage_family_numbers': manage_family_numbers
-    }
+    """
+    加载所有函数
+    
+    每个函数都经过 tool_metrics 计时；默认还带有结果缓存（见 TOOL_CACHE_TTLS），设置 PYTHONIC_TOOL_CACHE=0 时不缓存
+    """
+    functions = tool_metrics.wrap(load_raw_functions())
+    if TOOL_CACHE_ENABLED:
+        functions = tool_cache.wrap(functions, is_write=is_write_call)
+    return functions
+
 
+def load_raw_functions():
+    """加载未经缓存包装的原始函数"""
+    return tools.functions()
 
+
+@tools.tool
 def search_phone_number_balance(phone_number: str) -> str:
-    """查询指定手机号码的账户余额"""
+    """
+    查询指定手机号码的账户余额
+
+    Args:
+        phone_number: 手机号码
+
+    Returns:
+        账户余额信息
+    """
     time.sleep(random.uniform(0.75, 1.25))
     balance = round(random.uniform(-10, 50), 2)
-    status = "欠费" if balance < 0 else "正常"
-    return f"[执行函数：search_phone_number_balance]手机号{phone_number}的账户余额查询结果：\n余额：{balance}元\n账户状态：{status}\n"
+    return ToolResult(BalanceResult(phone_number, balance))
 
 
+@tools.tool
 def query_value_added_services(phone_number: str) -> List[str]:
     """
     查询用户开通的增值服务列表
-    
+
     Args:
         phone_number: 手机号码
-        
+
     Returns:
         已开通的增值服务名称列表
     """
@@ -241,22 +185,38 @@ def query_value_added_services(phone_number: str) -> List[str]:
     return random.sample(services, random.randint(1, len(services)))
 
 
+@tools.tool
 def query_basic_package_usage(phone_number: str) -> str:
-    """查询用户基本套餐的使用情况"""
+    """
+    查询用户基本套餐的使用情况
+
+    Args:
+        phone_number: 手机号码
+
+    Returns:
+        各项服务使用情况
+    """
     time.sleep(random.uniform(0.75, 1.25))
-    data = f"{random.randint(0, 100)}GB/{random.randint(100, 200)}GB"
-    voice = f"{random.randint(0, 100)}分钟/{random.randint(100, 200)}分钟"
-    sms = f"{random.randint(0, 100)}条/{random.randint(100, 200)}条"
-    
-    return f"""[执行函数：query_basic_package_usage]\n手机号{phone_number}的基本套餐使用情况：
-流量使用：{data}
-通话使用：{voice}
-短信使用：{sms}
-"""
+    items = (
+        UsageItem("流量", random.randint(0, 100), random.randint(100, 200), "GB"),
+        UsageItem("通话", random.randint(0, 100), random.randint(100, 200), "分钟"),
+        UsageItem("短信", random.randint(0, 100), random.randint(100, 200), "条"),
+    )
+    return ToolResult(PackageUsageResult(phone_number, items))
 
 
+@tools.tool
 def query_addon_package_usage(phone_number: str, package_type: Optional[str] = None) -> str:
-    """查询用户增值包的使用情况"""
+    """
+    查询用户增值包的使用情况
+
+    Args:
+        phone_number: 手机号码
+        package_type: 可选，包类型(data/voice/sms)
+
+    Returns:
+        指定类型的使用情况
+    """
     time.sleep(random.uniform(0.75, 1.25))
     
     # 参数验证
@@ -270,19 +230,26 @@ def query_addon_package_usage(phone_number: str, package_type: Optional[str] = N
     type_name = PACKAGE_TYPES.get(package_type, "未知类型")
     
     if package_type == "data":
-        usage = f"{random.randint(0, 50)}GB/{random.randint(50, 100)}GB"
+        usage = UsageItem(type_name, random.randint(0, 50), random.randint(50, 100), "GB")
     elif package_type == "voice":
-        usage = f"{random.randint(0, 100)}分钟/{random.randint(100, 200)}分钟"
+        usage = UsageItem(type_name, random.randint(0, 100), random.randint(100, 200), "分钟")
     else:  # sms
-        usage = f"{random.randint(0, 100)}条/{random.randint(100, 200)}条"
+        usage = UsageItem(type_name, random.randint(0, 100), random.randint(100, 200), "条")
     
-    return f"""\n手机号{phone_number}的{type_name}增值包使用情况：
-使用量：{usage}
-"""
+    return ToolResult(AddonUsageResult(phone_number, usage))
 
 
+@tools.tool
 def get_package_recommendations(phone_number: str) -> str:
-    """获取套餐推荐"""
+    """
+    获取套餐推荐
+
+    Args:
+        phone_number: 手机号码
+
+    Returns:
+        推荐套餐列表
+    """
     time.sleep(random.uniform(0.75, 1.25))
     recommendations = []
     for pkg_type, type_name in PACKAGE_TYPES.items():
@@ -300,8 +267,17 @@ def get_package_recommendations(phone_number: str) -> str:
     return result
 
 
+@tools.tool
 def check_network_status(phone_number: str) -> str:
-    """查询用户当前网络状态"""
+    """
+    查询用户当前网络状态
+
+    Args:
+        phone_number: 手机号码
+
+    Returns:
+        网络状态信息
+    """
     time.sleep(random.uniform(0.75, 1.25))
     network_types = ["5G", "4G", "3G", "2G"]
     network_type = random.choice(network_types)
@@ -315,8 +291,18 @@ def check_network_status(phone_number: str) -> str:
 """
 
 
+@tools.tool
 def query_last_calls(phone_number: str, limit: int = 5) -> str:
-    """查询最近通话记录"""
+    """
+    查询最近通话记录
+
+    Args:
+        phone_number: 手机号码
+        limit: 返回记录数量
+
+    Returns:
+        通话记录列表
+    """
     time.sleep(random.uniform(0.75, 1.25))  # 随机延时500-1500ms
     
     # 参数验证
@@ -338,8 +324,18 @@ def query_last_calls(phone_number: str, limit: int = 5) -> str:
     return f"""[执行函数：query_last_calls]\n手机号{phone_number}的最近{limit}条通话记录：\n{"".join(f"{call}\n" for call in calls)}"""
 
 
+@tools.tool
 def check_service_availability(phone_number: str, service_type: str) -> str:
-    """检查特定服务是否可用于该号码"""
+    """
+    检查特定服务是否可用于该号码
+
+    Args:
+        phone_number: 手机号码
+        service_type: 服务类型
+
+    Returns:
+        服务可用性
+    """
     time.sleep(random.uniform(0.75, 1.25))  
     
     # 参数验证
@@ -362,14 +358,15 @@ def check_service_availability(phone_number: str, service_type: str) -> str:
     return result
 
 
+@tools.tool
 def query_value_added_service_usage(phone_number: str, service_name: str) -> str:
     """
     查询特定增值服务的使用情况
-    
+
     Args:
         phone_number: 手机号码
         service_name: 增值服务名称
-        
+
     Returns:
         服务使用情况描述
     """
@@ -385,7 +382,7 @@ def query_value_added_service_usage(phone_number: str, service_name: str) -> str
         
     template = usage_templates[service_name]
     if service_name == "5G畅游包":
-        return template.format(usage=random.randint(10, 50), remaining=random.randint(0, 20))
+        return ToolResult(DataPassUsageResult(service_name, random.randint(10, 50), random.randint(0, 20)))
     elif service_name == "流量共享":
         return template.format(usage=random.randint(1, 10), num=random.randint(1, 3))
     elif service_name == "亲情号码":
@@ -394,13 +391,14 @@ def query_value_added_service_usage(phone_number: str, service_name: str) -> str
         return template.format(count=random.randint(5, 20))
 
 
+@tools.tool
 def query_data_sharing_members(phone_number: str) -> List[dict]:
     """
     查询流量共享成员列表及使用情况
-    
+
     Args:
         phone_number: 主号码
-        
+
     Returns:
         成员使用情况列表
     """
@@ -415,15 +413,16 @@ def query_data_sharing_members(phone_number: str) -> List[dict]:
     return members
 
 
+@tools.tool
 def manage_family_numbers(phone_number: str, action: str = "query", target_number: str = None) -> str:
     """
     管理亲情号码
-    
+
     Args:
         phone_number: 主号码
         action: 操作类型 (query/add/remove)
         target_number: 目标亲情号码
-        
+
     Returns:
         操作结果描述
     """
@@ -439,25 +438,18 @@ def manage_family_numbers(phone_number: str, action: str = "query", target_numbe
         return "不支持的操作类型"
 
 
-def handle_query(query: str) -> tuple[float, str, list[str]]:
-    """
-    处理单个查询请求，返回执行时间、响应文本和执行的函数列表
-    
-    Args:
-        query: 用户查询文本
-        
-    Returns:
-        tuple: (执行时间（毫秒）, 响应文本, 执行的函数列表)
-    """
-    # 使用预定义的提示词模板
-    prompt_template = """你是一个移动通信服务的智能助手。你的任务是理解用户需求，并生成相应的Python代码来完成服务查询流程。
+# 提示词中函数定义的格式：full 为完整的函数定义和文档字符串，compact 为每个函数一行（提示词更短）
+SCHEMA_MODE = os.getenv('PYTHONIC_SCHEMA_MODE', 'full')
+functions_schema = tools.render_schema(SCHEMA_MODE)
+functions_name_list = tools.names
+
+# 用户查询放在最后：前面的函数定义和要求每次请求都完全相同，后端可以复用这部分前缀的缓存（见 prompt_cache.py）
+PROMPT_TEMPLATE = """你是一个移动通信服务的智能助手。你的任务是理解用户需求，并生成相应的Python代码来完成服务查询流程。
 
 可用的函数定义如下：
 {functions_schema}
 
-用户查询：{user_query}
-
-请生成Python代码来处理这个查询。要求：
+请针对下面的用户查询生成Python代码。要求：
 1. 代码应该调用上述预定义的函数来完成查询
 2. 将所有查询结果拼接成一个字符串并返回
 3. 使用 markdown 格式输出代码，例如：
@@ -471,83 +463,878 @@ result.append(...)
 
 # 返回拼接后的结果
 return "\\n".join(result)
-```"""
+```
+
+用户查询：{user_query}"""
+
+SUGGESTION_SYSTEM_MESSAGE = """你是一个移动通信服务的智能助手, 接下来会传递针对用户的查询的响应内容。
+    你需要根据查询结果，生成一句话建议。诸如：
+    1. 如果用户欠费则建议用户尽快进行充值，并提供一些充值渠道建议。
+    2. 如果用户的某增值服务用量小于三分之一，则建议用户升级该增值服务。
+    3. 如果用户购买了多项增值服务，可以建议用户评估下是否需要调整套餐。
+    """
+
+
+# 生成代码缓存：只有手机号等实体不同的查询复用同一份代码模板
+codegen_cache = CodeGenCache(functions_name_list)
+
+# 代码生成提示词的固定前缀
+codegen_prompt = StablePromptPrefix("你是一个移动通信服务的智能助手", PROMPT_TEMPLATE, functions_schema=functions_schema)
+
+
+# 工具检索：只把与查询最相关的 k 个函数放进提示词，0 表示不检索（函数数量较多时开启）
+TOOL_RETRIEVAL_TOP_K = int(os.getenv('PYTHONIC_TOOL_RETRIEVAL_TOP_K', '0'))
+
+# 用户对各个函数的常用说法，补充函数说明中没有的词
+TOOL_KEYWORDS = {
+    'search_phone_number_balance': ['余额', '话费', '欠费', '欠了', '充值', '停机'],
+    'query_value_added_services': ['增值服务', '业务', '开了', '开通了'],
+    'query_basic_package_usage': ['套餐', '流量', '通话', '语音', '短信', '用得', '使用情况'],
+    'query_addon_package_usage': ['流量包', '通话包', '短信包', '增值包', '加油包'],
+    'get_package_recommendations': ['推荐', '换套餐', '合适', '划算', '优惠', '实惠', '便宜'],
+    'check_network_status': ['信号', '网络', '5g', '4g', '卡'],
+    'query_last_calls': ['通话记录', '打电话', '打给谁', '跟谁', '消费记录'],
+    'check_service_availability': ['开通', '升级', '能不能'],
+    'query_value_added_service_usage': ['增值服务', '业务', '用量', '畅游包', '来电提醒'],
+    'query_data_sharing_members': ['共享', '成员', '副卡'],
+    'manage_family_numbers': ['亲情号', '家人']
+}
+
+tool_retriever = ToolRetriever(tools, keywords=TOOL_KEYWORDS, schema_mode=SCHEMA_MODE)
+
+# 检索出的每组函数对应的提示词前缀，同一组函数的请求共用同一个前缀；函数组合很多时淘汰最久未使用的
+CODEGEN_PROMPT_CACHE_SIZE = 64
+_codegen_prompts: "OrderedDict[tuple, StablePromptPrefix]" = OrderedDict()
+_codegen_prompts_lock = threading.Lock()
+
+# 执行环境中除工具函数外可用的名字，用于识别生成代码调用的不存在的函数
+EXECUTION_GLOBAL_NAMES = frozenset(execution_globals())
+
+
+def get_codegen_prompt(query: str) -> tuple[StablePromptPrefix, List[str]]:
+    """
+    获取查询对应的代码生成提示词
     
-    # 构造完整提示词
-    prompt = prompt_template.format(
-        functions_schema=functions_schema,
-        user_query=query
-    )
+    Args:
+        query: 用户查询文本
+        
+    Returns:
+        (提示词前缀, 提示词中包含的函数名列表)；没有开启工具检索时包含全部函数
+    """
+    if TOOL_RETRIEVAL_TOP_K <= 0:
+        return codegen_prompt, functions_name_list
 
-    # 构建消息
-    messages = [
-        SystemMessage(content="你是一个移动通信服务的智能助手"),
-        HumanMessage(content=prompt)
-    ]
+    names = tuple(tool_retriever.retrieve(query, TOOL_RETRIEVAL_TOP_K))
+    with _codegen_prompts_lock:
+        prompt = _codegen_prompts.get(names)
+        if prompt is None:
+            prompt = _codegen_prompts[names] = StablePromptPrefix(
+                codegen_prompt.system_message, PROMPT_TEMPLATE,
+                functions_schema=tools.render_schema(SCHEMA_MODE, names)
+            )
+            while len(_codegen_prompts) > CODEGEN_PROMPT_CACHE_SIZE:
+                _codegen_prompts.popitem(last=False)
+        else:
+            _codegen_prompts.move_to_end(names)
+    return prompt, list(names)
+
+
+def record_tool_selection(tool_names: List[str], code: Optional[str]) -> None:
+    """开启工具检索时，记录生成的代码是否调用了提示词之外的函数（检索漏掉了查询需要的函数）"""
+    if TOOL_RETRIEVAL_TOP_K <= 0 or not code:
+        return
+    selected = set(tool_names)
+    unselected = [name for name in analyze_calls(code, functions_name_list).called_functions if name not in selected]
+    unknown = unknown_calls(code, [*functions_name_list, *EXECUTION_GLOBAL_NAMES])
+    tool_retriever.record_generation(unselected, unknown)
+
+
+def record_calls(functions: Dict[str, Callable]) -> tuple[Dict[str, Callable], List[str]]:
+    """
+    包装工具函数，记录代码执行时实际调用到的函数
     
-    start_time = time.time()
+    Returns:
+        (包装后的函数字典, 调用到的函数名列表，按首次调用的顺序排列，执行过程中实时更新)
+    """
+    called: List[str] = []
+    lock = threading.Lock()
+
+    def wrap(name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with lock:
+                if name not in called:
+                    called.append(name)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return {name: wrap(name, func) for name, func in functions.items()}, called
+
+
+def check_generated_code(code: Optional[str]) -> None:
+    """
+    验证生成的代码，不通过时抛出异常
+
+    Raises:
+        Exception: 没有代码或验证失败，异常信息为失败原因
+    """
+    if not code:
+        raise Exception("未找到可执行代码")
+
+    valid, message = validate_generated_code(code, functions_name_list)
+    if not valid:
+        raise Exception(f"代码验证失败: {message}")
+
+
+def calls_side_effect_functions(code: Optional[str]) -> bool:
+    """生成的代码是否调用了有副作用的函数"""
+    if not code:
+        return False
+    return bool(set(analyze_calls(code, functions_name_list).called_functions) & SIDE_EFFECT_FUNCTIONS)
+
+
+def run_generated_code(code: Optional[str],
+                       on_tool_result: Optional[Callable[[str, Any, float], None]] = None,
+                       call_memo: Optional[SharedCallMemo] = None,
+                       deadline: Optional[Deadline] = None) -> tuple[str, list[str]]:
+    """
+    验证并执行生成的代码
     
+    该函数会阻塞（生成代码中的工具调用均为同步调用），异步调用方需放到线程池中执行
+    
+    Args:
+        code: 从模型响应中提取的代码
+        on_tool_result: 可选，代码取得工具调用结果时的回调 (函数名, 返回值, 耗时毫秒)，没有被取用的预取不会回调
+        call_memo: 可选，与其他查询共享的工具调用结果，参数相同的只读调用只执行一次
+        deadline: 可选，请求的截止时间，过期后的工具调用抛出 DeadlineExceeded
+        
+    Returns:
+        tuple: (响应文本, 执行的函数列表)
+    """
+    check_generated_code(code)
+
+    functions = load_functions()
+    if deadline is not None:
+        functions = deadline.wrap(functions)
+    if call_memo is not None:
+        functions = call_memo.wrap(functions, exclude=SIDE_EFFECT_FUNCTIONS)
+
+    # 并发预取代码中一定会执行、相互独立的工具调用，再执行代码；on_tool_result 只在代码取用结果时回调
+    mock_functions, prefetcher = parallelize_tool_calls(code, functions, exclude=SIDE_EFFECT_FUNCTIONS,
+                                                        on_result=on_tool_result)
+    mock_functions, executed_functions = record_calls(mock_functions)
     try:
-        # 获取模型响应
-        response = chat.invoke(messages)  # 使用 invoke 而不是直接调用
+        local_vars = execute_code(code, mock_functions)
+    finally:
+        prefetch_metrics.record(prefetcher, prefetcher.cancel_unused())
+    if deadline is not None:
+        # 代码用裸 except 吞掉了超时时，执行完成后仍然按超时处理
+        deadline.check('execution')
+
+    # 获取执行结果
+    response_text = local_vars.get('_return_value', '执行完成，但没有返回值')
+
+    return str(response_text), executed_functions
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """获取（首次调用时创建）沙箱进程池，工作进程预先加载好工具函数"""
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        _sandbox_pool = SandboxPool(warmup='mservice:load_functions', runner='mservice:run_generated_code',
+                                    event_arg='on_tool_result')
+    return _sandbox_pool
+
+
+def execute_generated_code(code: Optional[str],
+                           call_memo: Optional[SharedCallMemo] = None,
+                           deadline: Optional[Deadline] = None,
+                           on_tool_result: Optional[Callable[[str, Any, float], None]] = None) -> tuple[str, list[str]]:
+    """
+    按 EXECUTION_BACKEND 配置执行生成的代码
+    
+    Args:
+        code: 从模型响应中提取的代码
+        call_memo: 可选，与其他查询共享的工具调用结果（沙箱进程之间无法共享，沙箱模式下忽略）
+        deadline: 可选，请求的截止时间（沙箱模式下作为任务的超时时间）
+        on_tool_result: 可选，代码取得工具调用结果时的回调（沙箱模式下由工作进程经 Pipe 转发，在当前线程中回调）
         
-        # 提取代码
-        code = extract_python_code(response.content)
-        if not code:
-            raise Exception("未找到可执行代码")
-            
-        # 验证代码
-        valid, message = validate_generated_code(code, functions_name_list)
-        if not valid:
-            raise Exception(f"代码验证失败: {message}")
-            
-        # 执行代码
-        mock_functions = load_functions()
-        local_vars = execute_code(code, mock_functions.copy())
+    Returns:
+        tuple: (响应文本, 执行的函数列表)
         
-        # 获取执行结果
-        response_text = local_vars.get('_return_value', '执行完成，但没有返回值')
+    Raises:
+        DeadlineExceeded: 执行超过截止时间
+    """
+    if EXECUTION_BACKEND == 'sandbox':
+        if deadline is None:
+            return get_sandbox_pool().run(code, on_event=on_tool_result)
+        deadline.check('execution')
+        try:
+            return get_sandbox_pool().run(code, timeout=deadline.remaining(), on_event=on_tool_result)
+        except SandboxTimeout:
+            raise DeadlineExceeded('execution') from None
+    return run_generated_code(code, on_tool_result, call_memo, deadline)
+
+
+class CodeAttempts:
+    """
+    一个查询的代码生成与修复过程，同步、异步和流式处理共用，调用方只负责调用模型和执行代码
+
+    第一次尝试优先使用缓存的代码模板，缓存的代码执行失败时删除模板、改为调用模型生成；
+    生成的代码验证或执行失败时，把错误发回给模型修复，直到成功或修复预算用完（见 code_repair.py）
+
+    Example:
+        attempts = CodeAttempts(query, deadline)
+        while True:
+            code = attempts.cached_code()
+            if code is None:
+                request_messages, request_kwargs = attempts.start_generation()
+                response = chat.invoke(request_messages, **request_kwargs)
+                code = attempts.generated(response.content, response)
+            try:
+                attempts.validate(code)
+                response_text, executed_functions = execute_generated_code(code)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if not attempts.retry(e):
+                    raise
+                continue
+            attempts.succeed()
+            return response_text, executed_functions
+    """
+
+    def __init__(self, query: str, deadline: Optional[Deadline] = None):
+        """
+        Args:
+            query: 用户查询文本
+            deadline: 可选，请求的截止时间，修复预算不会超过它
+        """
+        self.query = query
+        self.budget = RepairBudget(deadline=deadline.expires_at if deadline else None)
+        self.cache_hit = False  # 当前尝试的代码是否来自缓存
+        self.stage = 'validation'  # 当前尝试进行到的阶段：validation / execution
+        self.prompt: Optional[StablePromptPrefix] = None
+        self.tool_names: List[str] = []
+        self._cached = codegen_cache.get(query)
+        self._messages: list = []
+        self._request_messages: list = []
+        self._response_content = ''
+        self._code: Optional[str] = None
+        self._generation_start = 0.0
+        self._generation_time = 0.0
+        self._execution_start = 0.0
+
+    def cached_code(self) -> Optional[str]:
+        """第一次尝试时返回缓存的代码（已绑定当前查询的实体），之后的尝试和未命中时返回 None"""
+        code, self._cached = self._cached, None
+        self.cache_hit = code is not None
+        return code
+
+    def start_generation(self) -> tuple[list, Dict[str, Any]]:
+        """
+        开始一次模型生成（第一次调用时才检索工具、构造提示词）
+
+        Returns:
+            (请求消息, 模型调用参数)，修复时请求消息包含上一次的回答和错误信息
+        """
+        if self.prompt is None:
+            self.prompt, self.tool_names = get_codegen_prompt(self.query)
+            self._messages = self._request_messages = self.prompt.build_messages(self.query)
+        self._generation_start = time.time()
+        return self._request_messages, self.prompt.request_kwargs()
+
+    def generated(self, content: str, usage: Any) -> Optional[str]:
+        """
+        模型生成完成
+
+        Args:
+            content: 模型回答的完整文本
+            usage: 带 usage_metadata 的响应或最后一个流式分块，用于前缀缓存统计
+
+        Returns:
+            从回答中提取的代码
+        """
+        self.prompt.record(usage)
+        self._generation_time = time.time() - self._generation_start
+        self._response_content = content
+        code = extract_python_code(content)
+        record_tool_selection(self.tool_names, code)
+        return code
+
+    def validate(self, code: Optional[str]) -> None:
+        """
+        验证本次尝试的代码，通过后由调用方执行
+
+        Raises:
+            Exception: 没有代码或验证失败
+        """
+        self._code = code
+        self.stage = 'validation'
+        self._execution_start = time.time()
+        check_generated_code(code)
+        self.stage = 'execution'
+
+    def retry(self, error: BaseException) -> bool:
+        """
+        本次尝试验证或执行失败，判断是否再尝试一次
+
+        Returns:
+            是否继续：缓存的代码失败时改为调用模型生成，生成的代码失败时让模型修复；
+            执行阶段出错且代码调用了有副作用的函数时不再尝试
+        """
+        side_effects = self.stage == 'execution' and calls_side_effect_functions(self._code)
+        if self.cache_hit:
+            codegen_cache.invalidate(self.query)
+            if side_effects:
+                return False
+            print(f"缓存的代码{REPAIR_STAGE_NAMES[self.stage]}失败，改为调用模型生成: {error}")
+            return True
+
+        self.budget.record(self._generation_time, time.time() - self._execution_start, error, self.stage)
+        if not self.budget.can_repair(side_effects):
+            repair_metrics.record(self.budget, False)
+            return False
+        self._request_messages = self.budget.repair_messages(self._messages, self._response_content)
+        return True
+
+    def succeed(self) -> None:
+        """本次尝试执行成功：记录修复统计，缓存生成的代码"""
+        if self.cache_hit:
+            return
+        self.budget.record(self._generation_time, time.time() - self._execution_start)
+        repair_metrics.record(self.budget, True)
+        codegen_cache.put(self.query, self._code)
+
+
+def generate_and_execute(query: str, call_memo: Optional[SharedCallMemo] = None,
+                         deadline: Optional[Deadline] = None) -> tuple[str, list[str]]:
+    """
+    生成并执行查询对应的代码：优先使用缓存的代码模板，未命中或缓存的代码执行失败时调用模型；
+    生成的代码验证或执行失败时，把错误发回给模型修复，直到成功或修复预算用完（见 CodeAttempts）
+    
+    Args:
+        query: 用户查询文本
+        call_memo: 可选，与其他查询共享的工具调用结果
+        deadline: 可选，请求的截止时间。同步的模型调用无法中途取消，只在调用前后检查
         
-        # 提取执行的函数列表
-        executed_functions = []
-        for func in functions_name_list:
-            if func in code:
-                executed_functions.append(func)
+    Returns:
+        tuple: (响应文本, 执行的函数列表)
+        
+    Raises:
+        DeadlineExceeded: 超过截止时间
+        Exception: 代码执行失败且不再修复时，抛出最后一次的错误
+    """
+    attempts = CodeAttempts(query, deadline)
+    while True:
+        code = attempts.cached_code()
+        if code is None:
+            if deadline is not None:
+                deadline.check('generation')
+            request_messages, request_kwargs = attempts.start_generation()
+            response = chat.invoke(request_messages, **request_kwargs)
+            if deadline is not None:
+                deadline.check('generation')
+            code = attempts.generated(response.content, response)
+
+        try:
+            attempts.validate(code)
+            response_text, executed_functions = execute_generated_code(code, call_memo, deadline)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not attempts.retry(e):
+                raise
+            continue
+
+        attempts.succeed()
+        return response_text, executed_functions
+
+
+async def agenerate_and_execute(query: str,
+                                call_memo: Optional[SharedCallMemo] = None,
+                                generation_limiter: Optional[asyncio.Semaphore] = None,
+                                deadline: Optional[Deadline] = None,
+                                on_tool_result: Optional[Callable[[str, Any, float], None]] = None,
+                                on_code_ready: Optional[Callable[[str], None]] = None
+                                ) -> tuple[str, list[str]]:
+    """
+    generate_and_execute 的异步版本：通过 ainvoke 等待模型响应，代码的执行放到 tool_executor 线程池中
+    
+    Args:
+        query: 用户查询文本
+        call_memo: 可选，与其他查询共享的工具调用结果
+        generation_limiter: 可选，限制同时进行的模型调用数量
+        deadline: 可选，请求的截止时间，超时后取消模型调用、放弃代码执行
+        on_tool_result: 可选，每个工具调用完成时的回调，超时时调用方可以据此返回部分结果
+        on_code_ready: 可选，每次开始执行代码前以代码为参数的回调
+        
+    Returns:
+        tuple: (响应文本, 执行的函数列表)
+        
+    Raises:
+        DeadlineExceeded: 超过截止时间
+    """
+    loop = asyncio.get_running_loop()
+    deadline = deadline or Deadline()
+
+    async def execute(code: str) -> tuple[str, list[str]]:
+        if on_code_ready is not None:
+            on_code_ready(code)
+        # 阻塞的代码执行交给线程池；超时后不再等待，线程中的代码在下一次工具调用时结束
+        return await deadline.run(loop.run_in_executor(
+            tool_executor, execute_generated_code, code, call_memo, deadline, on_tool_result
+        ), 'execution')
+
+    async def generate() -> Optional[str]:
+        request_messages, request_kwargs = attempts.start_generation()
+        async with generation_limiter or contextlib.nullcontext():
+            response = await chat.ainvoke(request_messages, **request_kwargs)
+        return attempts.generated(response.content, response)
+
+    attempts = CodeAttempts(query, deadline)
+    while True:
+        code = attempts.cached_code()
+        if code is None:
+            code = await deadline.run(generate(), 'generation')
+
+        try:
+            attempts.validate(code)
+            response_text, executed_functions = await execute(code)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if not attempts.retry(e):
+                raise
+            continue
+
+        attempts.succeed()
+        return response_text, executed_functions
+
+
+def handle_query(query: str, timeout: Optional[float] = None) -> tuple[float, str, list[str]]:
+    """
+    处理单个查询请求，返回执行时间、响应文本和执行的函数列表
+    
+    Args:
+        query: 用户查询文本
+        timeout: 可选，超时时间（秒），默认使用服务的默认超时
+        
+    Returns:
+        tuple: (执行时间（毫秒）, 响应文本, 执行的函数列表)
+    """
+    start_time = time.time()
+    
+    try:
+        response_text, executed_functions = generate_and_execute(query, deadline=Deadline(timeout))
         
         # 计算总执行时间（毫秒）
         execution_time = (time.time() - start_time) * 1000
         
-        return execution_time, str(response_text), executed_functions
+        return execution_time, response_text, executed_functions
         
-    except Exception as e:
+    except (DeadlineExceeded, Exception) as e:
         # 计算执行时间（即使发生错误）
         execution_time = (time.time() - start_time) * 1000
         error_message = f"处理查询时出错: {str(e)}"
         return execution_time, error_message, []
 
 
-def generate_suggestions(user_query: str, query_response: str) -> str:
+async def ahandle_query(query: str,
+                        call_memo: Optional[SharedCallMemo] = None,
+                        generation_limiter: Optional[asyncio.Semaphore] = None,
+                        deadline: Optional[Deadline] = None) -> tuple[float, str, list[str]]:
     """
-    根据用户查询和查询结果生成智能建议
+    handle_query 的异步版本：通过 ainvoke 等待模型响应，生成代码的执行放到 tool_executor 线程池中，
+    整个过程不会阻塞事件循环
+    
+    Args:
+        query: 用户查询文本
+        call_memo: 可选，与其他查询共享的工具调用结果
+        generation_limiter: 可选，限制同时进行的模型调用数量
+        deadline: 可选，请求的截止时间，默认使用服务的默认超时
+        
+    Returns:
+        tuple: (执行时间（毫秒）, 响应文本, 执行的函数列表)
+    """
+    start_time = time.time()
+
+    try:
+        response_text, executed_functions = await agenerate_and_execute(
+            query, call_memo, generation_limiter, deadline
+        )
+
+        execution_time = (time.time() - start_time) * 1000
+        return execution_time, response_text, executed_functions
+
+    except (DeadlineExceeded, Exception) as e:
+        execution_time = (time.time() - start_time) * 1000
+        error_message = f"处理查询时出错: {str(e)}"
+        return execution_time, error_message, []
+
+
+async def aprocess_query(query: str,
+                         need_suggestion: bool = False,
+                         deadline: Optional[Deadline] = None,
+                         call_memo: Optional[SharedCallMemo] = None,
+                         generation_limiter: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+    """
+    在截止时间内处理查询并按需生成建议
+    
+    截止时间过后：正在进行的模型调用被取消，代码执行不再等待（已完成的工具调用结果作为部分结果返回），
+    建议生成被跳过；timed_out_stage 为超时的阶段（generation / execution / suggestion），未超时时为 None
+    
+    建议优先由规则根据工具调用结果生成（suggestion_rules.py）；规则不命中时调用建议模型，模型调用在代码执行期间
+    就根据已完成的工具调用结果开始推测生成（speculative_suggestion.py）
+    
+    Args:
+        query: 用户查询文本
+        need_suggestion: 是否生成建议
+        deadline: 可选，请求的截止时间，默认使用服务的默认超时
+        call_memo: 可选，与其他查询共享的工具调用结果
+        generation_limiter: 可选，限制同时进行的模型调用数量（建议生成也受它限制）
+        
+    Returns:
+        包含 execution_time、response、executed_functions、suggestion、timed_out_stage、partial_results 的字典
+    """
+    start_time = time.time()
+    deadline = deadline or Deadline()
+    tool_results: List[Dict[str, Any]] = []
+    timed_out_stage = None
+    partial_results = None
+    failed = False
+
+    async def suggest_within_limit(user_query: str, query_response: str) -> str:
+        async with generation_limiter or contextlib.nullcontext():
+            return await ainvoke_suggestion_model(user_query, query_response)
+
+    speculation = None
+    if need_suggestion and SPECULATIVE_SUGGESTION_ENABLED:
+        speculation = SpeculativeSuggestion(query, suggest_within_limit, suggestion_metrics,
+                                            skip=suggestion_rules.matches)
+
+    def on_code_ready(code: str) -> None:
+        # 每次尝试（缓存的代码、修复后的代码）开始执行前调用：失败尝试的工具调用结果作废，
+        # 上一次尝试的代码执行已经结束，不会再追加结果
+        tool_results.clear()
+        if speculation is not None:
+            speculation.set_code(code, functions_name_list)
+
+    def on_tool_result(name: str, result: Any, elapsed: float) -> None:
+        item = {"function": name, "result": result, "elapsed": elapsed}
+        if isinstance(result, ToolResult):
+            item["data"] = result.to_dict()
+        tool_results.append(item)
+        if speculation is not None:
+            speculation.on_tool_result(name, result)
+
+    try:
+        response_text, executed_functions = await agenerate_and_execute(
+            query, call_memo, generation_limiter, deadline, on_tool_result, on_code_ready
+        )
+    except DeadlineExceeded as e:
+        timed_out_stage = e.stage
+        # tool_results 只包含最后一次尝试中代码取用了的结果；超时之后被放弃的代码执行可能还会追加结果，
+        # 这里只取超时时已完成的部分
+        partial_results = list(tool_results)
+        executed_functions = list(dict.fromkeys(item["function"] for item in partial_results))
+        response_text = "\n".join([f"处理查询超时（{STAGE_NAMES[e.stage]}阶段），以下为已完成的部分结果："] +
+                                  [str(item["result"]) for item in partial_results])
+    except Exception as e:
+        failed = True
+        response_text = f"处理查询时出错: {str(e)}"
+        executed_functions = []
+    execution_time = (time.time() - start_time) * 1000
+
+    suggestion = None
+    if need_suggestion and timed_out_stage is None:
+        # 出错时工具调用结果来自失败的尝试，不使用规则和推测，直接根据错误信息生成建议；
+        # 沙箱模式下没有逐个的工具调用结果，规则在响应文本上评估
+        if not failed:
+            suggestion = suggestion_rules.suggest([item["result"] for item in tool_results] or [response_text])
+            if suggestion is None:
+                suggestion_rules.record_fallback()
+        if suggestion is None:
+            try:
+                if speculation is not None and not failed:
+                    suggestion = await speculation.take(deadline)
+                if suggestion is None:
+                    suggestion = await deadline.run(suggest_within_limit(query, response_text), 'suggestion')
+            except DeadlineExceeded:
+                timed_out_stage = 'suggestion'
+    elif need_suggestion and timed_out_stage == 'execution':
+        # 代码执行超时：规则或已经根据部分结果生成好的推测建议仍然返回
+        suggestion = suggestion_rules.suggest([item["result"] for item in partial_results])
+        if suggestion is None and speculation is not None:
+            suggestion = speculation.take_ready()
+    if speculation is not None:
+        speculation.finish()
+
+    deadline_metrics.record(timed_out_stage)
+    return {
+        "execution_time": execution_time,
+        "response": response_text,
+        "executed_functions": executed_functions,
+        "suggestion": suggestion,
+        "timed_out_stage": timed_out_stage,
+        "partial_results": partial_results
+    }
+
+
+async def ahandle_batch(queries: List[str], need_suggestion: bool = False,
+                        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    批量处理查询
+    
+    - 同时进行的模型调用数量不超过 max_concurrency（不超过服务端上限 BATCH_MAX_CONCURRENCY）
+    - 完全相同的查询只处理一次
+    - 不同查询中参数相同的只读工具调用（比如同一号码的余额）只执行一次
+    
+    Args:
+        queries: 用户查询文本列表
+        need_suggestion: 是否为每个查询生成建议
+        max_concurrency: 同时进行的模型调用数量上限，来自客户端，超过 BATCH_MAX_CONCURRENCY 时按它截断
+        timeout: 可选，整个批次的超时时间（秒），所有查询共用同一个截止时间
+        
+    Returns:
+        包含每个查询的结果（与 queries 顺序一致）和整体耗时、去重统计的字典
+    """
+    start_time = time.time()
+    limiter = asyncio.Semaphore(max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY)))
+    call_memo = SharedCallMemo()
+    deadline = Deadline(timeout)
+
+    unique_queries = list(dict.fromkeys(queries))
+    unique_results = await asyncio.gather(*(
+        aprocess_query(query, need_suggestion, deadline, call_memo, limiter) for query in unique_queries
+    ))
+    result_by_query = dict(zip(unique_queries, unique_results))
+    results = [result_by_query[query] for query in queries]
+
+    return {
+        "results": results,
+        "total_time": (time.time() - start_time) * 1000,
+        "sum_execution_time": sum(result["execution_time"] for result in unique_results),
+        "deduplicated_queries": len(queries) - len(unique_queries),
+        "tool_calls": call_memo.stats['calls'],
+        "deduplicated_tool_calls": call_memo.stats['deduplicated']
+    }
+
+
+async def astream_query(query: str, need_suggestion: bool = False,
+                        timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    流式处理查询，按发生顺序产出事件，调用方不必等整个流程结束才拿到第一个字节
+    
+    事件类型：
+    - token: 模型生成代码过程中的增量文本（命中代码缓存时没有）
+    - code_ready: 代码已生成，包含代码和是否来自缓存
+    - tool_result: 某个工具调用完成，包含函数名、返回值和耗时；结构化的结果（见 structured_results.py）另有 data 字段
+    - repair: 生成的代码验证或执行失败，正在让模型修复（之后会重新产出 token、code_ready 等事件）；
+      cached 为 True 时是缓存的代码执行失败，改为调用模型生成
+    - result: 代码执行完成，包含执行时间、响应文本和执行的函数列表
+    - suggestion_token / suggestion: 建议的增量文本和完整建议（need_suggestion 为 True 时）；
+      规则命中或代码执行期间推测生成的建议可用时没有 suggestion_token，suggestion 中 rule 或 speculative 为 True
+    - timeout: 超过截止时间，包含超时的阶段（之前产出的 tool_result 即为部分结果）
+    - error: 处理出错
+    - done: 流程结束，包含总耗时
+    
+    Args:
+        query: 用户查询文本
+        need_suggestion: 是否生成建议
+        timeout: 可选，超时时间（秒），默认使用服务的默认超时
+        
+    Yields:
+        事件字典，event 字段为事件类型
+    """
+    start_time = time.time()
+    deadline = Deadline(timeout)
+    timed_out_stage = None
+    loop = asyncio.get_running_loop()
+    tool_events: asyncio.Queue = asyncio.Queue()
+    tool_results: List[Any] = []
+    speculation = None
+    if need_suggestion and SPECULATIVE_SUGGESTION_ENABLED:
+        speculation = SpeculativeSuggestion(query, ainvoke_suggestion_model, suggestion_metrics,
+                                            skip=suggestion_rules.matches)
+
+    def on_tool_result(name: str, result: Any, elapsed: float) -> None:
+        tool_results.append(result)
+        if speculation is not None:
+            speculation.on_tool_result(name, result)
+        event = {
+            "event": "tool_result",
+            "function": name,
+            "result": result if isinstance(result, (list, dict)) else str(result),
+            "elapsed": elapsed
+        }
+        if isinstance(result, ToolResult):
+            event["data"] = result.to_dict()
+        # 在执行代码的线程中被调用，转交给事件循环
+        loop.call_soon_threadsafe(tool_events.put_nowait, event)
+
+    try:
+        attempts = CodeAttempts(query, deadline)
+        while True:
+            code = attempts.cached_code()
+            if code is None:
+                request_messages, request_kwargs = attempts.start_generation()
+                chunks = []
+                usage_chunk = None
+                model_stream = chat.astream(request_messages, **request_kwargs)
+                async for chunk in deadline.iterate(model_stream, 'generation'):
+                    chunks.append(chunk.content)
+                    if getattr(chunk, 'usage_metadata', None):
+                        usage_chunk = chunk
+                    yield {"event": "token", "content": chunk.content}
+                code = attempts.generated("".join(chunks), usage_chunk)
+            yield {"event": "code_ready", "code": code, "cached": attempts.cache_hit}
+            if speculation is not None:
+                speculation.set_code(code, functions_name_list)
+
+            try:
+                attempts.validate(code)
+                # 与其他接口相同按 EXECUTION_BACKEND 执行，沙箱模式下工具调用结果由工作进程转发
+                execution = loop.run_in_executor(tool_executor, execute_generated_code, code, None, deadline,
+                                                 on_tool_result)
+
+                # 代码执行期间，工具调用一完成就转发；超时后不再等待，线程中的代码在下一次工具调用时结束
+                while True:
+                    next_event = asyncio.ensure_future(tool_events.get())
+                    done, _ = await asyncio.wait({execution, next_event}, timeout=deadline.remaining(),
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        next_event.cancel()
+                        raise DeadlineExceeded('execution')
+                    if next_event not in done:
+                        next_event.cancel()
+                        break
+                    yield next_event.result()
+                while not tool_events.empty():
+                    yield tool_events.get_nowait()
+
+                response_text, executed_functions = execution.result()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if not attempts.retry(e):
+                    raise
+                # 失败尝试的工具调用结果不再用于建议
+                tool_results.clear()
+                yield {"event": "repair", "attempt": len(attempts.budget.attempts) + 1, "stage": attempts.stage,
+                       "error": str(e), "cached": attempts.cache_hit}
+                continue
+
+            attempts.succeed()
+            break
+
+        yield {
+            "event": "result",
+            "execution_time": (time.time() - start_time) * 1000,
+            "response": response_text,
+            "executed_functions": executed_functions
+        }
+
+        rule_suggestion = suggestion_rules.suggest(tool_results or [response_text]) if need_suggestion else None
+        if rule_suggestion is not None:
+            yield {"event": "suggestion", "content": rule_suggestion, "rule": True}
+        elif need_suggestion:
+            suggestion_rules.record_fallback()
+            speculative_suggestion = await speculation.take(deadline) if speculation is not None else None
+            if speculative_suggestion is not None:
+                yield {"event": "suggestion", "content": speculative_suggestion, "speculative": True}
+            else:
+                parts = []
+                suggestion_stream = suggest.astream(build_suggestion_messages(query, response_text))
+                async for chunk in deadline.iterate(suggestion_stream, 'suggestion'):
+                    parts.append(chunk.content)
+                    yield {"event": "suggestion_token", "content": chunk.content}
+                yield {"event": "suggestion", "content": "".join(parts)}
+
+    except DeadlineExceeded as e:
+        timed_out_stage = e.stage
+        yield {"event": "timeout", "stage": e.stage, "message": f"处理查询超时（{STAGE_NAMES[e.stage]}阶段）"}
+    except Exception as e:
+        yield {"event": "error", "message": f"处理查询时出错: {str(e)}"}
+    finally:
+        if speculation is not None:
+            speculation.finish()
+
+    deadline_metrics.record(timed_out_stage)
+
+    yield {"event": "done", "total_time": (time.time() - start_time) * 1000}
+
+
+def build_suggestion_messages(user_query: str, query_response: str) -> list:
+    """
+    构造生成建议请求的消息列表
     
     Args:
         user_query: 用户的原始查询文本
         query_response: 查询的响应结果
         
     Returns:
-        str: 生成的建议内容
+        发送给建议模型的消息列表
     """
-    _system_message = """你是一个移动通信服务的智能助手, 接下来会传递针对用户的查询的响应内容。
-    你需要根据查询结果，生成一句话建议。诸如：
-    1. 如果用户欠费则建议用户尽快进行充值，并提供一些充值渠道建议。
-    2. 如果用户的某增值服务用量小于三分之一，则建议用户升级该增值服务。
-    3. 如果用户购买了多项增值服务，可以建议用户评估下是否需要调整套餐。
-    """
-    messages = [
-        SystemMessage(content=_system_message),
+    return [
+        SystemMessage(content=SUGGESTION_SYSTEM_MESSAGE),
         HumanMessage(content=f"用户查询内容:\n{user_query}\n查询结果:\n{query_response}")
     ]
-    response = suggest.invoke(messages)
+
+
+def generate_suggestions(user_query: str, query_response: str, tool_results: Optional[List[Any]] = None) -> str:
+    """
+    根据用户查询和查询结果生成智能建议，规则命中时直接返回规则的建议，否则调用建议模型
+    
+    Args:
+        user_query: 用户的原始查询文本
+        query_response: 查询的响应结果
+        tool_results: 可选，各工具调用的返回值，没有时规则在响应文本上评估
+        
+    Returns:
+        str: 生成的建议内容
+    """
+    suggestion = suggestion_rules.suggest(tool_results or [query_response])
+    if suggestion is not None:
+        return suggestion
+    suggestion_rules.record_fallback()
+    response = suggest.invoke(build_suggestion_messages(user_query, query_response))
+    return response.content
+
+
+async def agenerate_suggestions(user_query: str, query_response: str, tool_results: Optional[List[Any]] = None) -> str:
+    """
+    generate_suggestions 的异步版本
+    
+    Args:
+        user_query: 用户的原始查询文本
+        query_response: 查询的响应结果
+        tool_results: 可选，各工具调用的返回值，没有时规则在响应文本上评估
+        
+    Returns:
+        str: 生成的建议内容
+    """
+    suggestion = suggestion_rules.suggest(tool_results or [query_response])
+    if suggestion is not None:
+        return suggestion
+    suggestion_rules.record_fallback()
+    return await ainvoke_suggestion_model(user_query, query_response)
+
+
+async def ainvoke_suggestion_model(user_query: str, query_response: str) -> str:
+    """
+    直接调用建议模型生成建议（不经过规则）
+    
+    Args:
+        user_query: 用户的原始查询文本
+        query_response: 查询的响应结果
+        
+    Returns:
+        str: 生成的建议内容
+    """
+    response = await suggest.ainvoke(build_suggestion_messages(user_query, query_response))
     return response.content
 
 
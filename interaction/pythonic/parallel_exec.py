@@ -0,0 +1,235 @@
+"""
+生成代码中工具调用的自动并行化
+
+模型生成的代码大多按顺序逐个调用工具函数，每次调用约 1 秒。执行前先分析代码的 AST，
+找出参数不依赖其他调用结果的工具调用（参数都是字面量，或只被赋值过一次的字面量变量），
+把它们提前并发派发；代码真正执行到这些调用时直接取回预取的结果。
+只预取代码执行时一定会调用的（位于顶层顺序执行的语句中的）调用：分支、循环中的调用可能不会执行，
+提前调用会带来额外的负载和延迟。
+这样无论模型生成的是顺序代码还是多线程代码，总的工具耗时都约等于最慢的那一次调用。
+"""
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from code_analysis import analyze_calls
+
+# 预取工具调用使用的线程池
+PREFETCH_MAX_WORKERS = 64
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="tool-prefetch")
+
+
+def call_key(name: str, args: tuple, kwargs: dict) -> Tuple[str, str, str]:
+    """构造工具调用的匹配键（参数可能是 list/dict 等不可哈希对象，使用 repr）"""
+    return name, repr(args), repr(sorted(kwargs.items()))
+
+
+def timed_call(func: Callable, args: tuple, kwargs: dict) -> Tuple[Any, float]:
+    """调用 func，返回 (返回值, 耗时毫秒)"""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, (time.time() - start) * 1000
+
+
+def find_independent_calls(code: str, function_names: Iterable[str],
+                           exclude: Iterable[str] = ()) -> List[Tuple[str, tuple, dict]]:
+    """
+    找出生成代码中可以提前并发执行的工具调用
+
+    Args:
+        code: 生成的代码
+        function_names: 工具函数名列表
+        exclude: 不允许提前执行的函数（有副作用的写操作）
+
+    Returns:
+        去重后的 (函数名, 位置参数, 关键字参数) 列表，按在代码中出现的顺序排列
+    """
+    analysis = analyze_calls(code, function_names)
+    exclude = set(exclude)
+
+    calls = []
+    seen = set()
+    for call in analysis.calls:
+        if call.name in exclude or not call.resolved or not call.unconditional:
+            # 有副作用、参数依赖运行时的值（比如其他调用的结果），或者不一定会执行，只能在执行时调用
+            continue
+        key = call_key(call.name, call.args, call.kwargs)
+        if key not in seen:
+            seen.add(key)
+            calls.append((call.name, call.args, call.kwargs))
+
+    return calls
+
+
+class ToolCallPrefetcher:
+    """
+    预取工具调用结果，并生成在执行时取回预取结果的包装函数
+
+    每个预取结果只被取用一次：同样参数的后续调用会真正执行，保证与顺序执行的语义一致。
+    """
+
+    def __init__(self, functions: Dict[str, Callable],
+                 on_result: Optional[Callable[[str, Any, float], None]] = None):
+        """
+        Args:
+            functions: 工具函数字典
+            on_result: 可选，代码取得工具调用结果时的回调 (函数名, 返回值, 耗时毫秒)；
+                只在执行的代码取用了结果（命中预取或直接调用）时回调，没有被取用的预取不会回调
+        """
+        self.functions = functions
+        self.on_result = on_result
+        self._pending: Dict[Tuple[str, str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'prefetched': 0,  # 提前派发的调用数
+            'hits': 0,  # 执行时命中预取结果的调用数
+            'direct': 0  # 执行时直接调用的次数
+        }
+
+    def prefetch(self, calls: List[Tuple[str, tuple, dict]]) -> None:
+        """并发派发工具调用"""
+        for name, args, kwargs in calls:
+            key = call_key(name, args, kwargs)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending[key] = _prefetch_executor.submit(timed_call, self.functions[name], args, kwargs)
+                self.stats['prefetched'] += 1
+
+    def wrap(self) -> Dict[str, Callable]:
+        """返回包装后的函数字典，调用参数与某个预取调用一致时直接返回其结果"""
+        wrapped = dict(self.functions)
+        for name, func in self.functions.items():
+            wrapped[name] = self._wrap_function(name, func)
+        return wrapped
+
+    def _wrap_function(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                future = self._pending.pop(call_key(name, args, kwargs), None)
+                self.stats['direct' if future is None else 'hits'] += 1
+            if future is not None:
+                # 预取调用抛出的异常会在这里重新抛出，与顺序执行时的位置一致
+                result, elapsed = future.result()
+            else:
+                result, elapsed = timed_call(func, args, kwargs)
+            if self.on_result is not None:
+                self.on_result(name, result, elapsed)
+            return result
+
+        return wrapper
+
+    def cancel_unused(self) -> int:
+        """取消还未开始执行的多余预取（例如代码在调用前抛出了异常），返回未被取用的预取数量"""
+        with self._lock:
+            unused = list(self._pending.values())
+            self._pending.clear()
+        for future in unused:
+            future.cancel()
+        return len(unused)
+
+
+class PrefetchMetrics:
+    """汇总各次代码执行的预取统计，通过 /api/stats 查看"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            'executions': 0,  # 执行的代码数
+            'prefetched': 0,
+            'hits': 0,
+            'direct': 0,
+            'unused': 0  # 预取了但没有被代码取用的调用数（例如代码在调用前抛出了异常）
+        }
+
+    def record(self, prefetcher: ToolCallPrefetcher, unused: int) -> None:
+        """记录一次代码执行的预取结果"""
+        with self._lock:
+            self.stats['executions'] += 1
+            for key in ('prefetched', 'hits', 'direct'):
+                self.stats[key] += prefetcher.stats[key]
+            self.stats['unused'] += unused
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['hit_rate'] = stats['hits'] / stats['prefetched'] if stats['prefetched'] else 0.0
+        return stats
+
+
+def parallelize_tool_calls(code: str, functions: Dict[str, Callable], exclude: Iterable[str] = (),
+                           on_result: Optional[Callable[[str, Any, float], None]] = None
+                           ) -> Tuple[Dict[str, Callable], ToolCallPrefetcher]:
+    """
+    分析生成的代码，并发预取其中相互独立的工具调用
+
+    Args:
+        code: 生成的代码
+        functions: 工具函数字典
+        exclude: 不允许提前执行的函数（有副作用的写操作）
+        on_result: 可选，代码取得工具调用结果时的回调，见 ToolCallPrefetcher
+
+    Returns:
+        (用于执行代码的包装函数字典, 预取器)
+    """
+    prefetcher = ToolCallPrefetcher(functions, on_result)
+    calls = find_independent_calls(code, functions.keys(), exclude)
+    prefetcher.prefetch(calls)
+    return prefetcher.wrap(), prefetcher
+
+
+class SharedCallMemo:
+    """
+    在多次代码执行之间共享工具调用结果（例如一次批量请求中的多个查询）
+
+    参数完全相同的调用只真正执行一次，其余调用等待并复用其结果（包括正在执行中的调用）。
+    只应用于只读的工具函数。
+    """
+
+    def __init__(self):
+        self._results: Dict[Tuple[str, str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0,  # 实际执行的调用数
+            'deduplicated': 0  # 复用已有结果的调用数
+        }
+
+    def call(self, name: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        key = call_key(name, args, kwargs)
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+                self.stats['calls'] += 1
+            else:
+                self.stats['deduplicated'] += 1
+
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        result = future.result()
+        # 列表、字典等可变结果复制一份，避免不同查询的代码互相影响
+        return result.copy() if isinstance(result, (list, dict)) else result
+
+    def wrap(self, functions: Dict[str, Callable], exclude: Iterable[str] = ()) -> Dict[str, Callable]:
+        """返回经过共享结果包装的函数字典，exclude 中的函数保持原样"""
+        exclude = set(exclude)
+        wrapped = dict(functions)
+        for name, func in functions.items():
+            if name not in exclude:
+                wrapped[name] = self._wrap_function(name, func)
+        return wrapped
+
+    def _wrap_function(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(name, func, args, kwargs)
+
+        return wrapper
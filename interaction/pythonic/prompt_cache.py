@@ -0,0 +1,114 @@
+"""
+代码生成提示词的稳定前缀
+
+代码生成的提示词里，很长的函数定义（functions_schema）和要求每次都一样，只有用户查询不同。
+把用户查询放到提示词的最后，前面的部分每次请求都逐字节一致，支持前缀缓存的后端（例如开启了
+--enable-prefix-caching 的 vLLM，或 OpenAI 兼容接口）就可以直接复用这部分的 KV 缓存，不用每次重新计算。
+
+这里记录前缀的哈希、请求次数，以及后端在 usage 中返回的命中缓存的 token 数，用于确认前缀缓存是否生效。
+"""
+import hashlib
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from langchain.schema import HumanMessage, SystemMessage
+
+# 是否在请求中携带 prompt_cache_key（OpenAI 接口用它把相同前缀的请求路由到同一缓存），不支持的后端可能报错，默认关闭
+PROMPT_CACHE_KEY_ENABLED = os.getenv('PYTHONIC_PROMPT_CACHE_KEY', '0') == '1'
+
+
+def token_usage(message: Any) -> Tuple[Optional[int], Optional[int]]:
+    """
+    从模型响应中读取提示词 token 数和命中缓存的 token 数
+
+    Returns:
+        (提示词 token 数, 命中缓存的 token 数)，后端没有返回时为 None
+    """
+    usage = getattr(message, 'usage_metadata', None)
+    if usage:
+        details = usage.get('input_token_details') or {}
+        return usage.get('input_tokens'), details.get('cache_read')
+    metadata = getattr(message, 'response_metadata', None) or {}
+    usage = metadata.get('token_usage') or metadata.get('usage') or {}
+    details = usage.get('prompt_tokens_details') or {}
+    return usage.get('prompt_tokens'), details.get('cached_tokens')
+
+
+class StablePromptPrefix:
+    """
+    把提示词模板拆成固定前缀和用户查询后缀
+
+    Example:
+        prompt = StablePromptPrefix("你是一个智能助手", PROMPT_TEMPLATE, functions_schema=functions_schema)
+        response = chat.invoke(prompt.build_messages(query), **prompt.request_kwargs())
+        prompt.record(response)
+    """
+
+    def __init__(self, system_message: str, template: str, send_cache_key: bool = PROMPT_CACHE_KEY_ENABLED,
+                 **fixed_fields):
+        """
+        Args:
+            system_message: 系统消息
+            template: 提示词模板，{user_query} 必须位于模板最后
+            send_cache_key: 是否在请求中携带 prompt_cache_key
+            fixed_fields: 模板中其他占位符的取值（在这里一次性填好）
+
+        Raises:
+            ValueError: {user_query} 不在模板最后
+        """
+        head, placeholder, tail = template.rpartition('{user_query}')
+        if not placeholder or tail.strip():
+            raise ValueError("提示词模板中 {user_query} 必须位于最后")
+        self.system_message = system_message
+        self.prefix = head.format(**fixed_fields)
+        self.suffix = tail
+        self.prefix_hash = hashlib.sha256(f"{system_message}\0{self.prefix}".encode('utf-8')).hexdigest()[:16]
+        self.send_cache_key = send_cache_key
+
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'usage_reported': 0,  # 后端返回了 token 用量的请求数
+            'prompt_tokens': 0,
+            'cached_tokens': 0
+        }
+
+    def build_messages(self, user_query: str) -> list:
+        """构造消息列表，前缀部分每次都完全相同"""
+        return [
+            SystemMessage(content=self.system_message),
+            HumanMessage(content=self.prefix + user_query + self.suffix)
+        ]
+
+    def request_kwargs(self) -> Dict[str, Any]:
+        """调用模型时附加的参数"""
+        if not self.send_cache_key:
+            return {}
+        return {'extra_body': {'prompt_cache_key': self.prefix_hash}}
+
+    def record(self, message: Any = None) -> None:
+        """
+        记录一次请求
+
+        Args:
+            message: 模型响应（流式调用时为带有 usage 的最后一个分块），用于读取命中缓存的 token 数
+        """
+        prompt_tokens, cached_tokens = token_usage(message) if message is not None else (None, None)
+        with self._lock:
+            self.stats['requests'] += 1
+            if prompt_tokens is not None:
+                self.stats['usage_reported'] += 1
+                self.stats['prompt_tokens'] += prompt_tokens
+                self.stats['cached_tokens'] += cached_tokens or 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回前缀信息和缓存命中情况"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['prefix_hash'] = self.prefix_hash
+        stats['prefix_chars'] = len(self.system_message) + len(self.prefix)
+        stats['cached_token_ratio'] = (
+            stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        )
+        return stats
@@ -1,20 +1,27 @@
+import os
 import re
 from typing import Optional
 from datetime import datetime, timedelta
-from langchain.schema import HumanMessage, SystemMessage
 import random
 from time import time
 from model import chat
+from prompt_cache import StablePromptPrefix
+from tool_registry import ToolRegistry
 
-functions_schema = """
-def search_flights(departure: str, destination: str, date: str, passengers: int = 1, class_type: str = "economy") -> list[dict]:
-    \"\"\"
+# 工具函数注册表，提示词中的函数定义由它生成
+tools = ToolRegistry()
+
+
+@tools.tool
+def search_flights(departure: str, destination: str, date: str, passengers: int = 1,
+                   class_type: str = "economy") -> list[dict]:
+    """
     搜索特定条件的航班
 
     Args:
         departure: 出发城市
-        destination: 目的城市 
-        date: 出发日期(YYYY-MM-DD格式)    
+        destination: 目的城市
+        date: 出发日期(YYYY-MM-DD格式)
         passengers: 乘客数量
         class_type: 舱位类型(economy/business/first)
 
@@ -25,87 +32,7 @@ def search_flights(departure: str, destination: str, date: str, passengers: int
         - seats: 剩余座位数
         - departure_time: 起飞时间
         - arrival_time: 到达时间
-    \"\"\"
-    pass
-
-def check_seat_availability(flight_no: str, class_type: str, num_seats: int) -> dict:
-    \"\"\"
-    检查指定航班的座位可用性
-
-    Args:
-        flight_no: 航班号
-        class_type: 舱位类型
-        num_seats: 所需座位数
-
-    Returns:
-        座位可用性信息:
-        - available: 是否有足够座位
-        - price: 当前价格
-        - remaining_seats: 剩余座位数
-    \"\"\"
-    pass
-
-def create_booking(flight_no: str, passenger_info: list[dict], class_type: str, contact: dict) -> dict:
-    \"\"\"
-    创建机票预订
-
-    Args:
-        flight_no: 航班号
-        passenger_info: 乘客信息列表,每个乘客包含:
-            - name: 姓名
-            - id_type: 证件类型
-            - id_number: 证件号码
-        class_type: 舱位类型
-        contact: 联系人信息:
-            - name: 姓名
-            - phone: 电话
-            - email: 邮箱
-
-    Returns:
-        预订信息:
-        - booking_id: 预订编号
-        - total_price: 总价
-        - status: 预订状态
-    \"\"\"
-    pass
-
-def generate_payment_link(booking_id: str, payment_method: str) -> dict:
-    \"\"\"
-    生成支付链接
-
-    Args:
-        booking_id: 预订编号
-        payment_method: 支付方式(alipay/wechat/credit_card)
-
-    Returns:
-        支付信息:
-        - payment_url: 支付链接
-        - expire_time: 过期时间
-        - amount: 支付金额
-    \"\"\"
-    pass
-
-def send_booking_notification(booking_id: str, notification_type: str = "email", language: str = "zh_CN") -> bool:
-    \"\"\"
-    发送预订通知
-
-    Args:
-        booking_id: 预订编号
-        notification_type: 通知类型(email/sms/both)
-        language: 语言代码
-
-    Returns:
-        发送是否成功
-    \"\"\"
-    pass
-"""
-
-
-
-
-def search_flights(departure: str, destination: str, date: str, passengers: int = 1, class_type: str = "economy") -> \
-list[dict]:
-    """模拟航班搜索"""
+    """
     print(f"\n执行 search_flights:")
     print(f"- departure: {departure}")
     print(f"- destination: {destination}")
@@ -137,8 +64,22 @@ list[dict]:
     return flights
 
 
+@tools.tool
 def check_seat_availability(flight_no: str, class_type: str, num_seats: int) -> dict:
-    """模拟座位查询"""
+    """
+    检查指定航班的座位可用性
+
+    Args:
+        flight_no: 航班号
+        class_type: 舱位类型
+        num_seats: 所需座位数
+
+    Returns:
+        座位可用性信息:
+        - available: 是否有足够座位
+        - price: 当前价格
+        - remaining_seats: 剩余座位数
+    """
     # 随机生成座位信息
     print(f"\n执行 check_seat_availability:")
     print(f"- flight_no: {flight_no}")
@@ -158,8 +99,29 @@ def check_seat_availability(flight_no: str, class_type: str, num_seats: int) ->
     }
 
 
+@tools.tool
 def create_booking(flight_no: str, passenger_info: list[dict], class_type: str, contact: dict) -> dict:
-    """模拟创建预订"""
+    """
+    创建机票预订
+
+    Args:
+        flight_no: 航班号
+        passenger_info: 乘客信息列表,每个乘客包含:
+            - name: 姓名
+            - id_type: 证件类型
+            - id_number: 证件号码
+        class_type: 舱位类型
+        contact: 联系人信息:
+            - name: 姓名
+            - phone: 电话
+            - email: 邮箱
+
+    Returns:
+        预订信息:
+        - booking_id: 预订编号
+        - total_price: 总价
+        - status: 预订状态
+    """
     print(f"\n执行 create_booking:")
     print(f"- flight_no: {flight_no}")
     print(f"- passenger_info: {passenger_info}")
@@ -179,8 +141,21 @@ def create_booking(flight_no: str, passenger_info: list[dict], class_type: str,
     }
 
 
+@tools.tool
 def generate_payment_link(booking_id: str, payment_method: str) -> dict:
-    """模拟生成支付链接"""
+    """
+    生成支付链接
+
+    Args:
+        booking_id: 预订编号
+        payment_method: 支付方式(alipay/wechat/credit_card)
+
+    Returns:
+        支付信息:
+        - payment_url: 支付链接
+        - expire_time: 过期时间
+        - amount: 支付金额
+    """
     print(f"\n执行 generate_payment_link:")
     print(f"- booking_id: {booking_id}")
     print(f"- payment_method: {payment_method}")
@@ -191,8 +166,19 @@ def generate_payment_link(booking_id: str, payment_method: str) -> dict:
     }
 
 
+@tools.tool
 def send_booking_notification(booking_id: str, notification_type: str = "email", language: str = "zh_CN") -> bool:
-    """模拟发送通知"""
+    """
+    发送预订通知
+
+    Args:
+        booking_id: 预订编号
+        notification_type: 通知类型(email/sms/both)
+        language: 语言代码
+
+    Returns:
+        发送是否成功
+    """
     print(f"\n执行 send_booking_notification:")
     print(f"- booking_id: {booking_id}")
     print(f"- notification_type: {notification_type}")
@@ -201,6 +187,9 @@ def send_booking_notification(booking_id: str, notification_type: str = "email",
     return random.random() < 0.95
 
 
+functions_schema = tools.render_schema(os.getenv('PYTHONIC_SCHEMA_MODE', 'full'))
+
+# 用户需求放在最后，前面的部分每次请求都完全相同，后端可以复用前缀缓存（见 prompt_cache.py）
 PROMPT_TEMPLATE = """你是一个航空订票系统的智能助手。你的任务是理解用户需求，并生成相应的Python代码来完成订票流程。
 
 你可以使用的系统函数如下:
@@ -214,20 +203,14 @@ PROMPT_TEMPLATE = """你是一个航空订票系统的智能助手。你的任
 5. 需要考虑错误处理，确保代码的健壮性
 6. 所有生成的代码都必须放在markdown代码块中，使用```python 和 ``` 包裹
 
-用户需求是：
-{user_query}
+请生成相应的Python代码来完成下面的需求。
 
-请生成相应的Python代码来完成这个需求。"""
+用户需求是：
+{user_query}"""
 
 
 def load_functions():
-    return {
-        'search_flights': search_flights,
-        'check_seat_availability': check_seat_availability,
-        'create_booking': create_booking,
-        'generate_payment_link': generate_payment_link,
-        'send_booking_notification': send_booking_notification
-    }
+    return tools.functions()
 
 
 def extract_python_code(text: str) -> Optional[str]:
@@ -344,6 +327,9 @@ def main():
     # 加载mock函数
     mock_functions = load_functions()
 
+    # 代码生成提示词的固定前缀
+    booking_prompt = StablePromptPrefix("你是一个航空订票助手", PROMPT_TEMPLATE, functions_schema=functions_schema)
+
     total_start_time = time()
 
     for idx, query in enumerate(test_queries, 1):
@@ -354,20 +340,12 @@ def main():
         query_start_time = time()
 
         try:
-            # 构造完整提示词
-            prompt = PROMPT_TEMPLATE.format(
-                functions_schema=functions_schema,
-                user_query=query
-            )
-
-            # 获取模型响应
-            messages = [
-                SystemMessage(content="你是一个航空订票助手"),
-                HumanMessage(content=prompt)
-            ]
+            # 构造提示词：固定前缀 + 用户需求
+            messages = booking_prompt.build_messages(query)
 
             print("正在等待模型响应...")
-            response = chat.invoke(messages)
+            response = chat.invoke(messages, **booking_prompt.request_kwargs())
+            booking_prompt.record(response)
             print("模型响应完成")
 
             # 提取代码
@@ -430,6 +408,15 @@ def main():
     print(f"最短耗时: {stats['timing']['min_time']:.2f}秒")
     print(f"最长耗时: {stats['timing']['max_time']:.2f}秒")
 
+    prefix_stats = booking_prompt.get_stats()
+    print("\n提示词前缀缓存:")
+    print(f"前缀哈希: {prefix_stats['prefix_hash']}，长度: {prefix_stats['prefix_chars']}字符")
+    if prefix_stats['usage_reported']:
+        print(f"命中缓存的token: {prefix_stats['cached_tokens']}/{prefix_stats['prompt_tokens']} "
+              f"({prefix_stats['cached_token_ratio'] * 100:.1f}%)")
+    else:
+        print("后端没有返回token用量")
+
     if stats['failed_queries']:
         print("\n失败用例详情:")
         for idx, (query, error) in enumerate(stats['failed_queries'], 1):
@@ -0,0 +1,357 @@
+"""
+生成代码的沙箱执行后端
+
+模型生成的代码是不可信的，在 API 服务进程里直接 exec 时，死循环或者大量计算会一直占住工作线程，
+也没有任何超时。这里维护一组预先启动的工作进程：
+1. 进程启动时已经导入并初始化好工具函数（load_functions），执行任务时没有冷启动开销
+2. 每个任务有墙钟时间上限，超时的进程直接杀掉，在后台补充新进程，请求不等待新进程启动
+3. 每个进程限制可用内存，执行一定数量的任务后回收重建，避免状态和内存泄漏累积
+4. 通过 Pipe 传递任务和结果；任务执行过程中的事件（例如每个工具调用的结果）也经 Pipe 实时转发给调用方
+"""
+import atexit
+import importlib
+import multiprocessing
+import os
+import threading
+import time
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # 非 Unix 平台无法限制内存
+    resource = None
+
+SANDBOX_POOL_SIZE = int(os.getenv('PYTHONIC_SANDBOX_POOL_SIZE', '4'))
+SANDBOX_JOB_TIMEOUT = float(os.getenv('PYTHONIC_SANDBOX_JOB_TIMEOUT', '30'))  # 秒
+SANDBOX_MEMORY_LIMIT_MB = int(os.getenv('PYTHONIC_SANDBOX_MEMORY_LIMIT_MB', '512'))  # 每个进程在预热后可额外使用的内存
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv('PYTHONIC_SANDBOX_MAX_JOBS_PER_WORKER', '100'))
+SANDBOX_START_TIMEOUT = 60.0  # 等待工作进程完成预热的时间（秒）
+SANDBOX_RESPAWN_RETRY_DELAY = 5.0  # 补充工作进程失败后重试的间隔（秒）
+
+
+class SandboxError(Exception):
+    """沙箱执行失败（工作进程崩溃、内存超限等）"""
+
+
+class SandboxTimeout(SandboxError):
+    """沙箱任务执行超时"""
+
+
+def _load_callable(spec: str) -> Callable:
+    """按 "模块名:函数名" 加载函数"""
+    module_name, func_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def _limit_memory(extra_mb: int) -> None:
+    """在当前地址空间大小的基础上，限制进程最多再使用 extra_mb 内存"""
+    if resource is None or extra_mb <= 0:
+        return
+    current = 0
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmSize:'):
+                    current = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    limit = current + extra_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(conn, warmup: str, runner: str, memory_limit_mb: int, event_arg: Optional[str]) -> None:
+    """工作进程主循环：预热后逐个执行任务，收到 None 时退出"""
+    # 生成的代码可能在多个线程中调用工具，事件和结果的发送需要加锁，避免 Pipe 中的消息交错
+    send_lock = threading.Lock()
+
+    def send(message) -> None:
+        with send_lock:
+            conn.send(message)
+
+    def on_event(*event) -> None:
+        send(('event', event))
+
+    try:
+        _load_callable(warmup)()  # 预热：导入并初始化工具函数
+        run = _load_callable(runner)
+        _limit_memory(memory_limit_mb)
+        conn.send(('ready', os.getpid()))
+    except Exception as e:
+        conn.send(('error', type(e).__name__, f"工作进程初始化失败: {str(e)}"))
+        return
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        args, kwargs, stream_events = job
+        if stream_events:
+            kwargs = {**kwargs, event_arg: on_event}
+        try:
+            result = run(*args, **kwargs)
+            send(('ok', result))
+        except MemoryError:
+            send(('error', 'MemoryError', f"内存使用超过限制({memory_limit_mb}MB)"))
+            break
+        except Exception as e:
+            try:
+                send(('error', type(e).__name__, str(e)))
+            except Exception:
+                break
+
+
+class _Worker:
+    """父进程中对一个工作进程的记录"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs_done = 0
+
+    def stop(self, force: bool = False) -> None:
+        """通知工作进程退出，force 为 True 或进程没有及时退出时直接杀掉"""
+        if not force:
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=5)
+            except (OSError, ValueError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    预启动、预热的沙箱工作进程池
+
+    Example:
+        pool = SandboxPool(warmup='mservice:load_functions', runner='mservice:run_generated_code')
+        response_text, executed_functions = pool.run(code)
+    """
+
+    def __init__(self, warmup: str, runner: str,
+                 size: int = SANDBOX_POOL_SIZE,
+                 job_timeout: float = SANDBOX_JOB_TIMEOUT,
+                 memory_limit_mb: int = SANDBOX_MEMORY_LIMIT_MB,
+                 max_jobs_per_worker: int = SANDBOX_MAX_JOBS_PER_WORKER,
+                 event_arg: Optional[str] = None):
+        """
+        Args:
+            warmup: 工作进程启动时调用的预热函数，"模块名:函数名"
+            runner: 执行任务的函数，"模块名:函数名"，参数和返回值需要可以被 pickle
+            size: 工作进程数量
+            job_timeout: 单个任务的墙钟时间上限（秒）
+            memory_limit_mb: 工作进程预热后可额外使用的内存（MB），0 表示不限制
+            max_jobs_per_worker: 每个工作进程执行多少个任务后回收重建
+            event_arg: 可选，runner 接收事件回调的关键字参数名；run 指定 on_event 时，工作进程中通过该参数
+                传入的回调产生的事件会转发给 on_event
+        """
+        self.warmup = warmup
+        self.runner = runner
+        self.size = size
+        self.job_timeout = job_timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.event_arg = event_arg
+
+        # forkserver 预先导入工作进程需要的模块，之后每个进程都从已导入的状态 fork 出来
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._ctx = multiprocessing.get_context('forkserver')
+            self._ctx.set_forkserver_preload([warmup.split(':')[0], runner.split(':')[0]])
+        else:
+            self._ctx = multiprocessing.get_context('spawn')
+
+        self._idle: "Queue[_Worker]" = Queue()
+        self._workers: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._respawning = 0  # 正在后台补充的进程数
+        self.stats = {
+            'jobs': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'crashes': 0,
+            'recycled': 0,
+            'spawned': 0,
+            'spawn_failures': 0,
+            'events': 0,
+            'total_job_time': 0.0
+        }
+
+        for _ in range(size):
+            self._idle.put(self._spawn())
+        atexit.register(self.close)
+
+    def _spawn(self) -> _Worker:
+        """启动一个工作进程并等待其完成预热"""
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.warmup, self.runner, self.memory_limit_mb, self.event_arg),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        if not parent_conn.poll(SANDBOX_START_TIMEOUT):
+            worker.stop(force=True)
+            raise SandboxError("沙箱工作进程启动超时")
+        message = parent_conn.recv()
+        if message[0] != 'ready':
+            worker.stop(force=True)
+            raise SandboxError(message[2])
+
+        with self._lock:
+            self._workers.append(worker)
+            self.stats['spawned'] += 1
+        return worker
+
+    def _retire(self, worker: _Worker, force: bool) -> None:
+        """
+        停止工作进程，并在后台补充一个新的进程
+
+        新进程的启动和预热最长需要 SANDBOX_START_TIMEOUT 秒，不能放在请求路径上；
+        在此期间的任务由其他空闲进程执行
+        """
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+            self._respawning += 1
+        threading.Thread(target=self._replace, args=(worker, force), name="sandbox-respawn", daemon=True).start()
+
+    def _replace(self, worker: _Worker, force: bool) -> None:
+        """后台线程：停止旧进程，启动新进程放入空闲队列，启动失败时间隔一段时间重试，直到成功或进程池关闭"""
+        try:
+            worker.stop(force=force)
+            while not self._closed:
+                try:
+                    new_worker = self._spawn()
+                except Exception as e:
+                    with self._lock:
+                        self.stats['spawn_failures'] += 1
+                    print(f"补充沙箱工作进程失败，{SANDBOX_RESPAWN_RETRY_DELAY:.0f}秒后重试: {e}")
+                    time.sleep(SANDBOX_RESPAWN_RETRY_DELAY)
+                    continue
+                with self._lock:
+                    # 启动期间进程池被关闭，且 close 没有看到这个新进程时，由这里停止
+                    orphaned = self._closed and new_worker in self._workers
+                    if orphaned:
+                        self._workers.remove(new_worker)
+                if orphaned:
+                    new_worker.stop()
+                elif not self._closed:
+                    self._idle.put(new_worker)
+                break
+        finally:
+            with self._lock:
+                self._respawning -= 1
+
+    def run(self, *args, timeout: Optional[float] = None, on_event: Optional[Callable[..., None]] = None,
+            **kwargs) -> Any:
+        """
+        在沙箱进程中执行 runner(*args, **kwargs)
+
+        Args:
+            timeout: 本次任务的时间上限（秒），默认使用 job_timeout
+            on_event: 可选，任务执行过程中工作进程发出的事件的回调（需要创建进程池时指定 event_arg），
+                在调用 run 的线程中调用，参数需要可以被 pickle
+
+        Returns:
+            runner 的返回值
+
+        Raises:
+            SandboxTimeout: 任务超时（执行该任务的进程会被杀掉）
+            SandboxError: 工作进程崩溃
+            Exception: runner 抛出的异常，保留原始的错误信息
+        """
+        if self._closed:
+            raise SandboxError("沙箱进程池已关闭")
+        if on_event is not None and self.event_arg is None:
+            raise ValueError("创建进程池时没有指定 event_arg，无法转发事件")
+        timeout = self.job_timeout if timeout is None else timeout
+        start_time = time.time()
+
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except Empty:
+            raise SandboxTimeout(f"等待空闲沙箱进程超时({timeout:.1f}秒)")
+
+        try:
+            worker.conn.send((args, kwargs, on_event is not None))
+            while True:
+                remaining = max(0.0, timeout - (time.time() - start_time))
+                if not worker.conn.poll(remaining):
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    self._retire(worker, force=True)
+                    raise SandboxTimeout(f"代码执行超时({timeout:.1f}秒)")
+                message = worker.conn.recv()
+                if message[0] != 'event':
+                    break
+                with self._lock:
+                    self.stats['events'] += 1
+                try:
+                    on_event(*message[1])
+                except Exception as e:
+                    # 回调出错不能中断任务，否则工作进程后续发送的消息会被下一个任务读到
+                    print(f"沙箱事件回调出错: {e}")
+        except (EOFError, OSError):
+            with self._lock:
+                self.stats['crashes'] += 1
+            self._retire(worker, force=True)
+            raise SandboxError("沙箱进程异常退出")
+
+        worker.jobs_done += 1
+        with self._lock:
+            self.stats['jobs'] += 1
+            self.stats['total_job_time'] += time.time() - start_time
+
+        if message[0] == 'error' and message[1] == 'MemoryError':
+            # 内存超限的进程已自行退出
+            with self._lock:
+                self.stats['errors'] += 1
+            self._retire(worker, force=True)
+            raise SandboxError(message[2])
+
+        if worker.jobs_done >= self.max_jobs_per_worker:
+            with self._lock:
+                self.stats['recycled'] += 1
+            self._retire(worker, force=False)
+        else:
+            self._idle.put(worker)
+
+        if message[0] == 'error':
+            with self._lock:
+                self.stats['errors'] += 1
+            raise Exception(message[2])
+        return message[1]
+
+    def close(self) -> None:
+        """停止所有工作进程"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回进程池统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['workers'] = len(self._workers)
+            stats['respawning'] = self._respawning
+        stats['idle_workers'] = self._idle.qsize()
+        stats['average_job_time'] = stats['total_job_time'] / stats['jobs'] if stats['jobs'] else 0.0
+        return stats
@@ -0,0 +1,257 @@
+"""
+与代码执行重叠的推测式建议生成
+
+need_suggestion 为 True 时，原先要等代码执行完、拿到完整响应后才开始调用建议模型，建议的耗时全部叠加在请求延迟上。
+建议只依赖工具调用的结果，而生成代码中的工具调用大多被并发预取，结果在代码执行结束前就陆续返回了。这里在
+代码执行期间提前开始生成建议：
+- 完成的工具调用达到代码中调用数的 SPECULATIVE_START_RATIO 时，再等 SPECULATIVE_DEBOUNCE 秒，用已有结果开始
+  第一次推测；被并发预取的调用往往几乎同时返回，等一下可以避免发出马上就被完整结果替换的推测
+- 全部调用完成时（代码通常还在处理结果），用完整结果再推测一次；循环中的调用可能多于代码中的调用数，之后每来
+  一个结果都重新推测（已有推测覆盖的结果数不少于 SPECULATIVE_ACCEPT_RATIO 时除外）。开始新的推测时取消还没完成的旧推测
+- 代码执行结束后，最新的推测覆盖了全部结果时直接作为建议（speculative）；覆盖的结果数不少于
+  SPECULATIVE_ACCEPT_RATIO，或者剩余时间不够重新生成（按最近建议生成耗时的估计）时，用部分结果的推测提前返回
+  （partial）；否则取消推测、用完整响应重新生成（refined；没有任何推测时为 sequential）
+
+工具调用被并发预取时，最后一个结果几乎和代码执行同时结束，覆盖全部结果的推测藏不住多少延迟（实测平均可见延迟
+2.98 秒降到 2.94 秒），每个请求却要多付推测请求的模型调用，因此默认关闭（PYTHONIC_SPECULATIVE_SUGGESTION=1 开启）。
+开启时 SPECULATIVE_ACCEPT_RATIO 调低后可以用部分结果的建议换取更低的延迟，默认 1.0 只接受覆盖全部结果的推测。
+
+SuggestionMetrics 统计各方式的次数、没有用上的推测请求数，以及代码执行结束后还需等待建议的时间（可见延迟）。
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from code_analysis import analyze_calls
+from deadline import Deadline, DeadlineExceeded
+
+# 是否开启推测式建议生成（默认关闭，见模块说明）
+SPECULATIVE_SUGGESTION_ENABLED = os.getenv('PYTHONIC_SPECULATIVE_SUGGESTION', '0') == '1'
+# 完成的工具调用达到代码中调用数的该比例时开始第一次推测
+SPECULATIVE_START_RATIO = float(os.getenv('PYTHONIC_SPECULATIVE_START_RATIO', '0.5'))
+SPECULATIVE_DEBOUNCE = 0.2
+# 代码执行结束时，推测覆盖的结果数不少于全部结果的该比例即可直接使用
+SPECULATIVE_ACCEPT_RATIO = float(os.getenv('PYTHONIC_SPECULATIVE_ACCEPT_RATIO', '1.0'))
+# 建议生成耗时估计的平滑系数、没有样本时的初始估计（秒）
+LATENCY_EMA_ALPHA = 0.2
+INITIAL_LATENCY_ESTIMATE = 2.0
+
+MODES = ('speculative', 'partial', 'refined', 'sequential')
+
+
+class SuggestionMetrics:
+    """建议生成方式和可见延迟的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency_estimate = INITIAL_LATENCY_ESTIMATE
+        self.stats = {
+            'requests': 0,
+            **{mode: 0 for mode in MODES},
+            'speculations': 0,  # 发起的推测请求数
+            'wasted_speculations': 0,  # 没有用上（被取消或被替换）的推测请求数
+            'visible_latency': 0.0,  # 代码执行结束后等待建议的总时间（秒）
+        }
+
+    def observe_latency(self, seconds: float) -> None:
+        """记录一次完整的建议生成耗时，更新耗时估计"""
+        with self._lock:
+            self.latency_estimate += LATENCY_EMA_ALPHA * (seconds - self.latency_estimate)
+
+    def record(self, mode: str, visible_latency: float, speculations: int, wasted: int) -> None:
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[mode] += 1
+            self.stats['speculations'] += speculations
+            self.stats['wasted_speculations'] += wasted
+            self.stats['visible_latency'] += visible_latency
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['latency_estimate'] = self.latency_estimate * 1000
+        requests = stats['requests']
+        stats['avg_visible_latency'] = stats.pop('visible_latency') / requests * 1000 if requests else 0.0
+        stats['speculative_rate'] = (stats['speculative'] + stats['partial']) / requests if requests else 0.0
+        return stats
+
+
+class _Speculation:
+    def __init__(self, covered: int, task: asyncio.Task):
+        self.covered = covered  # 推测时已有的工具调用结果数
+        self.task = task
+
+
+class SpeculativeSuggestion:
+    """
+    单个请求的推测式建议
+
+    Example:
+        speculation = SpeculativeSuggestion(query, agenerate, metrics)
+        # 代码生成后
+        speculation.set_code(code, function_names)
+        # 每个工具调用完成时（可以在其他线程中调用）
+        speculation.on_tool_result(name, result)
+        # 代码执行结束后
+        suggestion = await speculation.take(deadline)
+        if suggestion is None:
+            suggestion = await agenerate(query, response_text)
+        speculation.finish()
+    """
+
+    def __init__(self, query: str, agenerate: Callable[[str, str], Awaitable[str]],
+                 metrics: SuggestionMetrics, max_speculations: int = 3,
+                 skip: Optional[Callable[[List[Any]], bool]] = None):
+        """
+        Args:
+            query: 用户查询文本
+            agenerate: 生成建议的协程函数 (用户查询, 查询结果) -> 建议
+            metrics: 统计对象
+            max_speculations: 最多发起的推测请求数
+            skip: 可选，以已有的工具调用结果为参数，返回 True 时不发起推测（比如规则已经可以给出建议）
+        """
+        self.query = query
+        self.agenerate = agenerate
+        self.metrics = metrics
+        self.max_speculations = max_speculations
+        self.loop = asyncio.get_running_loop()
+        self.expected_calls: Optional[int] = None
+        self.skip = skip
+        self.results: List[Any] = []
+        self.speculations: List[_Speculation] = []
+        self.mode: Optional[str] = None
+        self._ready_time: Optional[float] = None
+        self._stale = 0  # 修复后重新执行代码时作废的推测数
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def set_code(self, code: Optional[str], function_names: List[str]) -> None:
+        """
+        设置即将执行的代码，用其中的工具调用数判断何时开始推测
+
+        代码修复后重新执行时再次调用，之前的工具调用结果和推测作废
+        """
+        self._cancel_timer()
+        if self.results or self.speculations:
+            self._cancel_pending()
+            self._stale += len(self.speculations)
+            self.results = []
+            self.speculations = []
+        self.expected_calls = None
+        if code:
+            analysis = analyze_calls(code, function_names)
+            if analysis.syntax_error is None:
+                self.expected_calls = len(analysis.calls)
+
+    def on_tool_result(self, name: str, result: Any) -> None:
+        """工具调用完成的回调，可以在执行代码的线程中调用"""
+        self.loop.call_soon_threadsafe(self._add_result, result)
+
+    def _add_result(self, result: Any) -> None:
+        self.results.append(result)
+        if not self.expected_calls or len(self.speculations) >= self.max_speculations:
+            return
+        count = len(self.results)
+        if count >= self.expected_calls:
+            # 全部调用完成，用完整结果推测；已有的推测覆盖的结果足够多时不再推测
+            self._cancel_timer()
+            if not self.speculations or self.speculations[-1].covered < count * SPECULATIVE_ACCEPT_RATIO:
+                self._speculate()
+        elif (not self.speculations and self._timer is None
+              and count >= max(1, math.ceil(self.expected_calls * SPECULATIVE_START_RATIO))):
+            self._timer = self.loop.call_later(SPECULATIVE_DEBOUNCE, self._speculate_partial)
+
+    def _speculate_partial(self) -> None:
+        self._timer = None
+        if not self.speculations:
+            self._speculate()
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _speculate(self) -> None:
+        if self.skip is not None and self.skip(self.results):
+            return
+        covered = len(self.results)
+        partial_response = "\n".join(str(result) for result in self.results)
+
+        async def run() -> str:
+            start_time = time.time()
+            suggestion = await self.agenerate(self.query, partial_response)
+            self.metrics.observe_latency(time.time() - start_time)
+            return suggestion
+
+        # 新的推测覆盖更多结果，旧推测不会再被用到
+        self._cancel_pending()
+        self.speculations.append(_Speculation(covered, asyncio.ensure_future(run())))
+
+    async def take(self, deadline: Deadline) -> Optional[str]:
+        """
+        代码执行结束后取推测的建议
+
+        Returns:
+            可用的推测建议；推测不可用（需要调用方用完整响应重新生成）时返回 None
+
+        Raises:
+            DeadlineExceeded: 等待推测结果时超过截止时间
+        """
+        self._ready_time = time.time()
+        self._cancel_timer()
+        total = len(self.results)
+        latest = self.speculations[-1] if self.speculations else None
+        if latest is None:
+            chosen = None
+        elif latest.covered >= total:
+            chosen, mode = latest, 'speculative'
+        elif latest.covered >= total * SPECULATIVE_ACCEPT_RATIO or deadline.remaining() < self.metrics.latency_estimate:
+            # 部分结果的推测已经足够，或者剩余时间不够重新生成，提前返回
+            chosen, mode = latest, 'partial'
+        else:
+            chosen = None
+        if chosen is not None:
+            self.mode = mode
+            try:
+                # shield：等待超时时不在这里取消推测，由 finish 统一处理
+                return await deadline.run(asyncio.shield(chosen.task), 'suggestion')
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"推测的建议生成失败，改为重新生成: {e}")
+        self.mode = 'refined' if self.speculations else 'sequential'
+        self._cancel_pending()
+        return None
+
+    def take_ready(self) -> Optional[str]:
+        """代码执行超时时调用：已经完成的推测（基于部分结果）直接作为建议，不再等待"""
+        self._ready_time = time.time()
+        self._cancel_timer()
+        for item in reversed(self.speculations):
+            if item.task.done() and not item.task.cancelled() and item.task.exception() is None:
+                self.mode = 'partial'
+                return item.task.result()
+        return None
+
+    def _cancel_pending(self) -> None:
+        for item in self.speculations:
+            if not item.task.done():
+                item.task.cancel()
+
+    def finish(self) -> None:
+        """建议生成结束（或放弃）后调用：取消没有用上的推测并记录统计"""
+        visible_latency = time.time() - self._ready_time if self._ready_time is not None else 0.0
+        if self.mode in ('refined', 'sequential'):
+            self.metrics.observe_latency(visible_latency)
+        used = 1 if self.mode in ('speculative', 'partial') else 0
+        self._cancel_timer()
+        self._cancel_pending()
+        for item in self.speculations:
+            # 取出失败推测的异常，避免 "Task exception was never retrieved" 警告
+            if item.task.done() and not item.task.cancelled():
+                item.task.exception()
+        if self.mode is not None:
+            speculations = len(self.speculations) + self._stale
+            self.metrics.record(self.mode, visible_latency, speculations, speculations - used)
@@ -0,0 +1,111 @@
+"""
+结构化的工具调用结果
+
+余额、套餐用量等工具原先只返回拼好的中文字符串，建议规则、缓存和序列化要用其中的数字时只能再用正则（或者让
+模型）从字符串里解析回来。这里为这些结果定义 slots 数据类，工具返回 ToolResult：
+- ToolResult 是 str 的子类，内容与原来的字符串完全相同，生成的代码照旧用 "\\n".join(result) 拼接
+- ToolResult.data 是结构化的数据类，建议规则等直接读取字段，to_dict 用于 JSON 序列化
+
+生成的代码要把结果当字符串拼接，所以文本在构造时就渲染好（每个结果渲染一次，之后不再格式化或解析）。
+"""
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Tuple
+
+
+@dataclass(slots=True, frozen=True)
+class BalanceResult:
+    """账户余额"""
+    phone_number: str
+    balance: float  # 元，负数表示欠费
+
+    @property
+    def in_arrears(self) -> bool:
+        return self.balance < 0
+
+    def render(self) -> str:
+        status = "欠费" if self.in_arrears else "正常"
+        return (f"[执行函数：search_phone_number_balance]手机号{self.phone_number}的账户余额查询结果：\n"
+                f"余额：{self.balance}元\n账户状态：{status}\n")
+
+
+@dataclass(slots=True, frozen=True)
+class UsageItem:
+    """一项服务的用量"""
+    name: str
+    used: float
+    total: float
+    unit: str
+
+    @property
+    def ratio(self) -> float:
+        return self.used / self.total if self.total else 1.0
+
+    def render(self) -> str:
+        return f"{self.used:g}{self.unit}/{self.total:g}{self.unit}"
+
+
+@dataclass(slots=True, frozen=True)
+class PackageUsageResult:
+    """基本套餐的使用情况（流量、通话、短信）"""
+    phone_number: str
+    items: Tuple[UsageItem, ...]
+
+    def render(self) -> str:
+        lines = "".join(f"{item.name}使用：{item.render()}\n" for item in self.items)
+        return f"[执行函数：query_basic_package_usage]\n手机号{self.phone_number}的基本套餐使用情况：\n{lines}"
+
+
+@dataclass(slots=True, frozen=True)
+class AddonUsageResult:
+    """增值包（流量包 / 通话包 / 短信包）的使用情况"""
+    phone_number: str
+    usage: UsageItem  # name 为增值包类型名称
+
+    def render(self) -> str:
+        return f"\n手机号{self.phone_number}的{self.usage.name}增值包使用情况：\n使用量：{self.usage.render()}\n"
+
+
+@dataclass(slots=True, frozen=True)
+class DataPassUsageResult:
+    """流量型增值服务（5G畅游包）的使用情况"""
+    service_name: str
+    used: float  # GB
+    remaining: float  # GB
+
+    @property
+    def usage(self) -> UsageItem:
+        return UsageItem(self.service_name, self.used, self.used + self.remaining, "GB")
+
+    def render(self) -> str:
+        return f"本月已使用{self.used:g}GB，剩余{self.remaining:g}GB"
+
+
+class ToolResult(str):
+    """
+    带结构化数据的工具调用结果，字符串内容为 data.render() 的结果
+
+    Example:
+        result = ToolResult(BalanceResult(phone_number, balance))
+        if isinstance(result, ToolResult) and result.data.in_arrears:
+            ...
+    """
+
+    def __new__(cls, data: Any) -> 'ToolResult':
+        result = super().__new__(cls, data.render())
+        result.data = data
+        return result
+
+    def __copy__(self) -> 'ToolResult':
+        # 字符串和冻结的数据类都不可变，结果缓存复制时直接返回自身，不用重新渲染
+        return self
+
+    def __deepcopy__(self, memo: dict) -> 'ToolResult':
+        return self
+
+    def __reduce__(self):
+        # 在沙箱进程之间传递时保留结构化数据
+        return ToolResult, (self.data,)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """结构化数据的字典形式（可 JSON 序列化），type 为数据类名"""
+        return {"type": type(self.data).__name__, **asdict(self.data)}
@@ -0,0 +1,223 @@
+"""
+建议的规则快速路径
+
+建议模型的系统提示词（SUGGESTION_SYSTEM_MESSAGE）里的建议本身就是确定的规则：
+1. 欠费时建议尽快充值
+2. 某项增值包 / 增值服务用量小于三分之一时建议升级该服务
+3. 开通了多项增值服务时建议评估是否需要调整套餐
+SuggestionRuleEngine 直接从工具调用的结果中提取这些条件（余额、用量、已开通的服务），按上面的优先级取第一条
+命中的规则，用模板生成建议，耗时在微秒级；没有规则命中时才调用建议模型。结构化的结果（structured_results.py）
+直接读取字段，只有文本时用正则解析。
+
+规则只依赖从结果中提取到的事实，结果越多事实越多：部分结果已经命中规则时，完整结果也一定会命中，
+推测式建议据此跳过不需要的模型调用。
+
+get_stats 返回规则路径和模型路径各自的请求比例，以及每条规则的命中次数。
+"""
+import ast
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from structured_results import AddonUsageResult, BalanceResult, DataPassUsageResult, ToolResult, UsageItem
+
+# 是否先用规则生成建议
+SUGGESTION_RULES_ENABLED = os.getenv('PYTHONIC_SUGGESTION_RULES', '1') == '1'
+# 用量低于该比例时建议升级
+LOW_USAGE_RATIO = 1 / 3
+# 开通的增值服务不少于该数量时建议调整套餐
+MANY_SERVICES_THRESHOLD = 3
+
+# 已知的增值服务名称，与 mservice.query_value_added_services 一致
+VALUE_ADDED_SERVICES = ("5G畅游包", "流量共享", "亲情号码", "来电提醒")
+
+BALANCE_PATTERN = re.compile(r"余额：(-?\d+(?:\.\d+)?)元")
+ARREARS_PATTERN = re.compile(r"账户状态：欠费")
+# 增值包使用情况："手机号xxx的流量包增值包使用情况：\n使用量：10GB/50GB"
+ADDON_USAGE_PATTERN = re.compile(r"的(\S+?)增值包使用情况：\s*使用量：(\d+(?:\.\d+)?)(\D+?)/(\d+(?:\.\d+)?)")
+# 5G畅游包使用情况："本月已使用10GB，剩余5GB"
+SERVICE_USAGE_PATTERN = re.compile(r"本月已使用(\d+(?:\.\d+)?)GB，剩余(\d+(?:\.\d+)?)GB")
+# 生成代码把服务列表直接拼进响应时的形式：['5G畅游包', '流量共享']
+SERVICE_LIST_PATTERN = re.compile(r"\[(?:\s*'[^'\]]*'\s*,?)+\]")
+
+
+class SuggestionFacts(NamedTuple):
+    """从工具调用结果中提取的事实"""
+    balance: Optional[float]
+    in_arrears: bool
+    usages: List[UsageItem]
+    services: List[str]  # 已开通的增值服务
+
+
+def extract_facts(results: Iterable[Any]) -> SuggestionFacts:
+    """
+    从工具调用的返回值（或包含它们的响应文本）中提取事实
+
+    Args:
+        results: 工具调用的返回值列表；只有响应文本时传入 [响应文本]
+    """
+    balance = None
+    in_arrears = False
+    usages: List[UsageItem] = []
+    services: List[str] = []
+
+    def add_services(items: Iterable[Any]) -> None:
+        for item in items:
+            if item in VALUE_ADDED_SERVICES and item not in services:
+                services.append(item)
+
+    for result in results:
+        if isinstance(result, (list, tuple)):
+            add_services(result)
+            continue
+        if isinstance(result, ToolResult):
+            data = result.data
+            if isinstance(data, BalanceResult):
+                balance = data.balance
+                in_arrears = in_arrears or data.in_arrears
+            elif isinstance(data, (AddonUsageResult, DataPassUsageResult)):
+                usages.append(data.usage)
+            continue
+        if not isinstance(result, str):
+            continue
+        match = BALANCE_PATTERN.search(result)
+        if match:
+            balance = float(match.group(1))
+            in_arrears = in_arrears or balance < 0
+        if ARREARS_PATTERN.search(result):
+            in_arrears = True
+        for name, used, unit, total in ADDON_USAGE_PATTERN.findall(result):
+            usages.append(UsageItem(name, float(used), float(total), unit))
+        for used, remaining in SERVICE_USAGE_PATTERN.findall(result):
+            usages.append(DataPassUsageResult("5G畅游包", float(used), float(remaining)).usage)
+        for text in SERVICE_LIST_PATTERN.findall(result):
+            try:
+                add_services(ast.literal_eval(text))
+            except (ValueError, SyntaxError):
+                pass
+    return SuggestionFacts(balance, in_arrears, usages, services)
+
+
+def format_amount(value: float) -> str:
+    return f"{value:g}"
+
+
+def arrears_rule(facts: SuggestionFacts) -> Optional[str]:
+    if not facts.in_arrears:
+        return None
+    owed = f"{format_amount(abs(facts.balance))}元" if facts.balance is not None and facts.balance < 0 else ""
+    return f"您的账户已欠费{owed}，建议尽快通过营业厅App、微信或支付宝充值，以免影响正常使用。"
+
+
+def low_usage_rule(facts: SuggestionFacts) -> Optional[str]:
+    low = [usage for usage in facts.usages if usage.ratio < LOW_USAGE_RATIO]
+    if not low:
+        return None
+    usage = min(low, key=lambda item: item.ratio)
+    return (f"您的{usage.name}本月仅使用了{format_amount(usage.used)}{usage.unit}/{format_amount(usage.total)}"
+            f"{usage.unit}，用量不足三分之一，建议升级{usage.name}以获得更合适的权益。")
+
+
+def many_services_rule(facts: SuggestionFacts) -> Optional[str]:
+    if len(facts.services) < MANY_SERVICES_THRESHOLD:
+        return None
+    return (f"您已开通{len(facts.services)}项增值服务（{'、'.join(facts.services)}），"
+            f"建议评估这些服务是否都有需要，考虑调整为更合适的套餐。")
+
+
+# 按优先级排列的规则 (名称, 规则函数)，规则函数命中时返回建议，否则返回 None
+RULES: List[Tuple[str, Callable[[SuggestionFacts], Optional[str]]]] = [
+    ('arrears', arrears_rule),
+    ('low_usage', low_usage_rule),
+    ('many_services', many_services_rule),
+]
+
+
+class SuggestionRuleEngine:
+    """
+    规则优先的建议生成，统计规则路径和模型路径的请求数
+
+    Example:
+        suggestion = suggestion_rules.suggest(tool_results)
+        if suggestion is None:
+            suggestion_rules.record_fallback()
+            suggestion = 调用建议模型
+    """
+
+    def __init__(self, rules: Optional[List[Tuple[str, Callable[[SuggestionFacts], Optional[str]]]]] = None,
+                 enabled: bool = SUGGESTION_RULES_ENABLED):
+        """
+        Args:
+            rules: 按优先级排列的规则，默认 RULES
+            enabled: 为 False 时规则不命中，全部走模型
+        """
+        self.rules = RULES if rules is None else rules
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'rule': 0,
+            'llm': 0,
+            'rules': {name: 0 for name, _ in self.rules},
+            'rule_time': 0.0  # 规则评估的总耗时（秒）
+        }
+
+    def evaluate(self, results: Iterable[Any]) -> Optional[Tuple[str, str]]:
+        """
+        评估规则，不记录统计
+
+        Returns:
+            (规则名, 建议)，没有规则命中时返回 None
+        """
+        if not self.enabled:
+            return None
+        facts = extract_facts(results)
+        for name, rule in self.rules:
+            suggestion = rule(facts)
+            if suggestion is not None:
+                return name, suggestion
+        return None
+
+    def matches(self, results: Iterable[Any]) -> bool:
+        """是否有规则命中（推测式建议用它判断是否还需要调用模型）"""
+        return self.evaluate(results) is not None
+
+    def suggest(self, results: Iterable[Any]) -> Optional[str]:
+        """
+        用规则生成建议并记录统计
+
+        Args:
+            results: 工具调用的返回值列表；只有响应文本时传入 [响应文本]
+
+        Returns:
+            命中规则的建议；没有规则命中时返回 None，调用方改用模型生成后调用 record_fallback
+        """
+        start_time = time.time()
+        matched = self.evaluate(results)
+        elapsed = time.time() - start_time
+        with self._lock:
+            self.stats['rule_time'] += elapsed
+            if matched is not None:
+                self.stats['requests'] += 1
+                self.stats['rule'] += 1
+                self.stats['rules'][matched[0]] += 1
+        return None if matched is None else matched[1]
+
+    def record_fallback(self) -> None:
+        """记录一次没有规则命中、由模型生成的建议"""
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['llm'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['rules'] = dict(self.stats['rules'])
+        requests = stats['requests']
+        stats['rule_fraction'] = stats['rule'] / requests if requests else 0.0
+        stats['llm_fraction'] = stats['llm'] / requests if requests else 0.0
+        # 每次评估的平均耗时（微秒）
+        stats['avg_rule_time'] = stats.pop('rule_time') / requests * 1e6 if requests else 0.0
+        return stats
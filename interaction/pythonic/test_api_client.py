@@ -1,7 +1,14 @@
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
 import time
 
+API_URL = "http://36.103.203.211:18535/api/query"
+STREAM_API_URL = API_URL + "/stream"
+BATCH_API_URL = API_URL + "/batch"
+
 
 def test_query(query: str, need_suggestion: bool = False) -> Dict[str, Any]:
     """
@@ -14,7 +21,7 @@ def test_query(query: str, need_suggestion: bool = False) -> Dict[str, Any]:
     Returns:
         API响应的JSON数据
     """
-    url = "http://36.103.203.211:18535/api/query"
+    url = API_URL
     headers = {"Content-Type": "application/json"}
     data = {
         "query": query,
@@ -30,21 +37,68 @@ def test_query(query: str, need_suggestion: bool = False) -> Dict[str, Any]:
         return None
 
 
+def test_stream_query(query: str, need_suggestion: bool = False) -> List[Dict[str, Any]]:
+    """
+    测试流式查询接口，打印每个事件到达的时间
+    
+    Args:
+        query: 查询文本
+        need_suggestion: 是否需要生成建议
+        
+    Returns:
+        收到的事件列表
+    """
+    data = {
+        "query": query,
+        "need_suggestion": need_suggestion
+    }
+    events = []
+    start_time = time.time()
+    first_event_time = None
+
+    try:
+        with requests.post(STREAM_API_URL, json=data, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                elapsed = time.time() - start_time
+                if first_event_time is None:
+                    first_event_time = elapsed
+                events.append(event)
+
+                # 增量文本事件太多，只打印关键事件
+                if event["event"] in ("token", "suggestion_token"):
+                    continue
+                detail = event.get("function") or event.get("message") or event.get("error") or ""
+                print(f"[{elapsed:.2f}秒] {event['event']} {detail}")
+    except requests.exceptions.RequestException as e:
+        print(f"请求失败: {str(e)}")
+
+    if first_event_time is not None:
+        print(f"首个事件耗时: {first_event_time:.2f}秒, 总耗时: {time.time() - start_time:.2f}秒")
+    return events
+
+
+# 测试用例列表
+TEST_CASES = [
+    "喂，客服吗？我这手机13800138000最近话费扣得有点快，能帮我查查余额吗？顺便看看最近都跟谁打电话了，通话时间长不长",
+    "那个，我想问一下13900139000的套餐使用情况，我记得流量快用完了，你帮我看看。对了，我开通的那些增值服务都有啥用处啊，能给我介绍一下吗",
+    "你好，我是13700137000的机主，这两天老是显示4G，想问问现在的网络状态咋样，能升5G不？还有我的信号老是时有时无的，这是咋回事啊",
+    "麻烦帮我查一下13600136000这个月的流量和通话时间还剩多少，感觉用得特别快，帮我看看是不是有什么异常情况",
+    "诶，我这个13500135000的亲情号码套餐还能加人吗？顺便帮我看看现在都有谁在共享流量，他们用了多少",
+    "你好，13400134000这个号码能开通国际漫游吗？我下个月要出差，想提前了解一下。还有，现在有什么合适的境外流量包推荐吗",
+    "帮我查查13300133000这个号，我记得开了好几个增值服务，但不太记得都有啥了，能不能帮我看看哪些用得少，可以取消的",
+    "那个，能帮我看看13200132000的套餐使用情况吗？主要是流量，我这个月老是提醒我快超了，想问问是不是有什么更合适的套餐可以推荐",
+    "你好，13100131000这号码前两天好像欠费了，但是我记得应该还有话费啊，能帮我查一下具体余额和最近的消费记录吗",
+    "麻烦问一下，13000130000这个号码现在的网络制式是什么？我这边信号不太好，想看看是不是可以换个套餐或者升级一下网络，有什么建议吗"
+]
+
+
 def run_test_cases():
     """运行测试用例"""
-    # 测试用例列表
-    test_cases = [
-        "喂，客服吗？我这手机13800138000最近话费扣得有点快，能帮我查查余额吗？顺便看看最近都跟谁打电话了，通话时间长不长",
-        "那个，我想问一下13900139000的套餐使用情况，我记得流量快用完了，你帮我看看。对了，我开通的那些增值服务都有啥用处啊，能给我介绍一下吗",
-        "你好，我是13700137000的机主，这两天老是显示4G，想问问现在的网络状态咋样，能升5G不？还有我的信号老是时有时无的，这是咋回事啊",
-        "麻烦帮我查一下13600136000这个月的流量和通话时间还剩多少，感觉用得特别快，帮我看看是不是有什么异常情况",
-        "诶，我这个13500135000的亲情号码套餐还能加人吗？顺便帮我看看现在都有谁在共享流量，他们用了多少",
-        "你好，13400134000这个号码能开通国际漫游吗？我下个月要出差，想提前了解一下。还有，现在有什么合适的境外流量包推荐吗",
-        "帮我查查13300133000这个号，我记得开了好几个增值服务，但不太记得都有啥了，能不能帮我看看哪些用得少，可以取消的",
-        "那个，能帮我看看13200132000的套餐使用情况吗？主要是流量，我这个月老是提醒我快超了，想问问是不是有什么更合适的套餐可以推荐",
-        "你好，13100131000这号码前两天好像欠费了，但是我记得应该还有话费啊，能帮我查一下具体余额和最近的消费记录吗",
-        "麻烦问一下，13000130000这个号码现在的网络制式是什么？我这边信号不太好，想看看是不是可以换个套餐或者升级一下网络，有什么建议吗"
-    ]
+    test_cases = TEST_CASES
 
     # 记录总体测试结果
     results = {
@@ -106,5 +160,123 @@ def run_test_cases():
         print(f"- {func}: 调用{count}次")
 
 
+def run_concurrent_test(concurrency: int = 10, need_suggestion: bool = False) -> Dict[str, Any]:
+    """
+    并发压测：同时发出多个查询，检查服务端是否并发处理（请求耗时区间互相重叠）而不是排队执行
+    
+    Args:
+        concurrency: 同时发出的请求数量
+        need_suggestion: 是否需要生成建议
+        
+    Returns:
+        压测统计信息
+    """
+    queries = [TEST_CASES[i % len(TEST_CASES)] for i in range(concurrency)]
+    intervals: List[tuple] = []  # (开始时间, 结束时间, 是否成功)
+
+    def worker(query: str) -> None:
+        start = time.time()
+        response = test_query(query, need_suggestion=need_suggestion)
+        intervals.append((start, time.time(), response is not None))
+
+    print(f"开始并发测试，并发数: {concurrency}")
+    print("=" * 50)
+
+    wall_start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, queries))
+    wall_time = time.time() - wall_start
+
+    latencies = sorted(end - start for start, end, _ in intervals)
+    serial_time = sum(latencies)
+
+    # 统计同一时刻最多有多少个请求在处理中
+    events = sorted([(start, 1) for start, _, _ in intervals] + [(end, -1) for _, end, _ in intervals])
+    in_flight = max_in_flight = 0
+    for _, delta in events:
+        in_flight += delta
+        max_in_flight = max(max_in_flight, in_flight)
+
+    stats = {
+        "concurrency": concurrency,
+        "successful": sum(1 for *_, ok in intervals if ok),
+        "wall_time": wall_time,
+        "serial_time": serial_time,
+        "speedup": serial_time / wall_time if wall_time > 0 else 0,
+        "max_in_flight": max_in_flight,
+        "p50_latency": latencies[len(latencies) // 2],
+        "max_latency": latencies[-1]
+    }
+
+    print("\n并发测试统计:")
+    print(f"成功数: {stats['successful']}/{concurrency}")
+    print(f"总耗时(墙钟): {wall_time:.2f}秒")
+    print(f"各请求耗时之和: {serial_time:.2f}秒")
+    print(f"并发加速比: {stats['speedup']:.2f}x")
+    print(f"最大同时处理请求数: {max_in_flight}")
+    print(f"P50耗时: {stats['p50_latency']:.2f}秒, 最长耗时: {stats['max_latency']:.2f}秒")
+    # 排队执行时墙钟时间约等于各请求耗时之和，加速比接近 1
+    if stats['speedup'] < 1.5:
+        print("警告：请求基本是排队执行的，服务端可能存在阻塞事件循环的调用")
+
+    return stats
+
+
+def run_batch_test(need_suggestion: bool = False, max_concurrency: int = 8) -> Dict[str, Any]:
+    """
+    通过批量接口一次性提交全部测试用例
+    
+    Args:
+        need_suggestion: 是否需要生成建议
+        max_concurrency: 服务端同时进行的模型调用数量上限
+        
+    Returns:
+        批量接口的响应数据
+    """
+    data = {
+        "queries": TEST_CASES,
+        "need_suggestion": need_suggestion,
+        "max_concurrency": max_concurrency
+    }
+
+    print(f"开始批量测试，用例数: {len(TEST_CASES)}")
+    print("=" * 50)
+
+    start_time = time.time()
+    try:
+        response = requests.post(BATCH_API_URL, json=data)
+        response.raise_for_status()
+        batch = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"请求失败: {str(e)}")
+        return None
+    request_time = time.time() - start_time
+
+    function_stats = {}
+    for query, result in zip(TEST_CASES, batch["results"]):
+        for func in result["executed_functions"]:
+            function_stats[func] = function_stats.get(func, 0) + 1
+
+    print("\n批量测试统计:")
+    print(f"请求耗时: {request_time:.2f}秒")
+    print(f"服务端批次耗时: {batch['total_time'] / 1000:.2f}秒")
+    print(f"各查询耗时之和: {batch['sum_execution_time'] / 1000:.2f}秒")
+    print(f"重复查询数: {batch['deduplicated_queries']}")
+    print(f"工具调用数: {batch['tool_calls']}, 去重复用: {batch['deduplicated_tool_calls']}")
+
+    print("\n函数调用统计:")
+    for func, count in function_stats.items():
+        print(f"- {func}: 调用{count}次")
+
+    return batch
+
+
 if __name__ == "__main__":
-    run_test_cases()
+    if len(sys.argv) > 1 and sys.argv[1] == "concurrent":
+        run_concurrent_test(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        run_batch_test(need_suggestion=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "stream":
+        test_stream_query(TEST_CASES[0], need_suggestion=True)
+    else:
+        run_test_cases()
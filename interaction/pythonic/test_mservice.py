@@ -1,4 +1,6 @@
 import re
+import hashlib
+from collections import OrderedDict
 from typing import Optional, Any, Dict, List
 from datetime import datetime, timedelta
 from langchain.schema import HumanMessage, SystemMessage
@@ -7,6 +9,18 @@ from time import time
 from model import chat
 from threading import Thread, Lock
 from queue import Queue
+from tool_metrics import ToolMetrics
+from code_analysis import analyze_calls
+
+# 编译结果缓存：同一份生成代码在进程内只包装、编译一次，验证和执行共用
+COMPILE_CACHE_MAX_SIZE = 256
+_compile_cache: "OrderedDict[str, Any]" = OrderedDict()
+_compile_cache_lock = Lock()
+_compile_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0
+}
 
 
 def load_test_data(test_cases: List[str], functions_schema: str, prompt_template: str) -> Dict[str, Any]:
@@ -39,7 +53,8 @@ def load_test_data(test_cases: List[str], functions_schema: str, prompt_template
             },
             'function_stats': {  # 新增：函数调用统计
                 'calls': {},  # 记录每个函数的调用次数
-                'avg_time': {}  # 记录每个函数的平均响应时间
+                'avg_time': {},  # 记录每个函数的平均响应时间
+                'metrics': {}  # 每个函数的详细耗时统计（见 tool_metrics.ToolMetrics）
             }
         }
     }
@@ -52,6 +67,61 @@ def extract_python_code(text: str) -> Optional[str]:
     return matches[0] if matches else None
 
 
+def wrap_generated_code(code: str) -> str:
+    """
+    把生成的代码包装到 _execute 函数中（生成的代码里可能直接出现顶层 return），
+    执行后返回值保存在 _return_value 变量中
+    """
+    return f"""
+def _execute():
+{chr(10).join('    ' + line for line in code.split(chr(10)))}
+
+_return_value = _execute()
+"""
+
+
+def compile_generated_code(code: str):
+    """
+    包装并编译生成的代码，编译结果按代码内容的哈希缓存
+    
+    Args:
+        code: 生成的代码
+        
+    Returns:
+        编译后的代码对象
+        
+    Raises:
+        SyntaxError: 代码存在语法错误（不缓存）
+    """
+    key = hashlib.sha256(code.encode('utf-8')).hexdigest()
+    with _compile_cache_lock:
+        compiled = _compile_cache.get(key)
+        if compiled is not None:
+            _compile_cache.move_to_end(key)
+            _compile_cache_stats['hits'] += 1
+            return compiled
+
+    compiled = compile(wrap_generated_code(code), '<generated>', 'exec')
+
+    with _compile_cache_lock:
+        _compile_cache_stats['misses'] += 1
+        _compile_cache[key] = compiled
+        while len(_compile_cache) > COMPILE_CACHE_MAX_SIZE:
+            _compile_cache.popitem(last=False)
+            _compile_cache_stats['evictions'] += 1
+    return compiled
+
+
+def get_compile_cache_stats() -> Dict[str, Any]:
+    """返回编译缓存的统计信息"""
+    with _compile_cache_lock:
+        stats = dict(_compile_cache_stats)
+        stats['size'] = len(_compile_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
 def validate_generated_code(code: str, required_functions: List[str]) -> tuple[bool, str]:
     """
     验证生成的代码质量
@@ -66,36 +136,50 @@ def validate_generated_code(code: str, required_functions: List[str]) -> tuple[b
     if not code:
         return False, "空代码"
 
-    # 检查是否包含必要的函数调用
-    found_functions = []
-    for func in required_functions:
-        if func in code:
-            found_functions.append(func)
+    # 解析代码中真正的函数调用（注释、字符串中出现的函数名不算）
+    analysis = analyze_calls(code, required_functions)
+    if analysis.syntax_error is not None:
+        return False, f"语法错误: {analysis.syntax_error}"
 
+    # 检查是否包含必要的函数调用
+    found_functions = analysis.called_functions
     if not found_functions:
         return False, "没有使用任何预定义函数"
 
-    # 检查手机号格式（新增）
-    phone_pattern = r"1[3-9]\d{9}"
-    if re.search(phone_pattern, code):
-        if not all(len(num) == 11 for num in re.findall(phone_pattern, code)):
-            return False, "存在格式不正确的手机号"
-
-    # 包装代码到函数中进行语法检查
-    wrapped_code = f"""
-def _validate():
-{chr(10).join('    ' + line for line in code.split(chr(10)))}
-"""
+    # 检查调用参数中的手机号格式：以 1 开头的纯数字字符串应为 11 位
+    for call in analysis.calls:
+        literals = list(call.args or ()) + list((call.kwargs or {}).values())
+        for value in literals:
+            if isinstance(value, str) and re.fullmatch(r"1\d{6,}", value) and len(value) != 11:
+                return False, f"存在格式不正确的手机号: {value}"
 
-    # 基本的语法检查
+    # 包装代码到函数中进行编译，编译结果会被 execute_code 复用
     try:
-        compile(wrapped_code, '<string>', 'exec')
+        compile_generated_code(code)
     except SyntaxError as e:
         return False, f"语法错误: {str(e)}"
 
     return True, f"代码验证通过，使用了以下函数: {', '.join(found_functions)}"
 
 
+def execution_globals() -> dict:
+    """执行生成代码时，除工具函数外提供的基础模块和常量（每次返回新的字典，代码对它们的修改不会互相影响）"""
+    return {
+        'datetime': datetime,
+        'timedelta': timedelta,
+        'random': random,
+        'print': print,
+        'Thread': Thread,
+        'Lock': Lock,
+        'Queue': Queue,
+        'PACKAGE_TYPES': {  # 从 mservice.py 导入
+            "data": "流量包",
+            "voice": "通话包",
+            "sms": "短信包"
+        }
+    }
+
+
 def execute_code(code: str, global_context: dict) -> dict:
     """
     在提供的上下文中执行代码
@@ -109,20 +193,7 @@ def execute_code(code: str, global_context: dict) -> dict:
     """
     try:
         # 添加基础模块和常量到执行环境
-        global_context.update({
-            'datetime': datetime,
-            'timedelta': timedelta,
-            'random': random,
-            'print': print,
-            'Thread': Thread,
-            'Lock': Lock,
-            'Queue': Queue,
-            'PACKAGE_TYPES': {  # 从 mservice.py 导入
-                "data": "流量包",
-                "voice": "通话包",
-                "sms": "短信包"
-            }
-        })
+        global_context.update(execution_globals())
 
         # 创建本地变量空间
         local_context = {}
@@ -130,17 +201,12 @@ def execute_code(code: str, global_context: dict) -> dict:
         # 记录函数调用开始时间
         start_time = time()
 
-        # 包装代码以捕获返回值
-        wrapped_code = f"""
-def _execute():
-{chr(10).join('    ' + line for line in code.split(chr(10)))}
-
-_return_value = _execute()
-"""
+        # 包装代码以捕获返回值（验证阶段已编译过的代码直接复用编译结果）
+        compiled_code = compile_generated_code(code)
 
         # 执行代码
         print("开始执行生成的代码...")
-        exec(wrapped_code, global_context, local_context)
+        exec(compiled_code, global_context, local_context)
         print("代码执行完成")
 
         # 计算执行时间
@@ -174,6 +240,10 @@ def run_test(config: Dict[str, Any], mock_functions: Dict[str, Any], required_fu
         stats['function_stats']['calls'][func] = 0
         stats['function_stats']['avg_time'][func] = 0.0
 
+    # 给每个函数加上计时代理，记录生成代码执行期间的真实调用次数和耗时
+    metrics = ToolMetrics()
+    mock_functions = metrics.wrap(mock_functions)
+
     for idx, test_case in enumerate(config['test_cases'], 1):
         print(f"\n{'=' * 20} 测试用例 {idx}/{stats['total']} {'=' * 20}")
         print(f"测试内容: {test_case}")
@@ -232,17 +302,6 @@ def run_test(config: Dict[str, Any], mock_functions: Dict[str, Any], required_fu
             query_time = time() - case_start_time
             print(f"\n本次查询耗时: {query_time:.2f}秒")
 
-            # 更新函数调用统计
-            for func in required_functions:
-                if func in code:
-                    stats['function_stats']['calls'][func] += 1
-                    # 这里假设每个函数调用大约花费 1 秒
-                    current_avg = stats['function_stats']['avg_time'][func]
-                    calls = stats['function_stats']['calls'][func]
-                    stats['function_stats']['avg_time'][func] = (
-                            (current_avg * (calls - 1) + local_vars.get('_execution_time', 1.0)) / calls
-                    )
-
             stats['success'] += 1
 
         except Exception as e:
@@ -260,6 +319,13 @@ def run_test(config: Dict[str, Any], mock_functions: Dict[str, Any], required_fu
 
         print(f"{'=' * 20} 用例执行完成 {'=' * 20}\n")
 
+    # 汇总函数调用统计（计时代理的单位是毫秒，这里与其他耗时统计一样换算成秒）
+    function_metrics = metrics.get_stats()
+    for func, func_stats in function_metrics.items():
+        stats['function_stats']['calls'][func] = func_stats['calls']
+        stats['function_stats']['avg_time'][func] = func_stats['avg_time'] / 1000
+    stats['function_stats']['metrics'] = function_metrics
+
     # 计算总耗时和平均耗时
     stats['timing']['total_time'] = time() - total_start_time
     stats['timing']['average_time'] = stats['timing']['total_time'] / stats['total']
@@ -287,12 +353,21 @@ def print_test_results(stats: Dict[str, Any]) -> None:
     print(f"最短耗时: {stats['timing']['min_time']:.2f}秒")
     print(f"最长耗时: {stats['timing']['max_time']:.2f}秒")
 
-    print("\n函数调用统计:")
-    for func, calls in stats['function_stats']['calls'].items():
-        avg_time = stats['function_stats']['avg_time'][func]
+    print("\n函数调用统计(按总耗时排序):")
+    metrics = stats['function_stats']['metrics']
+    total_tool_time = sum(func_stats['total_time'] for func_stats in metrics.values())
+    for func, func_stats in metrics.items():
+        share = func_stats['total_time'] / total_tool_time * 100 if total_tool_time else 0.0
         print(f"- {func}:")
-        print(f"  调用次数: {calls}")
-        print(f"  平均响应时间: {avg_time:.2f}秒")
+        print(f"  调用次数: {func_stats['calls']}，失败: {func_stats['errors']}")
+        print(f"  平均响应时间: {func_stats['avg_time'] / 1000:.2f}秒，"
+              f"P50: {func_stats['p50_time'] / 1000:.2f}秒，"
+              f"P95: {func_stats['p95_time'] / 1000:.2f}秒，"
+              f"最长: {func_stats['max_time'] / 1000:.2f}秒")
+        print(f"  总耗时占比: {share:.1f}%，最大并发: {func_stats['max_concurrency']}")
+    unused = [func for func, calls in stats['function_stats']['calls'].items() if calls == 0]
+    if unused:
+        print(f"未被调用的函数: {', '.join(unused)}")
 
     if stats['failed_cases']:
         print("\n失败用例详情:")
@@ -0,0 +1,203 @@
+"""
+工具函数调用结果缓存
+
+生成的代码经常在一次请求里用相同的号码重复调用同一个函数（例如先查增值服务列表，再逐个查使用情况，
+中间又查一次余额），不同请求之间也会反复查询同一个用户。这里对工具函数做一层带过期时间的结果缓存：
+- 每个函数单独设置有效期：余额、网络状态变化快，有效期短；套餐、增值服务列表变化慢，有效期长
+- 写操作（比如添加亲情号码）不缓存，执行后清除该号码的所有缓存结果；与写操作同时进行的读取的结果可能是写之前的，
+  不再保存
+- 按函数统计命中、未命中、过期和失效次数
+"""
+import copy
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+# 判断一次调用是否为写操作：(函数名, 绑定后的参数字典) -> bool
+WritePredicate = Callable[[str, Dict[str, Any]], bool]
+
+
+class ToolResultCache:
+    """
+    工具函数结果缓存，支持按函数设置有效期、LRU 淘汰和按号码失效
+
+    Example:
+        cache = ToolResultCache({'search_phone_number_balance': 10})
+        functions = cache.wrap(load_raw_functions(), is_write=is_write_call)
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_size: int = 4096, subject_param: str = 'phone_number'):
+        """
+        Args:
+            ttls: 函数名到有效期（秒）的映射，不在其中的函数不缓存
+            max_size: 最多缓存的结果数量，超过后淘汰最久未使用的
+            subject_param: 标识缓存归属（写操作后按它失效）的参数名
+        """
+        self.ttls = dict(ttls)
+        self.max_size = max_size
+        self.subject_param = subject_param
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any, Any]]" = OrderedDict()
+        self._subjects: Dict[Any, Set[Tuple[str, str]]] = {}
+        self._generations: Dict[Any, int] = {}  # 每个号码的缓存被清除的次数
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, name: str, field: str) -> None:
+        stats = self._stats.setdefault(name, {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'invalidated': 0,  # 因写操作被清除的结果数
+            'writes': 0,
+            'discarded': 0,  # 调用期间该号码的缓存被清除，没有保存的结果数
+            'uncached': 0  # 未配置有效期而直接调用的次数
+        })
+        stats[field] += 1
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        """删除一条缓存（调用方持有锁）"""
+        _, _, subject = self._entries.pop(key)
+        keys = self._subjects.get(subject)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._subjects[subject]
+
+    def get(self, name: str, arguments: Dict[str, Any]) -> Tuple[bool, Any]:
+        """
+        查找缓存的结果
+
+        Returns:
+            (是否命中, 结果)
+        """
+        key = (name, repr(sorted(arguments.items())))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() > entry[0]:
+                self._remove(key)
+                self._count(name, 'expired')
+                entry = None
+            if entry is None:
+                self._count(name, 'misses')
+                return False, None
+            self._entries.move_to_end(key)
+            self._count(name, 'hits')
+        # 列表、字典等可变结果返回副本，避免生成的代码修改缓存内容
+        return True, copy.deepcopy(entry[1])
+
+    def generation(self, subject: Any) -> int:
+        """号码的缓存被清除的次数，调用函数前记下，保存结果时用于判断期间是否有写操作"""
+        with self._lock:
+            return self._generations.get(subject, 0)
+
+    def put(self, name: str, arguments: Dict[str, Any], result: Any, generation: Optional[int] = None) -> None:
+        """
+        保存调用结果
+
+        Args:
+            generation: 可选，调用函数前 generation() 的返回值；期间该号码的缓存被清除过时不保存
+        """
+        key = (name, repr(sorted(arguments.items())))
+        subject = arguments.get(self.subject_param)
+        with self._lock:
+            if generation is not None and self._generations.get(subject, 0) != generation:
+                # 结果可能是写操作之前读到的，保存下来会在整个有效期内返回旧数据
+                self._count(name, 'discarded')
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttls[name], copy.deepcopy(result), subject)
+            self._subjects.setdefault(subject, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, subject: Any) -> int:
+        """
+        清除某个号码的所有缓存结果
+
+        Args:
+            subject: 号码（subject_param 参数的取值）
+
+        Returns:
+            清除的结果数量
+        """
+        with self._lock:
+            self._generations[subject] = self._generations.get(subject, 0) + 1
+            keys = list(self._subjects.get(subject, ()))
+            for key in keys:
+                self._remove(key)
+                self._count(key[0], 'invalidated')
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._subjects.clear()
+
+    def wrap(self, functions: Dict[str, Callable], is_write: Optional[WritePredicate] = None) -> Dict[str, Callable]:
+        """
+        返回经过缓存包装的函数字典
+
+        Args:
+            functions: 工具函数字典
+            is_write: 判断调用是否为写操作，写操作不缓存，执行后清除该号码的缓存
+
+        Returns:
+            包装后的函数字典
+        """
+        return {name: self._wrap_function(name, func, is_write) for name, func in functions.items()}
+
+    def _wrap_function(self, name: str, func: Callable, is_write: Optional[WritePredicate]) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                bound = signature.bind(*args, **kwargs)
+            except TypeError:
+                # 参数不匹配，交给原函数报错
+                return func(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+
+            if is_write is not None and is_write(name, arguments):
+                with self._lock:
+                    self._count(name, 'writes')
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.invalidate(arguments.get(self.subject_param))
+
+            if name not in self.ttls:
+                with self._lock:
+                    self._count(name, 'uncached')
+                return func(*args, **kwargs)
+
+            generation = self.generation(arguments.get(self.subject_param))
+            hit, result = self.get(name, arguments)
+            if hit:
+                return result
+            result = func(*args, **kwargs)
+            self.put(name, arguments, result, generation)
+            return result
+
+        return wrapper
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回按函数统计的命中信息、整体命中率和当前大小"""
+        with self._lock:
+            functions = {name: dict(stats) for name, stats in self._stats.items()}
+            size = len(self._entries)
+        for stats in functions.values():
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        hits = sum(stats['hits'] for stats in functions.values())
+        lookups = hits + sum(stats['misses'] for stats in functions.values())
+        return {
+            'size': size,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'functions': functions
+        }
@@ -0,0 +1,128 @@
+"""
+工具函数调用的耗时统计
+
+在工具函数外面包一层计时代理，记录生成代码执行期间每个函数真实的调用次数、耗时分布、错误数和并发度，
+用于找出真正拖慢请求的后端调用（而不是把整段代码的执行时间平摊到代码里出现过的每个函数上）。
+"""
+import functools
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List
+
+# 耗时直方图的分桶上界（毫秒），最后一个桶收集超过最大上界的调用
+LATENCY_BUCKETS_MS = [10, 50, 100, 250, 500, 1000, 2000, 5000]
+
+# 每个函数保留最近多少次调用的耗时用于计算分位数
+LATENCY_SAMPLE_SIZE = 1024
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """计算分位数（最近秩法），samples 为空时返回 0"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+class _FunctionMetrics:
+    """单个函数的统计数据"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.in_flight = 0
+        self.max_concurrency = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.samples: deque = deque(maxlen=LATENCY_SAMPLE_SIZE)
+
+    def record(self, elapsed_ms: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total_time += elapsed_ms
+        self.max_time = max(self.max_time, elapsed_ms)
+        self.samples.append(elapsed_ms)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        samples = list(self.samples)
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.calls if self.calls else 0.0,
+            'p50_time': percentile(samples, 50),
+            'p95_time': percentile(samples, 95),
+            'max_time': self.max_time,
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'histogram': dict(zip(labels, self.buckets))
+        }
+
+
+class ToolMetrics:
+    """
+    记录工具函数调用耗时的计时代理，时间单位均为毫秒
+
+    Example:
+        metrics = ToolMetrics()
+        functions = metrics.wrap(load_raw_functions())
+        ...
+        print(metrics.get_stats())
+    """
+
+    def __init__(self):
+        self._functions: Dict[str, _FunctionMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> _FunctionMetrics:
+        """调用方持有锁"""
+        metrics = self._functions.get(name)
+        if metrics is None:
+            metrics = self._functions[name] = _FunctionMetrics()
+        return metrics
+
+    def wrap(self, functions: Dict[str, Callable]) -> Dict[str, Callable]:
+        """返回经过计时代理包装的函数字典"""
+        return {name: self._wrap_function(name, func) for name, func in functions.items()}
+
+    def _wrap_function(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self._lock:
+                metrics = self._get(name)
+                metrics.in_flight += 1
+                metrics.max_concurrency = max(metrics.max_concurrency, metrics.in_flight)
+            start_time = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                elapsed_ms = (time.perf_counter() - start_time) * 1000
+                with self._lock:
+                    metrics.in_flight -= 1
+                    metrics.record(elapsed_ms, failed)
+
+        return wrapper
+
+    def reset(self) -> None:
+        with self._lock:
+            self._functions.clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回按函数统计的调用信息，按总耗时从高到低排列"""
+        with self._lock:
+            stats = {name: metrics.to_dict() for name, metrics in self._functions.items()}
+        return dict(sorted(stats.items(), key=lambda item: item[1]['total_time'], reverse=True))
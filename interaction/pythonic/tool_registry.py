@@ -0,0 +1,211 @@
+"""
+工具函数注册表
+
+工具函数用 ToolRegistry.tool 装饰器注册后，提示词中的函数定义（schema）、函数名列表和函数字典都从函数本身的
+签名和文档字符串生成，不再手工维护三份相同的内容。
+
+schema 有两种渲染方式：
+- full: 完整的函数定义和文档字符串（与原先手写的 functions_schema 格式相同）
+- compact: 每个函数一行签名，加上一行说明，提示词明显更短
+
+每次请求都要发送 schema，提示词越长，模型的首 token 延迟和费用越高，token_report 用于比较两种渲染方式的 token 数。
+
+用法: python tool_registry.py [模块名]，打印该模块注册表的 token 数对比（默认 mservice）
+"""
+import functools
+import importlib
+import inspect
+import re
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # 未安装时按字符数估算
+    tiktoken = None
+
+SCHEMA_MODES = ('full', 'compact')
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+@functools.lru_cache(maxsize=None)
+def _load_encoding():
+    """加载 tiktoken 编码，首次使用需要联网下载编码文件，失败时返回 None（之后不再重试）"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> tuple[int, str]:
+    """
+    统计文本的 token 数
+
+    Returns:
+        (token 数, 计数方式)。安装了 tiktoken 时使用 cl100k_base 编码，否则按中文字符约 1 个 token、
+        其他字符约 4 个字符 1 个 token 估算（不同模型的分词器结果会有差异，只适合做相对比较）
+    """
+    encoding = _load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text)), 'tiktoken/cl100k_base'
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4, 'estimate'
+
+
+def _compact_item(text: str) -> str:
+    """把 "- name: 姓名" 这样的子项压缩成 name(姓名)"""
+    text = text.lstrip('- ').strip()
+    if ':' in text:
+        key, description = text.split(':', 1)
+        return f"{key.strip()}({description.strip()})" if description.strip() else key.strip()
+    return text
+
+
+def _parse_docstring(doc: str) -> tuple[str, Dict[str, str], str]:
+    """
+    从文档字符串中取出第一行说明、Args 中每个参数的说明和 Returns 的说明
+
+    参数、返回值说明下更深一层缩进的子项（比如字典包含的字段）会压缩到同一行
+    """
+    lines = doc.splitlines()
+    summary = lines[0].strip() if lines else ''
+    params: Dict[str, str] = {}
+    returns: List[str] = []
+    section = None
+    current = None
+    for line in lines[1:]:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if not line.startswith(' ') and stripped.endswith(':'):
+            section = stripped[:-1]
+            current = None
+            continue
+        if section == 'Args':
+            if not line.startswith('     ') and ':' in stripped:
+                current, description = (part.strip() for part in stripped.split(':', 1))
+                params[current] = description
+            elif current is not None:
+                separator = ' ' if params[current].endswith(':') else '、'
+                params[current] += separator + _compact_item(stripped)
+        elif section == 'Returns':
+            if returns and returns[-1].endswith(':'):
+                returns.append(' ' + _compact_item(stripped))
+            elif returns and stripped.startswith('-'):
+                returns.append('、' + _compact_item(stripped))
+            else:
+                returns.append(stripped)
+    return summary, params, ''.join(returns)
+
+
+class ToolRegistry:
+    """
+    工具函数注册表
+
+    Example:
+        tools = ToolRegistry()
+
+        @tools.tool
+        def search_phone_number_balance(phone_number: str) -> str:
+            \"\"\"查询指定手机号码的账户余额\"\"\"
+            ...
+
+        functions_schema = tools.render_schema()
+    """
+
+    def __init__(self):
+        self._functions: "OrderedDict[str, Callable]" = OrderedDict()
+        self._schema_cache: Dict[Tuple[str, str], str] = {}
+
+    def tool(self, func: Callable) -> Callable:
+        """注册工具函数的装饰器，原样返回函数"""
+        if func.__name__ in self._functions:
+            raise ValueError(f"工具函数 {func.__name__} 重复注册")
+        self._functions[func.__name__] = func
+        self._schema_cache.clear()
+        return func
+
+    @property
+    def names(self) -> List[str]:
+        """按注册顺序排列的函数名列表"""
+        return list(self._functions)
+
+    def functions(self) -> Dict[str, Callable]:
+        """函数名到函数的字典（每次返回新的字典，调用方可以自行包装）"""
+        return dict(self._functions)
+
+    def render_schema(self, mode: str = 'full', names: Optional[Iterable[str]] = None) -> str:
+        """
+        生成提示词中的函数定义，每个函数的渲染结果会被缓存
+
+        Args:
+            mode: full 或 compact
+            names: 只渲染这些函数（按注册顺序排列），默认渲染全部
+
+        Returns:
+            函数定义文本
+        """
+        if mode not in SCHEMA_MODES:
+            raise ValueError(f"不支持的 schema 格式: {mode}，可选: {', '.join(SCHEMA_MODES)}")
+        selected = set(self._functions) if names is None else set(names)
+        return '\n'.join(self._render(mode, name) for name in self._functions if name in selected)
+
+    def _render(self, mode: str, name: str) -> str:
+        key = (mode, name)
+        text = self._schema_cache.get(key)
+        if text is None:
+            render = self._render_full if mode == 'full' else self._render_compact
+            text = self._schema_cache[key] = render(self._functions[name])
+        return text
+
+    def describe(self, name: str) -> str:
+        """函数的说明文本（第一行说明、参数和返回值说明），供检索等使用"""
+        summary, params, returns = _parse_docstring(inspect.getdoc(self._functions[name]) or '')
+        return ' '.join([summary, *params.values(), returns])
+
+    @staticmethod
+    def _render_full(func: Callable) -> str:
+        doc = inspect.getdoc(func) or ''
+        body = '\n'.join(f'    {line}'.rstrip() for line in doc.splitlines())
+        return f'def {func.__name__}{inspect.signature(func)}:\n    """\n{body}\n    """\n    pass\n'
+
+    @staticmethod
+    def _render_compact(func: Callable) -> str:
+        summary, params, returns = _parse_docstring(inspect.getdoc(func) or '')
+        details = [f'{name}: {description}' for name, description in params.items()]
+        if returns:
+            details.append(f'返回: {returns}')
+        comment = f"{summary}（{'；'.join(details)}）" if details else summary
+        return f'def {func.__name__}{inspect.signature(func)}  # {comment}'
+
+    def token_report(self) -> Dict[str, Dict[str, Any]]:
+        """返回每种渲染方式的字符数和 token 数"""
+        report = {}
+        for mode in SCHEMA_MODES:
+            schema = self.render_schema(mode)
+            tokens, counter = count_tokens(schema)
+            report[mode] = {'chars': len(schema), 'tokens': tokens, 'counter': counter}
+        return report
+
+
+def print_token_report(registry: ToolRegistry) -> None:
+    """打印各渲染方式的 token 数对比"""
+    report = registry.token_report()
+    full_tokens = report['full']['tokens']
+    print(f"工具函数数量: {len(registry.names)}")
+    for mode, item in report.items():
+        ratio = item['tokens'] / full_tokens * 100 if full_tokens else 0.0
+        print(f"- {mode}: {item['chars']}字符, {item['tokens']} tokens ({item['counter']}), 为 full 的 {ratio:.0f}%")
+
+
+if __name__ == "__main__":
+    module = importlib.import_module(sys.argv[1] if len(sys.argv) > 1 else 'mservice')
+    for value in vars(module).values():
+        if isinstance(value, ToolRegistry):
+            print_token_report(value)
+            print("\ncompact 格式:")
+            print(value.render_schema('compact'))
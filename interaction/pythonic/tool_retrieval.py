@@ -0,0 +1,199 @@
+"""
+按查询检索相关的工具函数
+
+每次请求都把全部函数定义放进提示词，函数一多提示词就会很长，模型的首 token 延迟和费用随之增加。
+这里在构造提示词前先做一次本地检索：对每个函数的名称、说明和关键词建立字符 n-gram 的 BM25 索引
+（中文没有空格分词，用相邻两个字作为词项），按查询打分后只把得分最高的 k 个函数放进提示词。
+
+索引在创建时一次性建好，检索只是内存中的打分，耗时在毫秒以内。
+"""
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from tool_registry import ToolRegistry, count_tokens
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 查询中完整出现一个关键词时额外加的分数
+KEYWORD_WEIGHT = 2.0
+
+# 缓存多少组函数的 schema token 数（只用于统计，同一组函数不必每次重新渲染、计数）
+SCHEMA_TOKEN_CACHE_SIZE = 256
+
+# 手机号、日期等长数字与工具的选择无关
+_NUMBER_PATTERN = re.compile(r'\d{5,}|\d{4}-\d{2}-\d{2}')
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[^\sa-z0-9]+')
+_PUNCTUATION_PATTERN = re.compile(r'[，。！？、；：,.!?;:（）()\[\]【】"“”\'‘’/\-_]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    把文本切分成检索用的词项：英文单词、数字整体作为一个词项，中文切成相邻两个字的二元组
+
+    Args:
+        text: 查询或函数说明
+
+    Returns:
+        词项列表（可能重复）
+    """
+    text = _NUMBER_PATTERN.sub(' ', text.lower())
+    text = _PUNCTUATION_PATTERN.sub(' ', text)
+    terms = []
+    for word in _WORD_PATTERN.findall(text):
+        if word.isascii():
+            terms.append(word)
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class ToolRetriever:
+    """
+    工具函数检索器
+
+    Example:
+        retriever = ToolRetriever(tools, keywords={'search_phone_number_balance': ['余额', '话费']})
+        names = retriever.retrieve("帮我查下13800138000的余额", top_k=3)
+        schema = tools.render_schema(names=names)
+    """
+
+    def __init__(self, registry: ToolRegistry, keywords: Optional[Dict[str, List[str]]] = None,
+                 schema_mode: str = 'full'):
+        """
+        Args:
+            registry: 工具函数注册表
+            keywords: 函数名到关键词列表的映射，用户常用的说法（比如"话费""信号"）不一定出现在函数说明中
+            schema_mode: 统计提示词缩减比例时使用的 schema 格式
+        """
+        self.registry = registry
+        self.keywords = {name: [word.lower() for word in words] for name, words in (keywords or {}).items()}
+        self.schema_mode = schema_mode
+
+        # 建立索引：每个函数一篇文档，内容为函数名中的单词、说明和关键词
+        self.names = registry.names
+        self._term_counts: Dict[str, Counter] = {}
+        for name in self.names:
+            text = ' '.join([name.replace('_', ' '), registry.describe(name), *self.keywords.get(name, [])])
+            self._term_counts[name] = Counter(tokenize(text))
+        self._avg_length = sum(sum(counts.values()) for counts in self._term_counts.values()) / max(len(self.names), 1)
+        document_frequency = Counter(term for counts in self._term_counts.values() for term in counts)
+        total = len(self.names)
+        self._idf = {
+            term: math.log(1 + (total - freq + 0.5) / (freq + 0.5)) for term, freq in document_frequency.items()
+        }
+        self._full_schema_tokens = count_tokens(registry.render_schema(schema_mode))[0]
+        self._schema_tokens: "OrderedDict[Tuple[str, ...], int]" = OrderedDict()
+
+        self._lock = threading.Lock()
+        self.stats = {
+            'queries': 0,
+            'fallbacks': 0,  # 没有任何函数得分、退回使用全部函数的次数
+            'selected_tools': 0,
+            'schema_tokens': 0,
+            'full_schema_tokens': 0,
+            'generations': 0,  # 检查过的生成代码数
+            'missed_generations': 0,  # 其中调用了提示词之外函数的次数（检索漏掉了需要的函数）
+            'unknown_calls': 0,  # 调用不存在的函数的次数
+            'missed_tools': {}  # 被漏掉（没有选中却被代码调用）的已注册函数及次数
+        }
+
+    def score(self, query: str) -> Dict[str, float]:
+        """计算每个函数与查询的相关性得分（BM25 + 关键词命中）"""
+        query_terms = set(tokenize(query))
+        lowered = query.lower()
+        scores = {}
+        for name in self.names:
+            counts = self._term_counts[name]
+            length = sum(counts.values())
+            score = 0.0
+            for term in query_terms:
+                freq = counts.get(term)
+                if not freq:
+                    continue
+                norm = freq + BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_length)
+                score += self._idf[term] * freq * (BM25_K1 + 1) / norm
+            score += KEYWORD_WEIGHT * sum(1 for word in self.keywords.get(name, []) if word in lowered)
+            scores[name] = score
+        return scores
+
+    def retrieve(self, query: str, top_k: int) -> List[str]:
+        """
+        检索与查询最相关的函数
+
+        Args:
+            query: 用户查询
+            top_k: 最多返回的函数数量
+
+        Returns:
+            函数名列表，按注册顺序排列（同一组函数生成的提示词完全相同，便于复用前缀缓存）。
+            没有任何函数得分时返回全部函数
+        """
+        scores = self.score(query)
+        ranked = [name for name, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+                  if score > 0][:top_k]
+        fallback = not ranked
+        selected = set(self.names if fallback else ranked)
+        names = [name for name in self.names if name in selected]
+
+        schema_tokens = self._count_schema_tokens(tuple(names))
+        with self._lock:
+            self.stats['queries'] += 1
+            self.stats['fallbacks'] += fallback
+            self.stats['selected_tools'] += len(names)
+            self.stats['schema_tokens'] += schema_tokens
+            self.stats['full_schema_tokens'] += self._full_schema_tokens
+        return names
+
+    def _count_schema_tokens(self, names: Tuple[str, ...]) -> int:
+        """一组函数的 schema token 数，按函数组合缓存"""
+        with self._lock:
+            tokens = self._schema_tokens.get(names)
+            if tokens is not None:
+                self._schema_tokens.move_to_end(names)
+                return tokens
+        tokens = count_tokens(self.registry.render_schema(self.schema_mode, names))[0]
+        with self._lock:
+            self._schema_tokens[names] = tokens
+            while len(self._schema_tokens) > SCHEMA_TOKEN_CACHE_SIZE:
+                self._schema_tokens.popitem(last=False)
+        return tokens
+
+    def record_generation(self, unselected: List[str], unknown: List[str]) -> None:
+        """
+        记录一次代码生成是否漏检
+
+        模型只能看到检索出的函数，实际执行的函数总在检索结果中，据此算出的召回率恒为 1，发现不了漏检。
+        漏检时模型拿不到需要的函数，只能猜测或编造：生成的代码调用了没有被选中的已注册函数，
+        或者根本不存在的函数（按标注数据评估的召回率见 evaluate_tool_retrieval.py）
+
+        Args:
+            unselected: 代码调用了、但没有放进提示词的已注册函数
+            unknown: 代码调用了、但不存在的函数
+        """
+        with self._lock:
+            self.stats['generations'] += 1
+            self.stats['missed_generations'] += bool(unselected or unknown)
+            self.stats['unknown_calls'] += len(unknown)
+            missed_tools = self.stats['missed_tools']
+            for name in unselected:
+                missed_tools[name] = missed_tools.get(name, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回检索统计：平均选中函数数、提示词中函数定义的 token 缩减比例、生成代码的漏检率"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['missed_tools'] = dict(stats['missed_tools'])
+        queries = stats['queries']
+        stats['avg_selected_tools'] = stats['selected_tools'] / queries if queries else 0.0
+        stats['schema_token_reduction'] = (
+            1 - stats['schema_tokens'] / stats['full_schema_tokens'] if stats['full_schema_tokens'] else 0.0
+        )
+        stats['miss_rate'] = stats['missed_generations'] / stats['generations'] if stats['generations'] else 0.0
+        return stats
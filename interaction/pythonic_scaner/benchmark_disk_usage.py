@@ -0,0 +1,53 @@
+"""
+对比 df -h 子进程（get_disk_usage_df）和直接读取挂载表 + statvfs（get_disk_usage）的耗时
+
+两种方式各调用 --repeat 次，输出每次调用的平均耗时，并逐个挂载点对比结果：df -h 的容量只有两三位有效数字，
+这里同时列出精确的字节数，检查两者的差异在 df -h 的舍入范围内。
+
+用法：
+    python benchmark_disk_usage.py [--repeat 200]
+"""
+import argparse
+import time
+
+from disk_usage import disk_usage_collector
+from handlers import get_disk_usage, get_disk_usage_df
+
+
+def timed(func, repeat: int) -> float:
+    """func 每次调用的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="df -h 与 statvfs 获取磁盘使用情况的耗时对比")
+    parser.add_argument('--repeat', type=int, default=200, help="每种方式的调用次数")
+    args = parser.parse_args()
+
+    df_disks = {disk['mount_point']: disk for disk in get_disk_usage_df()}
+    disks = get_disk_usage()
+    print(f"{'挂载点':<30s} {'df -h 总/已用(GB)':>20s} {'statvfs 总/已用(GB)':>22s} {'已用字节数':>16s}")
+    for disk in disks:
+        df_disk = df_disks.pop(disk['mount_point'], None)
+        df_text = f"{df_disk['total_gb']}/{df_disk['used_gb']}" if df_disk else '-'
+        statvfs_text = f"{disk['total_gb']}/{disk['used_gb']}"
+        print(f"{disk['mount_point']:<30s} {df_text:>20s} {statvfs_text:>22s} {disk['used_bytes']:>16d}")
+        if df_disk:
+            # df -h 最多保留一位小数（大于 10 时为整数），差异应在舍入范围内
+            for key in ('total_gb', 'used_gb'):
+                tolerance = max(0.1, disk[key] * 0.05) + 0.01
+                assert abs(df_disk[key] - disk[key]) <= tolerance, (disk['mount_point'], key, df_disk, disk)
+    for mount_point in df_disks:
+        print(f"{mount_point:<30s} 只在 df -h 的结果中")
+
+    df_time = timed(get_disk_usage_df, args.repeat)
+    statvfs_time = timed(get_disk_usage, args.repeat)
+    print(f"\ndf -h: {df_time:.3f}ms/次  statvfs: {statvfs_time:.3f}ms/次  加速 {df_time / statvfs_time:.1f}x")
+    print(f"statvfs 统计: {disk_usage_collector.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
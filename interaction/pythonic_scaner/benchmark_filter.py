@@ -0,0 +1,103 @@
+"""
+嵌套路径过滤和 top-k 选择的扩展性测试
+
+对比原先两两比较的 filter_nested_paths（O(n²)）+ 全量排序，与前缀树实现 + 堆选择在不同条目数下的耗时，
+并检查两者保留的路径相同。
+
+用法：
+    python benchmark_filter.py [--sizes 1000,5000,20000,100000,500000] [--limit 30] [--quadratic-max 20000]
+"""
+import argparse
+import heapq
+import random
+import time
+from typing import Dict, List
+
+from handlers import filter_nested_paths
+
+
+def filter_nested_paths_quadratic(results: List[Dict]) -> List[Dict]:
+    """原先的实现：每个路径与所有已保留的路径逐一比较"""
+    filtered_results = []
+    size_threshold_ratio = 0.99
+    sorted_results = sorted(results, key=lambda x: len(x['path'].split('/')))
+
+    def is_subpath_with_similar_size(path: str, size_kb: int, processed_paths: List[Dict]) -> bool:
+        for item in processed_paths:
+            parent_path = item['path']
+            if path.startswith(parent_path + '/'):
+                if size_kb / item['size_kb'] >= size_threshold_ratio:
+                    return True
+        return False
+
+    for item in sorted_results:
+        if not is_subpath_with_similar_size(item['path'], item['size_kb'], filtered_results):
+            filtered_results.append(item)
+    return filtered_results
+
+
+def generate_entries(count: int, seed: int = 0) -> List[Dict]:
+    """
+    生成 count 个类似扫描结果的条目：随机的目录树，目录大小为其下所有条目之和，
+    约三成目录只有一个大的子条目（大小与父目录接近，应被过滤）
+    """
+    rng = random.Random(seed)
+    entries = []
+    frontier = [('', 0)]
+    while len(entries) < count:
+        parent, depth = frontier.pop(rng.randrange(len(frontier))) if frontier else ('', 0)
+        for i in range(rng.randint(1, 8)):
+            path = f"{parent}/n{len(entries)}" if parent else f"n{len(entries)}"
+            entries.append({'path': path, 'size_kb': 0, 'depth': depth + 1})
+            if depth < 12:
+                frontier.append((path, depth + 1))
+            if len(entries) >= count:
+                break
+
+    # 自底向上计算大小：叶子随机大小，目录为子条目之和（偶尔只有一个子条目时与父目录大小接近）
+    by_path = {entry['path']: entry for entry in entries}
+    for entry in sorted(entries, key=lambda x: -x['depth']):
+        if entry['size_kb'] == 0:
+            entry['size_kb'] = rng.randint(1024, 100 * 1024 * 1024)
+        parent = entry['path'].rpartition('/')[0]
+        if parent:
+            by_path[parent]['size_kb'] += entry['size_kb']
+    for entry in entries:
+        del entry['depth']
+    rng.shuffle(entries)
+    return entries
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌套路径过滤的扩展性测试")
+    parser.add_argument('--sizes', default='1000,5000,20000,100000,500000', help="条目数，逗号分隔")
+    parser.add_argument('--limit', type=int, default=30, help="返回的条目数")
+    parser.add_argument('--quadratic-max', type=int, default=20000, help="原实现只在不超过该条目数时运行")
+    args = parser.parse_args()
+
+    print(f"{'条目数':>8s} {'保留':>8s} {'原实现(秒)':>12s} {'前缀树(秒)':>12s} {'排序(秒)':>10s} {'堆(秒)':>10s}")
+    for count in (int(size) for size in args.sizes.split(',')):
+        entries = generate_entries(count)
+
+        filtered, trie_time = timed(filter_nested_paths, entries)
+        quadratic_time = None
+        if count <= args.quadratic_max:
+            expected, quadratic_time = timed(filter_nested_paths_quadratic, entries)
+            assert sorted(item['path'] for item in expected) == sorted(item['path'] for item in filtered), "结果不一致"
+
+        by_sort, sort_time = timed(lambda: sorted(filtered, key=lambda x: x['size_kb'], reverse=True)[:args.limit])
+        by_heap, heap_time = timed(lambda: heapq.nlargest(args.limit, filtered, key=lambda x: x['size_kb']))
+        assert [item['size_kb'] for item in by_sort] == [item['size_kb'] for item in by_heap]
+
+        quadratic = f"{quadratic_time:12.4f}" if quadratic_time is not None else f"{'跳过':>12s}"
+        print(f"{count:8d} {len(filtered):8d} {quadratic} {trie_time:12.4f} {sort_time:10.4f} {heap_time:10.4f}")
+
+
+if __name__ == "__main__":
+    main()
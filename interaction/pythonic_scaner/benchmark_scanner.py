@@ -0,0 +1,128 @@
+"""
+对比 du 子进程（scan_large_files_du）和进程内并行扫描（scan_large_files_fast 的 scandir 方式）的耗时
+
+scan_large_files_fast 默认使用 du（见 handlers.SCANNER_BACKEND），在目标存储上 scandir 更快时再切换
+
+在临时目录下生成一棵目录树（默认一百万个小文件，另有少量大文件），分别用两种方式扫描，检查结果一致并输出耗时。
+
+用法：
+    python benchmark_scanner.py [--files 1000000] [--fanout 20] [--depth 3] [--root 已有目录] [--repeat 3] [--warm]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+
+from disk_scanner import DirectoryScanner
+from handlers import scan_large_files_du, scan_large_files_fast
+
+# 生成的大文件数和大小（MB），用于检查两种方式返回的大文件一致
+LARGE_FILES = 20
+LARGE_FILE_MB = 8
+
+
+def generate_tree(root: str, files: int, fanout: int, depth: int) -> int:
+    """
+    生成 depth 层、每层 fanout 个子目录的目录树，小文件均匀分布在最底层目录中
+
+    Returns:
+        生成的文件数
+    """
+    leaves = [root]
+    for _ in range(depth):
+        leaves = [os.path.join(parent, f"d{i}") for parent in leaves for i in range(fanout)]
+    for leaf in leaves:
+        os.makedirs(leaf, exist_ok=True)
+
+    per_leaf = max(1, files // len(leaves))
+    count = 0
+    for leaf in leaves:
+        for i in range(per_leaf):
+            with open(os.path.join(leaf, f"f{i}.dat"), 'wb') as f:
+                f.write(b'x')
+            count += 1
+            if count >= files:
+                break
+        if count >= files:
+            break
+
+    chunk = os.urandom(1024 * 1024)
+    for i in range(LARGE_FILES):
+        with open(os.path.join(leaves[i * len(leaves) // LARGE_FILES], f"large{i}.bin"), 'wb') as f:
+            for _ in range(LARGE_FILE_MB):
+                f.write(chunk)
+    # 硬链接和符号链接，检查两种方式的处理一致
+    os.link(os.path.join(leaves[0], "large0.bin"), os.path.join(root, "large0.link"))
+    os.symlink(leaves[0], os.path.join(root, "symlink"))
+    return count + LARGE_FILES
+
+
+def drop_caches() -> None:
+    """尽量清空页缓存（需要 root 权限），否则两种方式都在热缓存上比较"""
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3\n')
+    except OSError:
+        pass
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="du 与并行 scandir 扫描的耗时对比")
+    parser.add_argument('--files', type=int, default=1_000_000, help="生成的小文件数")
+    parser.add_argument('--fanout', type=int, default=20, help="每层的子目录数")
+    parser.add_argument('--depth', type=int, default=3, help="目录层数")
+    parser.add_argument('--root', help="扫描已有的目录（不生成目录树）")
+    parser.add_argument('--repeat', type=int, default=3, help="每种方式扫描的次数")
+    parser.add_argument('--max-depth', type=int, default=3)
+    parser.add_argument('--warm', action='store_true', help="不清空页缓存，比较热缓存下的耗时")
+    args = parser.parse_args()
+
+    temp_dir = None
+    root = args.root
+    if root is None:
+        temp_dir = tempfile.mkdtemp(prefix='scanner_bench_')
+        root = temp_dir
+        start = time.perf_counter()
+        count = generate_tree(root, args.files, args.fanout, args.depth)
+        print(f"生成 {count} 个文件，耗时 {time.perf_counter() - start:.1f}秒: {root}")
+
+    try:
+        # 门槛设为 1MB（total_size_gb 的 1%），两种方式都会返回大文件和包含它们的目录
+        total_size_gb = 100 / 1024
+        timings = {'du': [], 'scandir': []}
+        outputs = {}
+        backends = (('du', scan_large_files_du), ('scandir', partial(scan_large_files_fast, backend='scandir')))
+        for _ in range(args.repeat):
+            for name, func in backends:
+                if not args.warm:
+                    drop_caches()
+                outputs[name], elapsed = timed(func, root, total_size_gb, args.max_depth, 1000)
+                timings[name].append(elapsed)
+
+        for name, values in timings.items():
+            print(f"{name:8s} 最快 {min(values):.3f}秒  平均 {sum(values) / len(values):.3f}秒  结果 {len(outputs[name])} 条")
+        print(f"加速比: {min(timings['du']) / min(timings['scandir']):.2f}x")
+
+        expected = sorted((item['path'], item['size']) for item in outputs['du'])
+        actual = sorted((item['path'], item['size']) for item in outputs['scandir'])
+        print("结果一致" if expected == actual else f"结果不一致:\n du: {expected[:10]}\n scandir: {actual[:10]}")
+
+        scanner = DirectoryScanner()
+        scanner.scan(root, args.max_depth)
+        print(f"扫描统计: {scanner.stats}")
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
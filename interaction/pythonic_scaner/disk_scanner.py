@@ -0,0 +1,347 @@
+"""
+进程内的并行目录扫描
+
+scan_large_files_du 调用 du -ak 子进程，逐行解析文本输出，再对每个输出的路径重新 os.stat 取 mtime、
+getpwuid 取所有者，每个文件都被 stat 两次。DirectoryScanner 直接用 os.scandir 遍历目录树
+（scan_large_files_fast 的 scandir 扫描方式，见 handlers.SCANNER_BACKEND）：
+- 每个目录是线程池中的一个任务，scandir/stat 释放 GIL，多个目录（尤其是网络存储上）并行读取
+- 大小自底向上汇总：目录扫描完自身的条目后记下还没完成的子目录数，最后一个完成的子目录把合计加到父目录上，
+  一直向上传递到根目录，整个过程只遍历一遍、不需要等待子任务
+- 所有者和修改时间取自同一次 stat 的结果，不再重复 stat
+
+大小与 du -k 一致：按实际占用的块数（st_blocks）计算，硬链接的文件只计一次，不跟随符号链接。
+
+传入 SizeIndex 时扫描结果写入索引；reuse 为 True 时增量扫描：没有变化的目录复用索引中的结果，不再读取其中的文件
+（见 size_index.py）。目录的 mtime 发现不了文件原地变大，复用前会重新 lstat 索引中记录的大文件，有变化时重新扫描该目录。
+
+iter_scan 在后台线程中扫描，符合条件的条目一出现就返回，不在内存中保存全部结果，可以随时取消。条目按自底向上的
+顺序到达：文件在扫描到时返回，目录在其下所有内容都已返回、大小汇总完成后返回。
+"""
+import functools
+import os
+import pwd
+import queue
+import sqlite3
+from stat import S_ISDIR
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from size_index import DirRecord, DirUpdate, FileRecord, SizeIndex, HISTORY_DEPTH
+
+# 扫描的线程数，目录读取主要在等待 IO，线程数可以多于 CPU 核数
+SCAN_WORKERS = int(os.getenv('SCANNER_WORKERS', str(min(32, (os.cpu_count() or 1) * 4))))
+
+
+class ScanEntry(NamedTuple):
+    """扫描到的文件或目录"""
+    path: str  # 绝对路径
+    size_kb: int  # 占用空间（KB），目录为其下所有内容的合计
+    is_dir: bool
+    uid: int
+    mtime: float
+    depth: int  # 相对扫描根目录的深度，根目录为 0
+
+
+@functools.lru_cache(maxsize=1024)
+def owner_name(uid: int) -> str:
+    """uid 对应的用户名，没有对应用户时返回 uid"""
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def size_kb(size_bytes: int) -> int:
+    """字节数换算为 KB（向上取整，与 du -k 一致）"""
+    return -(-size_bytes // 1024)
+
+
+class _DirNode:
+    """扫描中的目录"""
+    __slots__ = ('path', 'depth', 'parent', 'stat', 'size', 'pending', 'files_size', 'file_count', 'record',
+                 'scanned_at', 'large_files', 'removed', 'submitted')
+
+    def __init__(self, path: str, depth: int, parent: Optional['_DirNode'], stat_result: os.stat_result):
+        self.path = path
+        self.depth = depth
+        self.parent = parent
+        self.stat = stat_result
+        self.size = stat_result.st_blocks * 512  # 字节，扫描完成后为目录下所有内容的合计
+        self.pending = 0  # 还没完成的子目录数
+        self.submitted = False  # 子目录已提交（或没有子目录、已调用 finish），之后由子目录负责完成该目录
+        # 以下用于更新索引
+        self.files_size = 0  # 目录中直接包含的文件的合计
+        self.file_count = 0
+        self.record: Optional[DirRecord] = None  # 扫描前索引中的记录
+        self.scanned_at = 0.0  # 完整扫描的时间
+        self.large_files: Optional[List[FileRecord]] = None  # 重新扫描时记录的大文件
+        self.removed: List[str] = []  # 重新扫描时发现已经不存在的子目录
+
+
+class DirectoryScanner:
+    """
+    并行扫描目录树，返回不超过指定深度、大小不低于门槛的文件和目录
+
+    Example:
+        scanner = DirectoryScanner()
+        entries = scanner.scan('/data', max_depth=3, threshold_kb=10 * 1024 * 1024)
+        print(scanner.stats)
+    """
+
+    def __init__(self, max_workers: int = SCAN_WORKERS):
+        """
+        Args:
+            max_workers: 扫描的线程数
+        """
+        self.max_workers = max(1, max_workers)
+        self.stats: Dict[str, float] = {}
+
+    def scan(self, root: str, max_depth: int = 3, threshold_kb: int = 0, index: Optional[SizeIndex] = None,
+             on_entry: Optional[Callable[[ScanEntry], None]] = None,
+             cancel: Optional[threading.Event] = None, reuse: bool = True) -> List[ScanEntry]:
+        """
+        扫描 root 下的目录树
+
+        Args:
+            root: 扫描的根目录
+            max_depth: 只返回深度不超过 max_depth 的条目（目录的大小仍然包含更深层的内容）
+            threshold_kb: 只返回大小不低于该值（KB）的条目
+            index: 可选，目录大小索引，扫描后更新索引（包括大小历史）
+            on_entry: 可选，符合条件的条目交给它处理而不是放在返回的列表中（在扫描线程中调用，可能并发）
+            cancel: 可选，设置后停止扫描：还没读取的目录不再读取，不再返回条目，也不更新索引
+            reuse: 指定 index 时，没有变化的目录是否复用索引中的结果；为 False 时完整扫描，只写入索引
+
+        Returns:
+            符合条件的条目（包括根目录本身），顺序不确定；指定 on_entry 时为空列表
+
+        Raises:
+            OSError: 根目录不存在或无法访问
+        """
+        start_time = time.time()
+        root = os.path.abspath(root)
+        threshold_bytes = threshold_kb * 1024
+        lock = threading.Lock()
+        done = threading.Event()
+        seen_inodes = set()  # 已经计算过的硬链接文件 (st_dev, st_ino)
+        entries: List[ScanEntry] = []
+        emit = entries.append if on_entry is None else on_entry
+        cancelled = cancel.is_set if cancel is not None else lambda: False
+        counts = {'dirs': 0, 'files': 0, 'errors': 0, 'reused_dirs': 0, 'stale_dirs': 0}
+        updates: List[DirUpdate] = []
+        history: List[Tuple[str, int]] = []
+
+        def record_index(node: _DirNode) -> None:
+            # 新扫描的目录和合计有变化的目录写回索引
+            if node.large_files is not None or node.record is None or node.record.total_size != node.size:
+                parent = os.path.dirname(node.path) if node.path != '/' else None
+                updates.append(DirUpdate(node.path, parent, node.stat.st_mtime_ns, node.stat.st_ctime_ns,
+                                         node.files_size, node.file_count, node.size, node.scanned_at,
+                                         node.large_files, node.removed))
+            if node.depth <= HISTORY_DEPTH:
+                history.append((node.path, node.size))
+
+        def finish(node: _DirNode) -> None:
+            # 目录及其所有子目录都已完成：记录目录，把合计加到父目录，父目录的子目录全部完成时继续向上
+            while True:
+                if node.depth <= max_depth and node.size >= threshold_bytes and not cancelled():
+                    emit(ScanEntry(node.path, size_kb(node.size), True, node.stat.st_uid,
+                                             node.stat.st_mtime, node.depth))
+                if index is not None:
+                    record_index(node)
+                parent = node.parent
+                if parent is None:
+                    done.set()
+                    return
+                with lock:
+                    parent.size += node.size
+                    parent.pending -= 1
+                    if parent.pending:
+                        return
+                node = parent
+
+        def large_files_unchanged(node: _DirNode, large_files: List[FileRecord]) -> bool:
+            # 目录的 mtime 只在条目增删改名时变化，发现不了文件原地写入变大：重新 lstat 索引中记录的大文件
+            for item in large_files:
+                try:
+                    stat_result = os.lstat(os.path.join(node.path, item.name))
+                except OSError:
+                    return False
+                if stat_result.st_blocks * 512 != item.size or stat_result.st_mtime != item.mtime:
+                    return False
+            return True
+
+        def reuse_dir(node: _DirNode, large_files: List[FileRecord]) -> Tuple[List[_DirNode], int]:
+            # 目录没有变化：文件合计和大文件取自索引，只检查索引中记录的子目录
+            subdirs = []
+            errors = 0
+            for child in index.children(node.path):
+                try:
+                    stat_result = os.lstat(child)
+                except OSError:
+                    errors += 1
+                    continue
+                if S_ISDIR(stat_result.st_mode):
+                    subdirs.append(_DirNode(child, node.depth + 1, node, stat_result))
+            node.files_size = node.record.files_size
+            node.file_count = node.record.file_count
+            node.scanned_at = node.record.scanned_at
+            if node.depth < max_depth:
+                for item in large_files:
+                    if item.size >= threshold_bytes:
+                        emit(ScanEntry(os.path.join(node.path, item.name), size_kb(item.size), False,
+                                                 item.uid, item.mtime, node.depth + 1))
+            return subdirs, errors
+
+        def scan_dir(node: _DirNode) -> None:
+            if cancelled():
+                finish(node)
+                return
+            if index is not None:
+                node.record = index.lookup(node.path)
+            if reuse and index is not None and index.is_fresh(node.record, node.stat, threshold_kb):
+                large_files = index.large_files(node.path)
+                if large_files_unchanged(node, large_files):
+                    subdirs, errors = reuse_dir(node, large_files)
+                    with lock:
+                        counts['dirs'] += 1
+                        counts['reused_dirs'] += 1
+                        counts['files'] += node.file_count
+                        counts['errors'] += errors
+                        node.size += node.files_size
+                        node.pending = len(subdirs)
+                    submit_children(node, subdirs)
+                    return
+                # 有大文件原地变化：目录中的文件合计也不再可信，重新扫描该目录
+                with lock:
+                    counts['stale_dirs'] += 1
+
+            subdirs = []
+            files = errors = 0
+            size = 0
+            report_files = node.depth < max_depth
+            large_files = [] if index is not None else None
+            index_min_bytes = index.file_min_kb * 1024 if index is not None else 0
+            node.scanned_at = time.time()
+            try:
+                with os.scandir(node.path) as iterator:
+                    for entry in iterator:
+                        if cancelled():
+                            break
+                        try:
+                            stat_result = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            errors += 1
+                            continue
+                        if S_ISDIR(stat_result.st_mode):
+                            subdirs.append(_DirNode(entry.path, node.depth + 1, node, stat_result))
+                            continue
+                        files += 1
+                        file_size = stat_result.st_blocks * 512
+                        if stat_result.st_nlink > 1:
+                            key = (stat_result.st_dev, stat_result.st_ino)
+                            with lock:
+                                duplicate = key in seen_inodes
+                                seen_inodes.add(key)
+                            if duplicate:
+                                continue
+                        size += file_size
+                        if report_files and file_size >= threshold_bytes:
+                            emit(ScanEntry(entry.path, size_kb(file_size), False, stat_result.st_uid,
+                                                     stat_result.st_mtime, node.depth + 1))
+                        if large_files is not None and file_size >= index_min_bytes:
+                            large_files.append(FileRecord(entry.name, file_size, stat_result.st_uid,
+                                                          stat_result.st_mtime))
+            except OSError:
+                # 没有权限等情况与 du 相同：跳过该目录的内容，继续扫描其他目录
+                errors += 1
+            finally:
+                with lock:
+                    counts['dirs'] += 1
+                    counts['files'] += files
+                    counts['errors'] += errors
+                    node.size += size
+                    node.pending = len(subdirs)
+            if index is not None:
+                node.files_size = size
+                node.file_count = files
+                node.large_files = large_files
+                if node.record is not None:
+                    current = {subdir.path for subdir in subdirs}
+                    node.removed = [path for path in index.children(node.path) if path not in current]
+            submit_children(node, subdirs)
+
+        def submit_children(node: _DirNode, subdirs: List[_DirNode]) -> None:
+            node.submitted = True
+            if not subdirs:
+                finish(node)
+                return
+            for subdir in subdirs:
+                executor.submit(run, subdir)
+
+        def run(node: _DirNode) -> None:
+            try:
+                scan_dir(node)
+            except Exception as e:
+                # 任务中的意外错误不能让根目录永远等不到完成
+                print(f"扫描目录 {node.path} 时出错: {e}")
+                # 子目录已经提交时由最后完成的子目录调用 finish，这里再调用会把大小重复加到父目录、重复返回条目
+                if not node.submitted:
+                    finish(node)
+
+        root_node = _DirNode(root, 0, None, os.lstat(root))
+        if not S_ISDIR(root_node.stat.st_mode):
+            raise NotADirectoryError(root)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='disk-scanner') as executor:
+            executor.submit(run, root_node)
+            done.wait()
+
+        # 取消时目录的合计不完整，不能写入索引
+        if index is not None and not cancelled():
+            try:
+                index.apply(updates, history, start_time)
+            except sqlite3.Error as e:
+                # 索引写入失败不影响本次扫描的结果，下次扫描重新读取这些目录
+                print(f"更新目录大小索引失败: {e}")
+        self.stats = {**counts, 'cancelled': cancelled(), 'elapsed': time.time() - start_time}
+        return entries
+
+    def iter_scan(self, root: str, max_depth: int = 3, threshold_kb: int = 0,
+                  index: Optional[SizeIndex] = None, reuse: bool = True) -> Iterator[ScanEntry]:
+        """
+        在后台线程中扫描 root，逐个返回符合条件的条目（参数与 scan 相同）
+
+        条目按自底向上的顺序返回：一个目录返回时，它下面符合条件的条目都已经返回过。生成器被关闭（调用 close，
+        或 break 后被回收）时取消扫描，等正在读取的目录结束后返回。
+
+        Raises:
+            OSError: 根目录不存在或无法访问
+        """
+        # 符合条件的条目受大小门槛限制，数量不多，队列不设上限，取消时扫描线程不会阻塞在 put 上
+        entries: queue.Queue = queue.Queue()
+        cancel = threading.Event()
+        finished = object()
+        errors: List[BaseException] = []
+
+        def run() -> None:
+            try:
+                self.scan(root, max_depth, threshold_kb, index, on_entry=entries.put, cancel=cancel, reuse=reuse)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                entries.put(finished)
+
+        thread = threading.Thread(target=run, name='disk-scanner-stream', daemon=True)
+        thread.start()
+        try:
+            while True:
+                entry = entries.get()
+                if entry is finished:
+                    break
+                yield entry
+        finally:
+            cancel.set()
+            thread.join()
+        if errors:
+            raise errors[0]
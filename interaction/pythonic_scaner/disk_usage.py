@@ -0,0 +1,231 @@
+"""
+直接读取挂载表和 statvfs 的磁盘使用情况
+
+get_disk_usage 原先调用 df -h 子进程，按空格拆分人类可读的输出再用正则换算成 GB：精度只有 df -h 的两三位有效数字
+（如 "1.5T"），挂载点包含空格时列会错位，每次调用还要创建一个进程。collect_disk_usage 直接：
+- 读一次 /proc/self/mountinfo 得到挂载点、设备和文件系统类型，挂载点中的空格等字符按内核的八进制转义（\\040）还原
+- 对每个挂载点并行调用 os.statvfs，用与 df 相同的公式计算字节数
+- 每个挂载点有超时，无响应的网络存储（NFS 等）不会阻塞整个调用；statvfs 无法中断，卡住的线程是守护线程，
+  同一挂载点上一次的调用还没返回时直接视为超时，不再重复创建线程
+"""
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 每个挂载点 statvfs 的超时时间（秒）
+DISK_USAGE_TIMEOUT = float(os.getenv('DISK_USAGE_TIMEOUT', '2'))
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+# 要排除的设备（子串匹配）
+EXCLUDE_PATTERNS = [
+    '/dev/loop',  # snap包使用的loop设备
+    'tmpfs',  # 临时文件系统
+    'udev',  # 设备文件系统
+    'devtmpfs',  # 设备临时文件系统
+    '/snap/',  # snap相关挂载点
+]
+# 要排除的挂载点（前缀匹配）
+EXCLUDE_MOUNTS = (
+    '/boot',  # 启动分区
+    '/boot/efi',  # EFI系统分区
+    '/efi'  # 某些系统上的EFI分区挂载点
+)
+
+ESCAPE_PATTERN = re.compile(r'\\([0-7]{3})')
+
+
+class MountInfo(NamedTuple):
+    """挂载表中的一项"""
+    mount_point: str
+    device: str  # 设备，如 /dev/sda1
+    fstype: str
+    device_id: str  # "主设备号:次设备号"
+    root: str  # 挂载的是设备上的哪个目录，bind mount 时不是 "/"
+
+
+class DiskUsage(NamedTuple):
+    """一个挂载点的使用情况（字节），计算方式与 df 相同"""
+    total: int
+    used: int
+    available: int  # 普通用户可用的空间（不含保留块）
+
+    @property
+    def percent(self) -> int:
+        """使用百分比，与 df 的 Use% 一样按 used / (used + available) 向上取整"""
+        capacity = self.used + self.available
+        return -(-self.used * 100 // capacity) if capacity else 0
+
+
+def unescape_mount_field(field: str) -> str:
+    """还原挂载表字段中内核转义的字符（空格为 \\040，制表符为 \\011，换行为 \\012，反斜杠为 \\134）"""
+    return ESCAPE_PATTERN.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def read_mounts(path: str = MOUNTINFO_PATH) -> List[MountInfo]:
+    """
+    读取挂载表，同一挂载点被多次挂载时只保留最上层的一项
+
+    Raises:
+        OSError: 挂载表无法读取（非 Linux 系统）
+    """
+    mounts: Dict[str, MountInfo] = {}
+    with open(path, encoding='utf-8', errors='surrogateescape') as f:
+        for line in f:
+            # 格式：ID 父ID 主:次 根目录 挂载点 挂载选项 [可选字段...] - 文件系统类型 设备 超级块选项
+            fields, separator, rest = line.partition(' - ')
+            if not separator:
+                continue
+            fields = fields.split(' ')
+            rest = rest.split(' ')
+            if len(fields) < 6 or len(rest) < 2:
+                continue
+            mount_point = unescape_mount_field(fields[4])
+            mounts.pop(mount_point, None)
+            mounts[mount_point] = MountInfo(mount_point, unescape_mount_field(rest[1]), rest[0], fields[2],
+                                            unescape_mount_field(fields[3]))
+    return list(mounts.values())
+
+
+def select_physical_mounts(mounts: List[MountInfo]) -> List[MountInfo]:
+    """
+    只保留物理磁盘（/dev/ 下的设备），排除系统相关分区和虚拟设备；同一设备挂载在多处时与 df 一样只保留一处
+    （优先挂载整个设备的，其次挂载点路径最短的）
+    """
+    selected: Dict[str, MountInfo] = {}
+    for mount in mounts:
+        if not mount.device.startswith('/dev/'):
+            continue
+        if any(pattern in mount.device for pattern in EXCLUDE_PATTERNS):
+            continue
+        if mount.mount_point.startswith(EXCLUDE_MOUNTS):
+            continue
+        current = selected.get(mount.device_id)
+        if current is None or (mount.root != '/', len(mount.mount_point)) < (current.root != '/',
+                                                                            len(current.mount_point)):
+            selected[mount.device_id] = mount
+    return list(selected.values())
+
+
+def statvfs_usage(mount_point: str) -> DiskUsage:
+    """
+    挂载点的使用情况
+
+    Raises:
+        OSError: 挂载点无法访问
+    """
+    st = os.statvfs(mount_point)
+    return DiskUsage(st.f_blocks * st.f_frsize, (st.f_blocks - st.f_bfree) * st.f_frsize, st.f_bavail * st.f_frsize)
+
+
+class DiskUsageCollector:
+    """
+    并行获取各挂载点的使用情况，每个挂载点有超时
+
+    Example:
+        collector = DiskUsageCollector()
+        for mount, usage in collector.collect(select_physical_mounts(read_mounts())):
+            print(mount.mount_point, usage.total, usage.used)
+        print(collector.get_stats())
+    """
+
+    def __init__(self, timeout: float = DISK_USAGE_TIMEOUT):
+        """
+        Args:
+            timeout: 每个挂载点的超时时间（秒）
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._hung: Dict[str, threading.Thread] = {}  # 超时后还没返回的 statvfs
+        self.stats = {
+            'calls': 0,
+            'mounts': 0,
+            'timeouts': 0,
+            'errors': 0
+        }
+
+    def collect(self, mounts: List[MountInfo]) -> List[Tuple[MountInfo, DiskUsage]]:
+        """
+        Args:
+            mounts: 要获取的挂载点
+
+        Returns:
+            [(MountInfo, DiskUsage), ...]，顺序与 mounts 相同，超时或出错的挂载点不包含在内
+        """
+        results: List[Optional[DiskUsage]] = [None] * len(mounts)
+        threads = []
+        timeouts = 0
+
+        def run(position: int, mount_point: str) -> None:
+            try:
+                results[position] = statvfs_usage(mount_point)
+            except OSError as e:
+                print(f"获取 {mount_point} 的使用情况出错: {e}")
+
+        for position, mount in enumerate(mounts):
+            with self._lock:
+                hung = self._hung.get(mount.mount_point)
+                if hung is not None and hung.is_alive():
+                    # 上一次的调用还卡着，不再创建新线程
+                    timeouts += 1
+                    print(f"获取 {mount.mount_point} 的使用情况超时（上一次调用尚未返回）")
+                    continue
+                self._hung.pop(mount.mount_point, None)
+            thread = threading.Thread(target=run, args=(position, mount.mount_point),
+                                      name='disk-usage', daemon=True)
+            thread.start()
+            threads.append((position, mount.mount_point, thread))
+
+        # 所有挂载点共用一个截止时间，整个调用最多等待 timeout 秒
+        deadline = time.monotonic() + self.timeout
+        timed_out = set()
+        for position, mount_point, thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                timeouts += 1
+                timed_out.add(position)
+                print(f"获取 {mount_point} 的使用情况超时（{self.timeout}秒）")
+                with self._lock:
+                    self._hung[mount_point] = thread
+
+        # 超时的线程之后才返回的结果不再使用
+        collected = [(mount, usage) for position, (mount, usage) in enumerate(zip(mounts, results))
+                     if usage is not None and position not in timed_out]
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['mounts'] += len(mounts)
+            self.stats['timeouts'] += timeouts
+            self.stats['errors'] += len(mounts) - timeouts - len(collected)
+        return collected
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.stats, 'hung': sum(1 for thread in self._hung.values() if thread.is_alive())}
+
+
+# 各次调用共用，记录还没返回的 statvfs
+disk_usage_collector = DiskUsageCollector()
+
+
+def collect_disk_usage() -> List[Dict]:
+    """
+    物理磁盘的使用情况（格式见 handlers.get_disk_usage）
+
+    Raises:
+        OSError: 挂载表无法读取
+    """
+    disks = []
+    for mount, usage in disk_usage_collector.collect(select_physical_mounts(read_mounts())):
+        disks.append({
+            'mount_point': mount.mount_point,
+            'total_gb': round(usage.total / 1024 ** 3, 2),
+            'used_gb': round(usage.used / 1024 ** 3, 2),
+            'usage_percent': f"{usage.percent}%",
+            'filesystem': mount.device,
+            'fstype': mount.fstype,
+            'total_bytes': usage.total,
+            'used_bytes': usage.used,
+            'available_bytes': usage.available
+        })
+    return disks
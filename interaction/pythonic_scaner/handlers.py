@@ -1,17 +1,66 @@
 import subprocess
+import sqlite3
+import heapq
 import re
 import os
 import pwd
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 import psutil
 #import pynvml
 import pytz
+from stat import S_ISDIR
 
+from disk_scanner import DirectoryScanner, owner_name
+from disk_usage import collect_disk_usage
+from size_index import SizeIndex, HISTORY_DEPTH
 
-def get_disk_usage():
+# scan_large_files_fast 默认的扫描方式：du 子进程，或者 scandir（进程内并行扫描，见 disk_scanner.py）。
+# 在测试的本地存储上 scandir 比 du 慢，在目标存储上测出收益之前默认仍使用 du
+SCANNER_BACKEND = os.getenv('SCANNER_BACKEND', 'du')
+# 是否在每次扫描后记录目录大小历史（get_storage_growth 使用），需要可写的索引文件，默认不记录
+SCANNER_RECORD_HISTORY = os.getenv('SCANNER_RECORD_HISTORY', '0') == '1'
+
+# 目录大小索引，第一次使用时打开
+_size_index: Optional[SizeIndex] = None
+
+
+def get_size_index() -> SizeIndex:
+    """目录大小索引（见 size_index.py），索引文件位置由 SCANNER_INDEX_PATH 指定"""
+    global _size_index
+    if _size_index is None:
+        _size_index = SizeIndex()
+    return _size_index
+
+
+def open_size_index() -> Optional[SizeIndex]:
+    """打开目录大小索引，无法打开时（只读目录、SCANNER_INDEX_PATH 错误等）返回 None，扫描不使用索引"""
+    try:
+        return get_size_index()
+    except (OSError, sqlite3.Error) as e:
+        print(f"无法打开目录大小索引，不使用索引: {e}")
+        return None
+
+
+def get_disk_usage() -> List[Dict]:
     """
     获取物理磁盘使用情况，排除系统相关分区和虚拟设备
+    
+    直接读取 /proc/self/mountinfo，并行对各挂载点调用 statvfs（见 disk_usage.py），不再解析 df -h 的输出
+    """
+    try:
+        return collect_disk_usage()
+    except OSError as e:
+        print(f"Error reading mount table: {e}")
+        return []
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return []
+
+
+def get_disk_usage_df() -> List[Dict]:
+    """
+    使用 df -h 获取物理磁盘使用情况（get_disk_usage 原先的实现，保留用于对比）
     """
     try:
         df_output = subprocess.check_output(['df', '-h'], universal_newlines=True)
@@ -82,23 +131,252 @@ def get_disk_usage():
         return []
 
 
+def format_size(size_kb: float) -> str:
+    """将KB转换为人类可读的格式"""
+    size_bytes = size_kb * 1024
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.2f}{unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.2f}TB"
+
+
+class PathTrie:
+    """按路径分量组织的前缀树，节点上记录已保留路径的大小"""
+    __slots__ = ('children', 'size_kb')
+
+    def __init__(self):
+        self.children: Dict[str, 'PathTrie'] = {}
+        self.size_kb: Optional[int] = None  # 该路径被保留时为其大小
+
+
+def filter_nested_paths(results: List[Dict]) -> List[Dict]:
+    """
+    过滤掉嵌套的路径，只保留最上层的目录
+    如果子目录大小与父目录相同或非常接近（差异<1%），则过滤掉子目录
+    
+    已保留的路径放在前缀树中，检查一个路径时只需沿着它的各级父目录走一遍，复杂度为 O(n × 深度)
+    """
+    filtered_results = []
+    size_threshold_ratio = 0.99  # 大小相似度阈值（99%）
+    trie = PathTrie()
+
+    # 按路径深度排序，确保先处理上层目录
+    sorted_results = sorted(results, key=lambda x: x['path'].count('/'))
+
+    for item in sorted_results:
+        parts = item['path'].split('/')
+        size_kb = item['size_kb']
+
+        # 检查各级父目录中是否有已保留且大小相似的
+        node = trie
+        nested = False
+        for part in parts[:-1]:
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.size_kb is not None and size_kb >= node.size_kb * size_threshold_ratio:
+                nested = True
+                break
+        if nested:
+            continue
+
+        filtered_results.append(item)
+        node = trie
+        for part in parts:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = PathTrie()
+            node = child
+        node.size_kb = size_kb
+
+    return filtered_results
+
+
+def scan_threshold_kb(total_size_gb: Optional[float]) -> int:
+    """大小门槛（KB）：磁盘总容量的 1%，不指定总容量时为 10GB"""
+    return int((total_size_gb * 0.01 if total_size_gb else 10) * 1024 * 1024)
+
+
+def rank_key(item: Dict) -> Tuple[int, str]:
+    """结果的排序键：大小降序，大小相同时按路径排列（父目录排在子路径前面），使并行扫描的结果顺序确定"""
+    return -item['size_kb'], item['path']
+
+
+def finalize_scan_results(results: List[Dict], limit: int) -> List[Dict]:
+    """过滤嵌套路径，用堆取出最大的 limit 个（按大小降序），并移除用于排序的 size_kb 字段"""
+    results = heapq.nsmallest(limit, filter_nested_paths(results), key=rank_key)
+    for item in results:
+        del item['size_kb']
+    return results
+
+
+class TopKPaths:
+    """
+    流式扫描结果的有界 top-k：结果与对全部条目调用 finalize_scan_results 相同，但只保留可能进入前 limit 个的条目
+
+    DirectoryScanner.iter_scan 自底向上返回条目，新到达的目录下面的条目都已经到达，它最多使其中一个大小相近的
+    条目被过滤掉，而它自己排在被过滤的条目前面，所以任意位置之前保留的条目数不会减少。排在第 limit 个保留条目
+    之后的条目不可能再进入最终结果，条目数翻倍时用堆选出第 limit 个保留条目，把其后的条目丢弃。
+    """
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit: 最终返回的条目数
+        """
+        self.limit = limit
+        self._items: List[Dict] = []
+        self._prune_at = 2 * max(limit, 1)
+
+    def add(self, item: Dict) -> None:
+        """加入一个带 path 和 size_kb 的条目"""
+        if self.limit <= 0:
+            return
+        self._items.append(item)
+        if len(self._items) >= self._prune_at:
+            self._prune()
+
+    def _prune(self) -> None:
+        kept = heapq.nsmallest(self.limit, filter_nested_paths(self._items), key=rank_key)
+        if len(kept) == self.limit:
+            cutoff = rank_key(kept[-1])
+            self._items = [item for item in self._items if rank_key(item) <= cutoff]
+        # 被过滤的条目较多、丢弃不了多少时，等条目数再翻倍再整理
+        self._prune_at = 2 * max(len(self._items), self.limit)
+
+    def results(self) -> List[Dict]:
+        """当前的前 limit 个条目（按大小降序，不含 size_kb），扫描未完成时为目前为止的排名"""
+        return finalize_scan_results([dict(item) for item in self._items], self.limit)
+
+
+class LargeFileScan:
+    """
+    流式扫描挂载点下的大文件和目录：条目一符合条件就返回，同时在有界的堆中维护最终排名，可以提前取消
+
+    Example:
+        scan = LargeFileScan('/data', total_size_gb=500)
+        for item in scan:
+            print(item)  # 按发现顺序，目录在其下内容汇总完成后返回
+            if 已经找到需要的内容:
+                break  # 取消扫描，还没读取的目录不再读取
+        print(scan.results())  # 扫描完成时与 scan_large_files_fast 的返回值相同
+    """
+
+    def __init__(self, mount_point: str, total_size_gb: Optional[float] = None, max_depth: int = 3,
+                 limit: int = 30, incremental: bool = False):
+        """
+        参数与 scan_large_files_fast 相同
+        """
+        # 确保mount_point没有末尾的斜杠
+        self.mount_point = mount_point.rstrip('/') or '/'
+        self.threshold_kb = scan_threshold_kb(total_size_gb)
+        self.max_depth = max_depth
+        self.incremental = incremental
+        self.scanner = DirectoryScanner()
+        self.top = TopKPaths(limit)
+        self.completed = False  # 是否扫描完整个目录树
+        self._entries: Optional[Iterator] = None
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        逐个返回符合条件的条目（与 scan_large_files_fast 的结果格式相同，不保证被嵌套路径过滤后保留）
+
+        Raises:
+            OSError: 挂载点不存在或无法访问
+        """
+        # 开启了 SCANNER_RECORD_HISTORY 时，不增量扫描也写入索引，记录 get_storage_growth 使用的大小历史
+        index = open_size_index() if self.incremental or SCANNER_RECORD_HISTORY else None
+        self._entries = self.scanner.iter_scan(self.mount_point, self.max_depth, self.threshold_kb,
+                                               index=index, reuse=self.incremental)
+        try:
+            for entry in self._entries:
+                # 跳过根目录
+                if entry.depth == 0:
+                    continue
+                item = {
+                    'path': entry.path[len(self.mount_point):].lstrip('/'),  # 使用相对路径
+                    'size': format_size(entry.size_kb),
+                    'size_kb': entry.size_kb,  # 用于排序
+                    'owner': owner_name(entry.uid),
+                    'modified_time': datetime.fromtimestamp(entry.mtime).strftime('%Y-%m-%d %H:%M:%S')
+                }
+                self.top.add(item)
+                yield {key: value for key, value in item.items() if key != 'size_kb'}
+            self.completed = not self.scanner.stats.get('cancelled', False)
+        finally:
+            self._entries.close()
+
+    def close(self) -> None:
+        """取消扫描"""
+        if self._entries is not None:
+            self._entries.close()
+
+    def results(self) -> List[Dict]:
+        """最大的 limit 个条目（过滤嵌套路径后按大小降序）"""
+        return self.top.results()
+
+
 def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = None, max_depth: int = 3,
-                          limit: int = 30) -> List[Dict]:
+                          limit: int = 30, incremental: bool = False,
+                          on_entry: Optional[Callable[[Dict], None]] = None,
+                          backend: Optional[str] = None) -> List[Dict]:
     """
-    使用 du 命令快速扫描指定挂载点下的大文件和目录
+    扫描指定挂载点下的大文件和目录：默认使用 du 命令（scan_large_files_du），backend 为 'scandir' 时在进程内
+    并行扫描（见 disk_scanner.py），两种方式的结果一致
     
     Args:
         mount_point: 挂载点路径
         total_size_gb: 磁盘总容量（GB），如果不指定则使用10GB作为基准
         max_depth: 最大递归深度，默认为3
         limit: 返回结果的最大数量，默认30
+        incremental: 是否使用目录大小索引，只重新扫描上次扫描后有变化的目录（见 size_index.py）。默认关闭：
+            索引发现不了小文件原地变大，最长 SCANNER_INDEX_MAX_AGE 后才会重新扫描，结果可能偏小
+        on_entry: 可选，每发现一个符合条件的条目就调用一次，用于在扫描完成前展示部分结果
+        backend: 'du' 或 'scandir'，默认由环境变量 SCANNER_BACKEND 指定；incremental 为 True 时总是使用 scandir
+    """
+    backend = 'scandir' if incremental else (backend or SCANNER_BACKEND)
+    if backend == 'du':
+        return scan_large_files_du(mount_point, total_size_gb, max_depth, limit, on_entry)
+
+    scan = LargeFileScan(mount_point, total_size_gb, max_depth, limit, incremental)
+    try:
+        for item in scan:
+            if on_entry is not None:
+                on_entry(item)
+    except OSError as e:
+        print(f"Error scanning {scan.mount_point}: {e}")
+        return []
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return []
+
+    return scan.results()
+
+
+def scan_large_files_du(mount_point: str, total_size_gb: Optional[float] = None, max_depth: int = 3,
+                        limit: int = 30, on_entry: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    使用 du 命令扫描指定挂载点下的大文件和目录（scan_large_files_fast 默认的扫描方式）
+    
+    开启 SCANNER_RECORD_HISTORY 时，根目录下 HISTORY_DEPTH 层以内、du 输出了的（不低于大小门槛的）目录的大小
+    会记录到索引中，供 get_storage_growth 使用；du 执行出错时结果可能偏小，不记录
+    
+    Args:
+        mount_point: 挂载点路径
+        total_size_gb: 磁盘总容量（GB），如果不指定则使用10GB作为基准
+        max_depth: 最大递归深度，默认为3
+        limit: 返回结果的最大数量，默认30
+        on_entry: 可选，每发现一个符合条件的条目就调用一次，用于在扫描完成前展示部分结果
     """
     # 确保mount_point没有末尾的斜杠
     mount_point = mount_point.rstrip('/')
 
     # 设置大小门槛（KB）
-    threshold_kb = int((total_size_gb * 0.01 if total_size_gb else 10) * 1024 * 1024)
+    threshold_kb = scan_threshold_kb(total_size_gb)
     results = []
+    history = [] if SCANNER_RECORD_HISTORY else None  # 记录大小历史的 (目录绝对路径, 大小字节数)
+    start_time = datetime.now().timestamp()
 
     def get_owner(path: str) -> str:
         """获取文件所有者"""
@@ -112,47 +390,6 @@ def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = Non
         except (OSError, KeyError):
             return "unknown"
 
-    def format_size(size_kb: float) -> str:
-        """将KB转换为人类可读的格式"""
-        size_bytes = size_kb * 1024
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f}{unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f}TB"
-
-    def filter_nested_paths(results: List[Dict]) -> List[Dict]:
-        """
-        过滤掉嵌套的路径，只保留最上层的目录
-        如果子目录大小与父目录相同或非常接近（差异<1%），则过滤掉子目录
-        """
-        filtered_results = []
-        size_threshold_ratio = 0.99  # 大小相似度阈值（99%）
-
-        # 按路径长度排序，确保先处理上层目录
-        sorted_results = sorted(results, key=lambda x: len(x['path'].split('/')))
-
-        def is_subpath_with_similar_size(path: str, size_kb: int, processed_paths: List[Dict]) -> bool:
-            """检查是否是已处理路径的子路径，且大小相似"""
-            for item in processed_paths:
-                parent_path = item['path']
-                if path.startswith(parent_path + '/'):
-                    # 计算大小比例
-                    size_ratio = size_kb / item['size_kb']
-                    if size_ratio >= size_threshold_ratio:
-                        return True
-            return False
-
-        for item in sorted_results:
-            path = item['path']
-            size_kb = item['size_kb']
-
-            # 检查是否是已处理路径的子路径且大小相似
-            if not is_subpath_with_similar_size(path, size_kb, filtered_results):
-                filtered_results.append(item)
-
-        return filtered_results
-
     try:
         cmd = [
             'du',
@@ -176,6 +413,8 @@ def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = Non
 
                 # 跳过根目录
                 if path == mount_point:
+                    if history is not None:
+                        history.append((os.path.abspath(path), size_kb * 1024))
                     continue
 
                 # 验证大小是否超过阈值
@@ -188,14 +427,20 @@ def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = Non
 
                     # 将路径转换为相对路径
                     relative_path = path[len(mount_point):].lstrip('/')
+                    if (history is not None and S_ISDIR(stat_info.st_mode)
+                            and relative_path.count('/') < HISTORY_DEPTH):
+                        history.append((os.path.abspath(path), size_kb * 1024))
 
-                    results.append({
+                    item = {
                         'path': relative_path,  # 使用相对路径
                         'size': format_size(size_kb),
                         'size_kb': size_kb,  # 用于排序
                         'owner': get_owner(path),
                         'modified_time': mtime.strftime('%Y-%m-%d %H:%M:%S')
-                    })
+                    }
+                    results.append(item)
+                    if on_entry is not None:
+                        on_entry({key: value for key, value in item.items() if key != 'size_kb'})
                 except (OSError, IOError) as e:
                     continue
 
@@ -207,21 +452,10 @@ def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = Non
         if process.returncode != 0:
             stderr = process.stderr.read()
             print(f"Error running du command: {stderr}")
+        elif history is not None:
+            record_history(history, start_time)
 
-        # 按大小降序排序
-        results.sort(key=lambda x: x['size_kb'], reverse=True)
-
-        # 过滤嵌套路径
-        results = filter_nested_paths(results)
-
-        # 限制结果数量
-        results = results[:limit]
-
-        # 移除size_kb字段
-        for item in results:
-            del item['size_kb']
-
-        return results
+        return finalize_scan_results(results, limit)
 
     except subprocess.CalledProcessError as e:
         print(f"Error executing du command: {e}")
@@ -231,6 +465,70 @@ def scan_large_files_fast(mount_point: str, total_size_gb: Optional[float] = Non
         return []
 
 
+def record_history(history: List[Tuple[str, int]], scanned_at: float) -> None:
+    """把一次扫描的目录大小写入索引的历史记录，写入失败时只打印错误，不影响扫描结果"""
+    index = open_size_index()
+    if index is None:
+        return
+    try:
+        index.apply([], history, scanned_at)
+    except sqlite3.Error as e:
+        print(f"记录目录大小历史失败: {e}")
+
+
+def get_storage_growth(path: str, days: int = 30) -> Dict:
+    """
+    根据历次扫描记录的目录大小，返回存储空间的增长趋势
+    
+    只有开启 SCANNER_RECORD_HISTORY（或增量扫描）时用 scan_large_files_fast 扫描过（path 在扫描根目录下两层以内）
+    的目录才有记录，至少需要两次扫描；使用 du 扫描时只记录不低于大小门槛的目录
+    
+    Args:
+        path: 目录路径
+        days: 使用最近多少天的记录
+        
+    Returns:
+        Dict: {
+            'path': str,
+            'samples': [{'time': str, 'size_gb': float}, ...],  # 按时间排列
+            'growth_gb_per_day': Optional[float],  # 最小二乘拟合的日增长量，记录少于两次时为 None
+            'free_gb': Optional[float],  # 所在文件系统的剩余空间
+            'days_until_full': Optional[float]  # 按当前增长速度，剩余空间用完的天数（不增长时为 None）
+        }
+    """
+    path = os.path.abspath(path)
+    samples = get_size_index().growth(path, datetime.now().timestamp() - days * 86400)
+    result = {
+        'path': path,
+        'samples': [
+            {'time': datetime.fromtimestamp(scanned_at).strftime('%Y-%m-%d %H:%M:%S'),
+             'size_gb': round(size / 1024 ** 3, 3)}
+            for scanned_at, size in samples
+        ],
+        'growth_gb_per_day': None,
+        'free_gb': None,
+        'days_until_full': None
+    }
+    try:
+        stat_result = os.statvfs(path)
+        result['free_gb'] = round(stat_result.f_bavail * stat_result.f_frsize / 1024 ** 3, 3)
+    except OSError:
+        pass
+
+    if len(samples) >= 2:
+        times = [scanned_at / 86400 for scanned_at, _ in samples]
+        sizes = [size / 1024 ** 3 for _, size in samples]
+        mean_time = sum(times) / len(times)
+        mean_size = sum(sizes) / len(sizes)
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if variance > 0:
+            slope = sum((t - mean_time) * (s - mean_size) for t, s in zip(times, sizes)) / variance
+            result['growth_gb_per_day'] = round(slope, 3)
+            if slope > 0 and result['free_gb'] is not None:
+                result['days_until_full'] = round(result['free_gb'] / slope, 1)
+    return result
+
+
 def get_gpu_info() -> Dict:
     """
     获取GPU信息并返回结构化数据
@@ -1,4 +1,10 @@
-from langchain_openai import ChatOpenAI
+import os
+import sys
+
+# 模型客户端与 interaction/pythonic 共用同一份实现（model_client.py），按本文件的位置找到它，不依赖当前工作目录；
+# 追加到搜索路径末尾，本目录的同名模块（model.py 等）优先
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pythonic'))
+from model_client import create_chat_model
 
 
 codegeex_private_32b = {
@@ -43,5 +49,6 @@ hunyuan_model = {
 }
 
 
-chat = ChatOpenAI(**codegeex_private_32b)
-suggest = ChatOpenAI(**glm4)
\ No newline at end of file
+# 所有模型实例共用 model_client 中的连接池
+chat = create_chat_model(**codegeex_private_32b)
+suggest = create_chat_model(**glm4)
\ No newline at end of file
@@ -1,4 +1,5 @@
-from typing import Dict, TypedDict, Annotated, List, Optional
+from typing import Callable, Dict, TypedDict, Annotated, List, Optional
+from functools import partial
 from datetime import datetime
 from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
 from langgraph.graph import StateGraph
@@ -6,7 +7,7 @@ from langgraph.graph.message import add_messages
 from time import time
 import json
 
-from handlers import get_disk_usage, scan_large_files_fast, get_gpu_info, get_process_info
+from handlers import get_disk_usage, scan_large_files_fast, get_storage_growth, get_gpu_info, get_process_info
 from model import chat
 
 # 定义函数 schema
@@ -20,18 +21,32 @@ functions_schema = '''
         - total_gb: 总容量(GB)
         - used_gb: 已用容量(GB)
         - usage_percent: 使用百分比
-        - filesystem: 文件系统
+        - filesystem: 文件系统（设备）
+        - fstype: 文件系统类型
+        - total_bytes / used_bytes / available_bytes: 精确的总容量、已用、可用字节数
 
-2. scan_large_files_fast(mount_point: str, total_size_gb: float = None, max_depth: int = 3, limit: int = 30)
+2. scan_large_files_fast(mount_point: str, total_size_gb: float = None, max_depth: int = 3, limit: int = 30, incremental: bool = False)
    功能: 快速扫描指定挂载点下的大文件和目录
    参数：
         - mount_point: 挂载点路径
         - total_size_gb: 磁盘总容量（GB），不指定则使用10GB作为基准
         - max_depth: 最大递归深度，默认为3
         - limit: 返回结果的最大数量，默认30
+        - incremental: 是否只重新扫描上次扫描后有变化的目录（更快，但原地变大的小文件可能要几天后才反映出来），默认False
    返回: 大文件和目录列表
 
-3. get_gpu_info()
+3. get_storage_growth(path: str, days: int = 30)
+   功能: 根据历次 scan_large_files_fast 扫描记录的目录大小，返回存储空间增长趋势（需开启 SCANNER_RECORD_HISTORY；path 需在扫描根目录下两层以内，且大小不低于扫描的门槛）
+   参数：
+        - path: 目录路径
+        - days: 使用最近多少天的记录，默认30
+   返回: 增长趋势字典：
+        - samples: 历次扫描的大小列表（time、size_gb）
+        - growth_gb_per_day: 日增长量(GB)，记录不足两次时为None
+        - free_gb: 所在文件系统的剩余空间(GB)
+        - days_until_full: 按当前增长速度剩余空间用完的天数
+
+4. get_gpu_info()
    功能: 获取GPU信息并返回结构化数据
    返回: 包含所有GPU信息的字典：
         - timestamp: 时间戳
@@ -45,7 +60,7 @@ functions_schema = '''
             - memory: 内存使用情况
             - processes: 进程列表
 
-4. get_process_info(pid_list: List[int])
+5. get_process_info(pid_list: List[int])
    功能: 获取指定PID列表的进程信息
    参数：
         - pid_list: PID列表
@@ -68,6 +83,7 @@ class GraphState(TypedDict):
     used_functions: List[str]  # 使用的函数列表
     start_time: float  # 开始时间
     end_time: float  # 结束时间
+    on_partial: Optional[Callable[[Dict], None]]  # 可选，扫描过程中每发现一个大文件/目录就调用一次
 
 def extract_python_code(text: str) -> str:
     """从文本中提取Python代码"""
@@ -122,10 +138,15 @@ def code_generator(state: GraphState) -> GraphState:
 
 def code_executor(state: GraphState) -> GraphState:
     """执行代码的节点"""
+    # 扫描过程中发现的条目转发给调用方，不用等代码执行完才能看到结果
+    on_partial = state.get('on_partial')
+    scan_function = partial(scan_large_files_fast, on_entry=on_partial) if on_partial else scan_large_files_fast
+
     # 准备全局上下文
     global_context = {
         'get_disk_usage': get_disk_usage,
-        'scan_large_files_fast': scan_large_files_fast,
+        'scan_large_files_fast': scan_function,
+        'get_storage_growth': get_storage_growth,
         'get_gpu_info': get_gpu_info,
         'get_process_info': get_process_info,
         'datetime': datetime,
@@ -137,7 +158,7 @@ def code_executor(state: GraphState) -> GraphState:
     
     # 记录使用的函数
     used_functions = []
-    for func_name in ['get_disk_usage', 'scan_large_files_fast', 'get_gpu_info', 'get_process_info']:
+    for func_name in ['get_disk_usage', 'scan_large_files_fast', 'get_storage_growth', 'get_gpu_info', 'get_process_info']:
         if func_name in state['generated_code']:
             used_functions.append(func_name)
     
@@ -165,8 +186,14 @@ def create_graph():
     # 编译图
     return builder.compile()
 
-def process_request(request: str) -> Dict:
-    """处理用户请求并返回结果"""
+def process_request(request: str, on_partial: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    处理用户请求并返回结果
+
+    Args:
+        request: 用户请求
+        on_partial: 可选，生成的代码扫描大文件时，每发现一个符合条件的条目就调用一次（参数与结果中的条目格式相同）
+    """
     # 创建图
     graph = create_graph()
     
@@ -179,7 +206,8 @@ def process_request(request: str) -> Dict:
         'execution_result': None,
         'used_functions': [],
         'start_time': time(),
-        'end_time': 0
+        'end_time': 0,
+        'on_partial': on_partial
     }
     
     # 执行图
@@ -241,6 +269,6 @@ if __name__ == "__main__":
     for i, request in enumerate(test_requests, 1):
         print(f"\n=== 测试用例 {i} ===")
         print(f"请求: {request}")
-        result = process_request(request)
+        result = process_request(request, on_partial=lambda item: print(f"  发现: {item['path']} {item['size']}"))
         print(json.dumps(result, indent=2, ensure_ascii=False))
         print("="*50)
@@ -0,0 +1,233 @@
+"""
+持久化的目录大小索引
+
+资源助手经常反复询问"/data 下最大的目录"一类的问题，每次都要重新扫描整棵目录树。SizeIndex 把每个目录的扫描
+结果存到 sqlite 中（以路径为键，记录目录的 mtime/ctime），DirectoryScanner 带上索引扫描时：
+- 目录的 mtime/ctime 与索引中的相同（目录下没有增删改名），不再 scandir 读取其中的文件，直接复用索引中的
+  文件合计和大文件列表，只 lstat 索引中记录的子目录，检查它们是否变化
+- 目录变化时重新扫描其中的条目，更新索引，删除已经不存在的子目录的记录
+
+所以再次扫描基本静态的卷时，每个目录只需要一次 lstat。注意目录的 mtime 只在其中的条目增删改名时变化，
+发现不了文件原地写入变大：复用目录前会重新 lstat 索引中记录的大文件（不小于 INDEX_FILE_MIN_KB），有变化时重新扫描；
+更小的文件原地变大仍然发现不了，超过 INDEX_MAX_AGE 秒没有完整扫描过的目录会重新扫描。
+
+每次扫描还会记录扫描根目录下 HISTORY_DEPTH 层以内目录的大小，growth 据此返回存储空间的增长趋势。
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 索引文件的位置
+INDEX_PATH = os.getenv('SCANNER_INDEX_PATH',
+                       os.path.join(os.path.expanduser('~'), '.cache', 'pythonic_scaner', 'size_index.db'))
+# 索引只记录不小于该大小（KB）的文件，扫描门槛低于它时目录仍然需要重新扫描
+INDEX_FILE_MIN_KB = 1024
+# 目录距离上次完整扫描超过该时间（秒）时重新扫描，发现原地变大的文件
+INDEX_MAX_AGE = float(os.getenv('SCANNER_INDEX_MAX_AGE', str(7 * 24 * 3600)))
+# 记录大小历史的目录深度（相对扫描根目录）
+HISTORY_DEPTH = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER,
+    files_size INTEGER,  -- 目录中直接包含的文件的合计（字节）
+    file_count INTEGER,
+    total_size INTEGER,  -- 目录下所有内容的合计（字节）
+    scanned_at REAL  -- 上次完整扫描（scandir）的时间
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    dir TEXT,
+    name TEXT,
+    size INTEGER,
+    uid INTEGER,
+    mtime REAL,
+    PRIMARY KEY (dir, name)
+);
+CREATE TABLE IF NOT EXISTS history (
+    path TEXT,
+    scanned_at REAL,
+    total_size INTEGER,
+    PRIMARY KEY (path, scanned_at)
+);
+"""
+
+
+class DirRecord(NamedTuple):
+    """索引中的目录"""
+    path: str
+    mtime_ns: int
+    ctime_ns: int
+    files_size: int
+    file_count: int
+    total_size: int
+    scanned_at: float
+
+
+class FileRecord(NamedTuple):
+    """索引中的大文件"""
+    name: str
+    size: int
+    uid: int
+    mtime: float
+
+
+class DirUpdate(NamedTuple):
+    """一次扫描后要写入索引的目录"""
+    path: str
+    parent: Optional[str]
+    mtime_ns: int
+    ctime_ns: int
+    files_size: int
+    file_count: int
+    total_size: int
+    scanned_at: float
+    files: Optional[List[FileRecord]]  # 重新扫描过的目录中的大文件；复用索引时为 None（不改动）
+    removed: List[str]  # 重新扫描时发现已经不存在的子目录
+
+
+def subtree_pattern(path: str) -> str:
+    """匹配 path 下所有路径的 LIKE 模式"""
+    escaped = path.rstrip('/').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
+
+
+class SizeIndex:
+    """
+    sqlite 中的目录大小索引，可以在多个扫描线程中使用
+
+    Example:
+        index = SizeIndex()
+        entries = DirectoryScanner().scan('/data', 3, threshold_kb, index=index)
+        print(index.growth('/data'))
+    """
+
+    def __init__(self, db_path: str = INDEX_PATH, file_min_kb: int = INDEX_FILE_MIN_KB,
+                 max_age: float = INDEX_MAX_AGE):
+        """
+        Args:
+            db_path: 索引文件路径，":memory:" 表示不持久化
+            file_min_kb: 索引记录的文件的最小大小（KB）
+            max_age: 目录超过该时间（秒）没有完整扫描时重新扫描
+        """
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.file_min_kb = file_min_kb
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def lookup(self, path: str) -> Optional[DirRecord]:
+        """索引中的目录记录，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, mtime_ns, ctime_ns, files_size, file_count, total_size, scanned_at "
+                "FROM dirs WHERE path = ?", (path,)
+            ).fetchone()
+        return DirRecord(*row) if row else None
+
+    def children(self, path: str) -> List[str]:
+        """索引中记录的子目录路径"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT path FROM dirs WHERE parent = ?", (path,))]
+
+    def large_files(self, path: str) -> List[FileRecord]:
+        """索引中记录的目录中的大文件"""
+        with self._lock:
+            return [FileRecord(*row) for row in self._conn.execute(
+                "SELECT name, size, uid, mtime FROM files WHERE dir = ?", (path,)
+            )]
+
+    def is_fresh(self, record: Optional[DirRecord], stat_result: os.stat_result, threshold_kb: int) -> bool:
+        """目录自上次扫描以来没有变化，可以复用索引中的记录"""
+        return (record is not None
+                and record.mtime_ns == stat_result.st_mtime_ns
+                and record.ctime_ns == stat_result.st_ctime_ns
+                and threshold_kb >= self.file_min_kb
+                and time.time() - record.scanned_at < self.max_age)
+
+    def apply(self, updates: List[DirUpdate], history: List[Tuple[str, int]], scanned_at: float) -> None:
+        """
+        在一个事务中写入一次扫描的结果
+
+        Args:
+            updates: 新扫描或大小变化的目录
+            history: 要记录历史的 (目录, 大小)
+            scanned_at: 扫描时间
+        """
+        with self._lock, self._conn:
+            for update in updates:
+                for removed in update.removed:
+                    pattern = subtree_pattern(removed)
+                    self._conn.execute("DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                                       (removed, pattern))
+                    self._conn.execute("DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'",
+                                       (removed, pattern))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns, ctime_ns, files_size, file_count, total_size, "
+                "scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [update[:8] for update in updates]
+            )
+            for update in updates:
+                if update.files is None:
+                    continue
+                self._conn.execute("DELETE FROM files WHERE dir = ?", (update.path,))
+                self._conn.executemany(
+                    "INSERT INTO files (dir, name, size, uid, mtime) VALUES (?, ?, ?, ?, ?)",
+                    [(update.path, *item) for item in update.files]
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO history (path, scanned_at, total_size) VALUES (?, ?, ?)",
+                [(path, scanned_at, size) for path, size in history]
+            )
+
+    def biggest_dirs(self, path: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """
+        索引中 path 的直接子目录按大小降序排列（不扫描，反映上次扫描时的情况）
+
+        Returns:
+            [(目录路径, 大小字节数), ...]
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, total_size FROM dirs WHERE parent = ? ORDER BY total_size DESC LIMIT ?",
+                (path.rstrip('/') or '/', limit)
+            ).fetchall()
+
+    def growth(self, path: str, since: Optional[float] = None) -> List[Tuple[float, int]]:
+        """
+        目录大小的历史记录
+
+        Args:
+            path: 目录路径（需要在某次扫描根目录下 HISTORY_DEPTH 层以内）
+            since: 可选，只返回该时间之后的记录
+
+        Returns:
+            按时间排列的 [(扫描时间, 大小字节数), ...]
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT scanned_at, total_size FROM history WHERE path = ? AND scanned_at >= ? ORDER BY scanned_at",
+                (path.rstrip('/') or '/', since or 0)
+            ).fetchall()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'dirs': self._conn.execute("SELECT COUNT(*) FROM dirs").fetchone()[0],
+                'files': self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                'history': self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()